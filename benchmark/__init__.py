@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+The scraper benchmark. This replays recorded HTTP responses through the
+scraper definitions we ship so that we can measure how fast the scraper
+itself is, without the network. See benchmark.bench for how to run it.
+"""
+
+from benchmark.bench import *
@@ -0,0 +1,1087 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Benchmark the scraper against the scraper definitions we ship.
+
+For every definition under scraper/scrapers/video that our Scraper
+supports (see Registry.entries()) and that has a recording in
+benchmark/fixtures we load the definition and run a lookup of the
+recorded title through Scraper.lookup(), get_details() (and the movie's
+custom functions), get_episode_list() and Episode.get_details(),
+answering every request the scraper makes with the recorded response
+instead of going to the network. We report how many complete lookups
+per second we can do, the latency percentiles of each of those
+functions and the peak memory of the process that did them, and
+compare all of that with the stored baseline.
+
+Timings are only comparable on the same machine, so a baseline notes
+the machine it was made on. Against a baseline made on another one we
+report the changes but do not call any of them a regression: make a
+baseline of your own first with --save-baseline (and --baseline, to
+keep it out of the source tree.) Even on the same machine a function
+is only called slower if its median moved by more than both the
+threshold and the spread of its timings allow (see compare())
+
+Run it from the top of the source tree:
+
+    python -m benchmark.bench                    # every recorded definition
+    python -m benchmark.bench video/imdb.xml     # just the ones given
+    python -m benchmark.bench --save-baseline    # make this run the baseline
+
+Recordings are made, over the network, with:
+
+    python -m benchmark.bench --record [--title 'The Matrix'] video/imdb.xml
+
+or, without the network, with:
+
+    python -m benchmark.bench --synthesize video/imdb.xml
+
+which answers each request with a synthetic page for the function that
+parses it: a sample of the text each of that function's expressions
+matches, in the middle of filler markup that brings it up to the size
+of a real page. Those are the recordings we ship, so that the benchmark
+runs the same everywhere.
+
+Each recording is a JSON file, benchmark/fixtures/<definition>.json,
+holding the title that was looked up and every response that was
+received while doing so.
+
+The definitions under scraper/scrapers/music, and the music video ones
+under scraper/scrapers/video, are for content our Scraper does not
+support (albums and music videos) so they are not benchmarked.
+"""
+
+# system imports
+#
+import sys
+import os
+import time
+import re
+import json
+import base64
+import optparse
+import logging
+import resource
+import platform
+import threading
+import sre_parse
+import sre_constants
+import multiprocessing
+import xml.etree.ElementTree as ElementTree
+from timeit import default_timer
+
+#
+import scraper
+
+# Where the definitions we benchmark, their recordings and our baseline
+# are.
+#
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRAPERS_DIR = os.path.join(TOP_DIR, "scraper", "scrapers")
+DEFINITION_DIRS = ("video",)
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures")
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "baseline.json")
+
+# The title we record a lookup of when we are not given one, by the
+# content of the definition.
+#
+DEFAULT_TITLES = { "movies"  : "The Matrix",
+                   "tvshows" : "Battlestar Galactica" }
+
+# The title we look up in a synthesized recording, the content type of
+# its pages, about how big each one is (a page of IMDb is 50 to 150KB)
+# and the markup we pad them out to that size with.
+#
+SYNTHETIC_TITLE = "Synthetic"
+SYNTHETIC_CONTENT_TYPE = "text/html; charset=utf-8"
+SYNTHETIC_PAGE_BYTES = 64 * 1024
+FILLER = '<div class="filler"><p>Lorem ipsum dolor sit amet, consectetur ' \
+    'adipiscing elit, sed do eiusmod tempor incididunt.</p></div>\n'
+
+# The function of a definition that parses the pages each of the steps of
+# a lookup we time asks for (see run_lookup()). The pages asked for by
+# the custom functions that Movie.resolve() runs are parsed by the
+# function their <url> names.
+#
+STEP_FUNCTIONS = { "lookup" : "getsearchresults",
+                   "get_details" : "getdetails",
+                   "resolve" : "getdetails",
+                   "get_episode_list" : "getepisodelist",
+                   "episode_get_details" : "getepisodedetails" }
+
+# The character we put in a synthetic page for each character class.
+#
+SAMPLE_CATEGORIES = { sre_constants.CATEGORY_DIGIT : u"1",
+                      sre_constants.CATEGORY_SPACE : u" " }
+
+# The functions we time, in the order we report them.
+#
+FUNCTIONS = ("load", "lookup", "get_details", "resolve",
+             "get_episode_list", "episode_get_details")
+
+# The percentiles of each function's latency we report, and those we
+# also keep to measure how much its timings spread.
+#
+PERCENTILES = (50, 90, 99)
+SPREAD_PERCENTILES = (25, 75)
+
+# By default how many times we run each lookup (after one run to warm
+# up), and how much slower than the baseline a function's median
+# latency has to be before we call it a regression. It also has to be
+# slower by more than NOISE times the spread of its timings (see
+# compare())
+#
+ITERATIONS = 50
+THRESHOLD = 0.10
+NOISE = 2.0
+
+##################################################################
+##################################################################
+#
+class NoRecording(scraper.FetchFailed):
+    """
+    Raised when a replayed lookup makes a request that is not in its
+    recording.
+    """
+    def __init__(self, value = "No recorded response"):
+        self.value = value
+    def __str__(self):
+        return "NoRecording: %s" % self.value
+
+####################################################################
+#
+def to_str(value):
+    """
+    Return the given string as a str, encoding it as utf-8 if it is
+    unicode. None is returned as the empty string.
+
+    Arguments:
+    - `value`: The string.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+####################################################################
+#
+def request_id(method, url, data):
+    """
+    Return what a recorded response is looked up by: the method, url and
+    POST data of the request it is the response to.
+
+    Arguments:
+    - `method`: 'GET' or 'POST'
+    - `url`: The absolute url of the request.
+    - `data`: The body of a POST request, or None.
+    """
+    return (to_str(method), to_str(url), to_str(data))
+
+####################################################################
+#
+def definition_name(path):
+    """
+    Return the name we know a definition by: its path relative to the
+    scraper/scrapers directory, ie: 'video/imdb.xml'
+
+    Arguments:
+    - `path`: The path of the definition's XML file.
+    """
+    return os.path.relpath(os.path.abspath(path),
+                           SCRAPERS_DIR).replace(os.sep, "/")
+
+####################################################################
+#
+def fixture_file(name):
+    """
+    Return the path of the recording of the given definition.
+
+    Arguments:
+    - `name`: The name of the definition (see definition_name())
+    """
+    return os.path.join(FIXTURES_DIR,
+                        os.path.splitext(name)[0].replace("/", os.sep) + \
+                            ".json")
+
+####################################################################
+#
+def all_definitions():
+    """
+    Return the names of all of the definitions we ship that our Scraper
+    supports, sorted.
+    """
+    names = []
+    for entry in scraper.registry.entries(supported = True):
+        if entry["file"].split("/")[0] in DEFINITION_DIRS:
+            names.append(entry["file"])
+    return sorted(names)
+
+####################################################################
+#
+def percentile(values, p):
+    """
+    Return the p'th percentile of the given values, by the nearest rank
+    method. None if there are no values.
+
+    Arguments:
+    - `values`: A list of numbers.
+    - `p`: The percentile we want, from 0 to 100.
+    """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    rank = int(round(p / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+####################################################################
+#
+def machine():
+    """
+    Return a dict describing the machine we are running on, enough to
+    tell whether timings made elsewhere are comparable with ours.
+    """
+    try:
+        cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpus = None
+    return { "node" : platform.node(),
+             "platform" : platform.platform(),
+             "processor" : platform.processor() or platform.machine(),
+             "python" : platform.python_version(),
+             "cpus" : cpus }
+
+####################################################################
+#
+def spread(latencies):
+    """
+    Return how much the timings of a function spread: the distance
+    between their 25th and 75th percentiles as a fraction of their
+    median. 0 if we did not keep those percentiles (a baseline made
+    before we did.)
+
+    Arguments:
+    - `latencies`: The dict of percentiles of a function's latency.
+    """
+    if not latencies.get("p50") or "p25" not in latencies or \
+            "p75" not in latencies:
+        return 0.0
+    return (latencies["p75"] - latencies["p25"]) / latencies["p50"]
+
+####################################################################
+#
+def peak_rss_kb():
+    """
+    Return the peak resident set size of this process in kilobytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports this in kilobytes, OS X in bytes.
+    #
+    if sys.platform == "darwin":
+        peak /= 1024
+    return peak
+
+##################################################################
+##################################################################
+#
+class ReplayResponse(object):
+    """
+    A recorded response, with as much of the interface of the responses
+    HTTPSession.open() returns as the Fetcher uses.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, status, content_type, body):
+        """
+        Arguments:
+        - `status`: The HTTP status of the response.
+        - `content_type`: The Content-Type header of the response.
+        - `body`: The (uncompressed) body of the response.
+        """
+        self.status = status
+        self.reason = ""
+        self.content_type = content_type
+        self.body = body
+
+    ##################################################################
+    #
+    def getheader(self, name, default = None):
+        if name.lower() == "content-type" and self.content_type:
+            return self.content_type
+        return default
+
+##################################################################
+##################################################################
+#
+class ReplaySession(object):
+    """
+    Stands in for the HTTPSession of a Fetcher. Every request is answered
+    with the response recorded for it. A request that was made more than
+    once while recording gets the responses recorded for it in the order
+    they were received (the last one once they run out) until we are
+    rewound. A request that was not recorded raises NoRecording.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, responses):
+        """
+        Arguments:
+        - `responses`: The list of recorded responses, as they are kept in
+                       a recording (see RecordingSession.entries)
+        """
+        self.lock = threading.Lock()
+        self.responses = { }
+        for entry in responses:
+            key = request_id(entry["method"], entry["url"], entry["data"])
+            self.responses.setdefault(key, []).append(
+                (entry["status"], to_str(entry["content_type"]),
+                 base64.b64decode(entry["body"])))
+        self.rewind()
+
+    ##################################################################
+    #
+    def rewind(self):
+        """
+        Start replaying from the first response recorded for each
+        request again. We are rewound before each lookup.
+        """
+        with self.lock:
+            self.answered = { }
+        return
+
+    ##################################################################
+    #
+    def open(self, method, url, data = None, headers = { }):
+        key = request_id(method, url, data)
+        with self.lock:
+            responses = self.responses.get(key)
+            if responses is None:
+                raise NoRecording("%s %s" % (method, url))
+            count = self.answered.get(key, 0)
+            self.answered[key] = count + 1
+        status, content_type, body = responses[min(count,
+                                                   len(responses) - 1)]
+        if status >= 400:
+            raise scraper.FetchFailed("%s %s: %d" % (method, url, status))
+        return ReplayResponse(status, content_type, body)
+
+    ##################################################################
+    #
+    def close(self):
+        return
+
+##################################################################
+##################################################################
+#
+class RecordingSession(scraper.HTTPSession):
+    """
+    An HTTPSession that keeps a copy of every response it gets so that
+    they can be written out as a recording.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, *args, **kwargs):
+        scraper.HTTPSession.__init__(self, *args, **kwargs)
+        self.entries = []
+
+    ##################################################################
+    #
+    def open(self, method, url, data = None, headers = { }):
+        response = scraper.HTTPSession.open(self, method, url, data,
+                                            headers)
+
+        # A spooled response's body is a file. We read it for our copy
+        # and then put it back the way it was for the Fetcher.
+        #
+        body = response.body
+        if not isinstance(body, basestring):
+            content = body.read()
+            body.seek(0)
+            body = content
+        with self.lock:
+            self.entries.append({
+                    "method" : method,
+                    "url" : to_str(url),
+                    "data" : to_str(data),
+                    "status" : response.status,
+                    "content_type" : response.getheader("Content-Type", ""),
+                    "body" : base64.b64encode(body) })
+        return response
+
+####################################################################
+#
+def sample(tree, out):
+    """
+    Append to `out` a piece of text that the parsed regular expression
+    `tree` matches, or comes close to matching: one pass through each
+    repeat (up to three for those that must repeat), the first choice of
+    each alternation and set, and nothing for an assertion.
+
+    Arguments:
+    - `tree`: The sre_parse.parse() result, or part of it.
+    - `out`: The list of unicode strings to append to.
+    """
+    for op, av in tree:
+        if op == sre_constants.LITERAL:
+            out.append(unichr(av))
+        elif op == sre_constants.NOT_LITERAL:
+            out.append(u"y" if av == ord("x") else u"x")
+        elif op == sre_constants.ANY:
+            out.append(u"x")
+        elif op == sre_constants.IN:
+            out.append(sample_in(av))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            low, high, sub = av
+            if high != 0:
+                for i in range(min(max(low, 1), 3)):
+                    sample(sub, out)
+        elif op == sre_constants.SUBPATTERN:
+            sample(av[1], out)
+        elif op == sre_constants.BRANCH:
+            sample(av[1][0], out)
+        elif op == sre_constants.CATEGORY:
+            out.append(SAMPLE_CATEGORIES.get(av, u"a"))
+        elif op == sre_constants.GROUPREF:
+            out.append(u"a")
+    return
+
+####################################################################
+#
+def sample_in(items):
+    """
+    Return a character that the parsed set `items` ('[...]') matches.
+
+    Arguments:
+    - `items`: The arguments of an sre_parse IN op.
+    """
+    if any(op == sre_constants.NEGATE for op, av in items):
+        excluded = set()
+        for op, av in items:
+            if op == sre_constants.LITERAL:
+                excluded.add(av)
+            elif op == sre_constants.RANGE:
+                excluded.update(range(av[0], av[1] + 1))
+        for c in u"xyz019 ":
+            if ord(c) not in excluded:
+                return c
+        return u""
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            return unichr(av)
+        if op == sre_constants.RANGE:
+            return unichr(av[0])
+        if op == sre_constants.CATEGORY:
+            return SAMPLE_CATEGORIES.get(av, u"a")
+    return u""
+
+####################################################################
+#
+def function_samples(scraper_xml):
+    """
+    Return a list of the functions of the given definition, as the
+    tuple (name, samples): the name of the function's tag and a sample
+    of the text each of its expressions matches (see sample())
+
+    Arguments:
+    - `scraper_xml`: The XML scraper definition.
+    """
+    functions = []
+    for function in ElementTree.fromstring(scraper_xml):
+        samples = []
+        for expression in function.iter("expression"):
+            if not expression.text:
+                continue
+            out = []
+            try:
+                sample(sre_parse.parse(scraper.template_re.sub(
+                            lambda m: m.group(3) and "\n" or "",
+                            expression.text), re.DOTALL), out)
+            except (sre_constants.error, ValueError, OverflowError):
+                continue
+            samples.append(u"".join(out))
+        functions.append((function.tag, samples))
+    return functions
+
+####################################################################
+#
+def pad(samples, size):
+    """
+    Return a synthetic page: the given samples, one after the other, in
+    the middle of as much FILLER as it takes to make it about `size`
+    bytes long, encoded as utf-8.
+
+    Arguments:
+    - `samples`: The list of samples (see sample())
+    - `size`: About how many bytes long the page is.
+    """
+    content = u"\n<br>\n".join(samples).encode("utf-8")
+    filler = FILLER * max(0, (size - len(content)) / (2 * len(FILLER)))
+    return filler + content + "\n" + filler
+
+####################################################################
+#
+def well_formed(s, function, page):
+    """
+    Return True if what the given function of a definition makes of the
+    given page, with its default settings, is nothing, or well formed
+    XML.
+
+    Arguments:
+    - `s`: The Scraper of the definition.
+    - `function`: The name of the function.
+    - `page`: The page, as pad() returns it.
+    """
+    try:
+        output = s.parser.parse(function, s.settings,
+                                [page.decode("utf-8"), "12345", "12345"])
+        if output.strip():
+            scraper.parse_xml(output)
+    except Exception:
+        return False
+    return True
+
+####################################################################
+#
+def synthetic_pages(scraper_xml, size = SYNTHETIC_PAGE_BYTES):
+    """
+    Return a dict of the synthetic page of each function of the given
+    definition, by its name in lower case (see pad()) Each has samples
+    of its function's expressions (see function_samples()).
+
+    A page only has the samples of the function that parses it, and
+    only those that keep what the function makes of it well formed (see
+    well_formed()) The samples of expressions that are meant for
+    different pages, or different parts of one, can match each other,
+    a greedy '.*' or '[^(]*' can run across several of them, and then
+    a function's output may have unbalanced tags.
+
+    Arguments:
+    - `scraper_xml`: The XML scraper definition.
+    - `size`: About how many bytes long each page is.
+    """
+    s = scraper.Scraper(scraper_xml, definition_cache = None)
+    pages = { }
+    for name, samples in function_samples(scraper_xml):
+        kept = []
+        for sample_text in samples:
+            if well_formed(s, name, pad(kept + [sample_text], size)):
+                kept.append(sample_text)
+        pages[name.lower()] = pad(kept, size)
+    return pages
+
+##################################################################
+##################################################################
+#
+class SynthesizingSession(object):
+    """
+    Stands in for the HTTPSession of a Fetcher, answering each request
+    with the synthetic page (see synthetic_pages()) of the function that
+    parses its response, and keeping a copy of each response the way
+    RecordingSession does.
+
+    Which function that is we are told: by our SynthesizingFetcher for
+    the pages of custom functions and otherwise by whoever sets our
+    'step' to the step of the lookup (see run_lookup()) that is being
+    run.
+
+    A request that has been answered before gets an empty page. A
+    custom function may find a link to itself in its synthetic page,
+    which would otherwise go on for ever.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, pages):
+        """
+        Arguments:
+        - `pages`: The dict of synthetic pages, by function.
+        """
+        self.pages = pages
+        self.step = None
+        self.lock = threading.Lock()
+        self.functions = { }
+        self.answered = set()
+        self.entries = []
+
+    ##################################################################
+    #
+    def open(self, method, url, data = None, headers = { }):
+        key = request_id(method, url, data)
+        with self.lock:
+            body = ""
+            if key not in self.answered:
+                self.answered.add(key)
+                function = self.functions.get(key[1],
+                                              STEP_FUNCTIONS.get(self.step))
+                body = self.pages.get(function, "")
+            self.entries.append({
+                    "method" : method,
+                    "url" : to_str(url),
+                    "data" : to_str(data),
+                    "status" : 200,
+                    "content_type" : SYNTHETIC_CONTENT_TYPE,
+                    "body" : base64.b64encode(body) })
+        return ReplayResponse(200, SYNTHETIC_CONTENT_TYPE, body)
+
+    ##################################################################
+    #
+    def close(self):
+        return
+
+##################################################################
+##################################################################
+#
+class SynthesizingFetcher(scraper.Fetcher):
+    """
+    A Fetcher that tells its SynthesizingSession which custom function
+    parses each page it fetches for one.
+    """
+
+    ##################################################################
+    #
+    def fetch(self, url, revalidate = False):
+        if url.function:
+            method, target, data = self.request_parts(url)
+            with self.session.lock:
+                self.session.functions[to_str(target)] = url.function.lower()
+        return scraper.Fetcher.fetch(self, url, revalidate)
+
+####################################################################
+#
+def timed(timings, name, function, *args):
+    """
+    Call the given function with the given arguments, add how long it
+    took to the list of timings of the given name, and return what the
+    function returned.
+
+    Arguments:
+    - `timings`: A dict of function name to list of seconds.
+    - `name`: The name we keep the timing under.
+    - `function`: The function to call.
+    - `*args`: Its arguments.
+    """
+    start = default_timer()
+    result = function(*args)
+    timings.setdefault(name, []).append(default_timer() - start)
+    return result
+
+####################################################################
+#
+def run_lookup(scraper_xml, fetcher, title, timings, before = None):
+    """
+    Do one complete lookup of the given title the way a media scanner
+    would: load the definition, search for the title and get everything
+    there is to get about the first thing we find.
+
+    Arguments:
+    - `scraper_xml`: The XML scraper definition.
+    - `fetcher`: The Fetcher the scraper makes its requests with.
+    - `title`: The title to look up.
+    - `timings`: The dict the timings of each step are added to.
+    - `before`: If given, called with the name of each step before it
+                is run.
+    """
+    def step(name, function, *args):
+        if before is not None:
+            before(name)
+        return timed(timings, name, function, *args)
+
+    s = step("load", scraper.Scraper, scraper_xml, logging.getLogger(),
+             fetcher)
+    results = step("lookup", s.lookup, title)
+    if len(results) == 0:
+        return
+    show = results[0]
+    step("get_details", show.get_details)
+    if isinstance(show, scraper.Movie):
+        step("resolve", show.resolve)
+    elif isinstance(show, scraper.Series):
+        episodes = step("get_episode_list", show.get_episode_list)
+        if len(episodes) > 0:
+            step("episode_get_details", episodes[0].get_details)
+    return
+
+####################################################################
+#
+def benchmark_definition(name, iterations = ITERATIONS):
+    """
+    Benchmark one definition by replaying its recording. Return a dict
+    of the results: the title looked up, the lookups per second, the
+    latency percentiles (in milliseconds) of each function we timed and
+    the peak memory of this process, or the error that stopped us.
+
+    This is meant to be run in a process of its own so that the peak
+    memory is that of this definition alone.
+
+    Arguments:
+    - `name`: The name of the definition (see definition_name())
+    - `iterations`: How many timed lookups we do.
+    """
+    result = { "definition" : name }
+    try:
+        with open(fixture_file(name)) as f:
+            recording = json.load(f)
+        with open(os.path.join(SCRAPERS_DIR, name)) as f:
+            scraper_xml = f.read()
+
+        session = ReplaySession(recording["responses"])
+        fetcher = scraper.Fetcher(workers = 1, cache = None,
+                                  session = session)
+        title = to_str(recording["title"])
+        result["title"] = title
+
+        # One lookup to warm up, that we do not time.
+        #
+        run_lookup(scraper_xml, fetcher, title, { })
+
+        timings = { }
+        elapsed = 0
+        for i in range(iterations):
+            session.rewind()
+            start = default_timer()
+            run_lookup(scraper_xml, fetcher, title, timings)
+            elapsed += default_timer() - start
+    except Exception, e:
+        result["error"] = str(e)
+        return result
+
+    result["ops_per_sec"] = iterations / elapsed if elapsed > 0 else None
+    result["functions"] = { }
+    for function, seconds in timings.iteritems():
+        result["functions"][function] = dict(
+            ("p%d" % p, percentile(seconds, p) * 1000.0) \
+                for p in PERCENTILES + SPREAD_PERCENTILES)
+    result["peak_rss_kb"] = peak_rss_kb()
+    return result
+
+####################################################################
+#
+def synthesize_lookup(scraper_xml, title, size = SYNTHETIC_PAGE_BYTES):
+    """
+    Look up a title with the given definition, answering its requests
+    with synthetic pages (see synthetic_pages()), and return the
+    SynthesizingSession that answered them.
+
+    Arguments:
+    - `scraper_xml`: The XML scraper definition.
+    - `title`: The title to look up.
+    - `size`: About how many bytes long each page is.
+    """
+    session = SynthesizingSession(synthetic_pages(scraper_xml, size))
+    fetcher = SynthesizingFetcher(workers = 1, cache = None,
+                                  session = session)
+
+    def before(name):
+        session.step = name
+    run_lookup(scraper_xml, fetcher, title, { }, before)
+    return session
+
+####################################################################
+#
+def record_definition(name, title = None, synthesize = False,
+                      size = SYNTHETIC_PAGE_BYTES):
+    """
+    Look up a title with the given definition over the network and
+    write every response we get out as its recording.
+
+    Arguments:
+    - `name`: The name of the definition (see definition_name())
+    - `title`: The title to look up. If not given we use the one in
+               DEFAULT_TITLES for the definition's content, or
+               SYNTHETIC_TITLE if we are synthesizing.
+    - `synthesize`: If True every request is answered with a synthetic
+                    page (see synthetic_pages()) instead of going to the
+                    network.
+    - `size`: About how many bytes long each synthetic page is.
+    """
+    with open(os.path.join(SCRAPERS_DIR, name)) as f:
+        scraper_xml = f.read()
+    if synthesize:
+        if title is None:
+            title = SYNTHETIC_TITLE
+        session = synthesize_lookup(scraper_xml, title, size)
+    else:
+        session = RecordingSession()
+        fetcher = scraper.Fetcher(workers = 1, cache = None,
+                                  session = session)
+        if title is None:
+            content = scraper.ScraperParser(scraper_xml).content
+            title = DEFAULT_TITLES[content]
+        run_lookup(scraper_xml, fetcher, title, { })
+
+    path = fixture_file(name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        json.dump({ "definition" : name,
+                    "title" : title,
+                    "recorded" : time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "responses" : session.entries },
+                  f, indent = 1, sort_keys = True)
+    return path
+
+####################################################################
+#
+def compare(results, baseline, threshold = THRESHOLD, noise = NOISE):
+    """
+    Compare the median latencies of our results with those of the
+    baseline. Each result gets a 'changes' dict of function name to the
+    fractional change of its median latency (0.1 is 10% slower) and a
+    'regressions' list of the functions that are slower than we can
+    put down to noise: by more than `threshold`, and by more than
+    `noise` times the spread of its timings in this run or the
+    baseline, whichever is larger (see spread())
+
+    A baseline made on another machine (see machine()) is not
+    comparable, so then we report the changes but no regressions.
+
+    Arguments:
+    - `results`: The list of results of benchmark_definition()
+    - `baseline`: A baseline, as read by read_baseline()
+    - `threshold`: How much slower is a regression.
+    - `noise`: How many times the spread of its timings a function has to
+               be slower by as well.
+    """
+    same_machine = baseline["machine"] == machine()
+    for result in results:
+        before = baseline["definitions"].get(result["definition"])
+        if before is None or "functions" not in before or \
+                "functions" not in result:
+            continue
+        result["changes"] = { }
+        result["regressions"] = []
+        for function, latencies in result["functions"].iteritems():
+            old_latencies = before["functions"].get(function, { })
+            old = old_latencies.get("p50")
+            if not old:
+                continue
+            change = (latencies["p50"] - old) / old
+            result["changes"][function] = change
+            limit = max(threshold, noise * max(spread(latencies),
+                                               spread(old_latencies)))
+            if same_machine and change > limit:
+                result["regressions"].append(function)
+    return results
+
+####################################################################
+#
+def read_baseline(path):
+    """
+    Return the baseline in the given file as a dict of the machine it
+    was made on (see machine()) and, under 'definitions', the results
+    of each definition by name. An empty baseline if there is no such
+    file. A baseline from before we noted the machine is just the dict
+    of results, and its machine is unknown (None.)
+
+    Arguments:
+    - `path`: The file the baseline is in.
+    """
+    if not os.path.exists(path):
+        return { "machine" : None, "definitions" : { } }
+    with open(path) as f:
+        baseline = json.load(f)
+    if "definitions" not in baseline:
+        baseline = { "machine" : None, "definitions" : baseline }
+    return baseline
+
+####################################################################
+#
+def report(results, same_machine = True, out = sys.stdout):
+    """
+    Write out our results as a table.
+
+    Arguments:
+    - `results`: The list of results of benchmark_definition(), after
+                 compare()
+    - `same_machine`: False if the baseline was made on another machine,
+                      which we say before the table.
+    - `out`: Where to write them.
+    """
+    if not same_machine:
+        out.write("The baseline was made on another machine: changes are "
+                  "not regressions.\nMake one on this machine with "
+                  "--save-baseline.\n")
+    for result in results:
+        if "error" in result:
+            out.write("%s: %s\n" % (result["definition"], result["error"]))
+            continue
+        out.write("%s (%s): %.1f lookups/sec, peak %.1f MB\n" % \
+                  (result["definition"], result["title"],
+                   result["ops_per_sec"] or 0,
+                   result["peak_rss_kb"] / 1024.0))
+        changes = result.get("changes", { })
+        for function in FUNCTIONS:
+            latencies = result["functions"].get(function)
+            if latencies is None:
+                continue
+            line = "    %-20s" % function
+            line += "".join("  p%d %9.2fms" % (p, latencies["p%d" % p]) \
+                                for p in PERCENTILES)
+            if function in changes:
+                line += "  %+6.1f%%" % (changes[function] * 100)
+                if function in result["regressions"]:
+                    line += " SLOWER"
+            out.write(line + "\n")
+    return
+
+############################################################################
+#
+def setup_option_parser():
+    """
+    Very simple option parser object.
+    """
+    parser = optparse.OptionParser(usage = "%prog [options] "
+                                   "[definition ...]")
+    parser.add_option("--iterations", action="store", type="int",
+                      dest="iterations",
+                      default = ITERATIONS,
+                      help = "How many timed lookups we do of each "
+                      "definition. The default is %default.")
+    parser.add_option("--threshold", action="store", type="float",
+                      dest="threshold",
+                      default = THRESHOLD,
+                      help = "How much slower than the baseline a "
+                      "function's median latency has to be to count as a "
+                      "regression. The default is %default.")
+    parser.add_option("--noise", action="store", type="float",
+                      dest="noise",
+                      default = NOISE,
+                      help = "How many times the spread of its timings "
+                      "(between the 25th and 75th percentiles) a "
+                      "function's median latency has to be slower by as "
+                      "well. The default is %default.")
+    parser.add_option("--baseline", action="store", type="string",
+                      dest="baseline",
+                      default = BASELINE_FILE,
+                      help = "The baseline to compare with. Only one made "
+                      "on this machine can find regressions. The default "
+                      "is %default.")
+    parser.add_option("--save-baseline", action="store_true",
+                      dest="save_baseline",
+                      default = False,
+                      help = "Write the results of this run out as the "
+                      "baseline.")
+    parser.add_option("--json", action="store", type="string",
+                      dest="json",
+                      default = None,
+                      help = "Also write the results, as JSON, to this "
+                      "file.")
+    parser.add_option("--record", action="store_true",
+                      dest="record",
+                      default = False,
+                      help = "Make new recordings of the given definitions "
+                      "over the network instead of benchmarking them.")
+    parser.add_option("--synthesize", action="store_true",
+                      dest="synthesize",
+                      default = False,
+                      help = "Make new recordings of the given definitions, "
+                      "like --record, but answer every request with a "
+                      "synthetic page made from the definition's "
+                      "expressions instead of going to the network.")
+    parser.add_option("--page-size", action="store", type="int",
+                      dest="page_size",
+                      default = SYNTHETIC_PAGE_BYTES,
+                      help = "About how many bytes long each synthetic "
+                      "page --synthesize makes is. The default is "
+                      "%default.")
+    parser.add_option("--title", action="store", type="string",
+                      dest="title",
+                      default = None,
+                      help = "The title --record looks up. The default "
+                      "depends on the definition's content: %s" % \
+                          ", ".join("%s: '%s'" % item for item in \
+                                        sorted(DEFAULT_TITLES.items())))
+    return parser
+
+#############################################################################
+#
+def main():
+    """
+    Parse our options, then record or benchmark the definitions we are
+    given (or all of them.) Returns our exit status: 1 if any function
+    was slower than the baseline allows.
+    """
+    parser = setup_option_parser()
+    (options, args) = parser.parse_args()
+
+    # The scraper logs a lot at the debug level. We do not want to be
+    # timing that.
+    #
+    logging.basicConfig(level = logging.WARNING)
+
+    if len(args) > 0:
+        names = [definition_name(os.path.join(SCRAPERS_DIR, arg)) \
+                     for arg in args]
+    else:
+        names = all_definitions()
+
+    if options.record or options.synthesize:
+        for name in names:
+            try:
+                print "%s: recorded in %s" % (name,
+                                              record_definition(
+                                                  name, options.title,
+                                                  options.synthesize,
+                                                  options.page_size))
+            except Exception, e:
+                print "%s: %s" % (name, e)
+        return 0
+
+    # Each definition is benchmarked in a process of its own so that we
+    # know the peak memory of each one.
+    #
+    results = []
+    for name in names:
+        if not os.path.exists(fixture_file(name)):
+            continue
+        pool = multiprocessing.Pool(1)
+        try:
+            results.append(pool.apply(benchmark_definition,
+                                      (name, options.iterations)))
+        finally:
+            pool.close()
+            pool.join()
+
+    if len(results) == 0:
+        print "No recordings to benchmark. Make some with --record."
+        return 0
+
+    baseline = read_baseline(options.baseline)
+    compare(results, baseline, options.threshold, options.noise)
+    report(results, len(baseline["definitions"]) == 0 or \
+               baseline["machine"] == machine())
+
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent = 1, sort_keys = True)
+
+    if options.save_baseline:
+        # Results made on another machine do not go with ours.
+        #
+        if baseline["machine"] != machine():
+            baseline = { "machine" : machine(), "definitions" : { } }
+        for result in results:
+            if "error" not in result:
+                baseline["definitions"][result["definition"]] = dict(
+                    (key, result[key]) for key in \
+                        ("title", "ops_per_sec", "functions", "peak_rss_kb"))
+        with open(options.baseline, "w") as f:
+            json.dump(baseline, f, indent = 1, sort_keys = True)
+
+    if any(result.get("regressions") for result in results):
+        return 1
+    return 0
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,8 @@ A simple CLI interface to our python scraper module.
 #
 import sys
 import os
+import json
+import atexit
 import optparse
 import readline
 
@@ -52,13 +54,76 @@ def setup_option_parser():
     """
     Very simple option parser object.
     """
-    parser = optparse.OptionParser(usage = "%prog [options]",
+    parser = optparse.OptionParser(usage = "%prog [options] "
+                                   "[lookup_many|batch [title file ...]]",
                                    version = "%prog 0.1")
     parser.add_option("--scraper", action="store", type="string",
                       dest="scraper",
                       default = None,
                       help = "The file containing the XML scraper definition "
-                      "to use.")
+                      "to use, or the name of one of the definitions we "
+                      "ship, ie: 'imdb'.")
+    parser.add_option("--list-scrapers", action="store_true",
+                      dest="list_scrapers",
+                      default = False,
+                      help = "List the names of the scraper definitions we "
+                      "ship and exit.")
+    parser.add_option("--cache", action="store", type="string",
+                      dest="cache",
+                      default = None,
+                      help = "A file to keep the responses to the scraper's "
+                      "requests in across runs. By default they are only "
+                      "kept in memory.")
+    parser.add_option("--cache-ttl", action="store", type="int",
+                      dest="cache_ttl",
+                      default = None,
+                      help = "How many seconds cached responses are good "
+                      "for. The default is the scraper definition's "
+                      "'cachePersistence', or one day.")
+    parser.add_option("--definition-cache", action="store", type="string",
+                      dest="definition_cache",
+                      default = None,
+                      help = "A directory to keep compiled scraper "
+                      "definitions in so that later runs start faster.")
+    parser.add_option("--workers", action="store", type="int",
+                      dest="workers",
+                      default = None,
+                      help = "How many processes 'lookup_many' uses. The "
+                      "default is one per cpu.")
+    parser.add_option("--jobs", action="store", type="int",
+                      dest="jobs",
+                      default = scraper.Scraper.ASYNC_WORKERS,
+                      help = "How many titles 'batch' looks up at the same "
+                      "time. The default is %default. These are threads, "
+                      "so a title stuck in one match of an expression is "
+                      "not stopped; 'lookup_many' kills its process.")
+    parser.add_option("--fields", action="store", type="string",
+                      dest="fields",
+                      default = None,
+                      help = "A comma separated list of the fields 'batch' "
+                      "outputs for each show, ie: 'title,year,id'. Details "
+                      "that are not needed for them are not fetched. The "
+                      "default is every field.")
+    parser.add_option("--file-names", action="store_true",
+                      dest="file_names",
+                      default = False,
+                      help = "The titles 'batch' reads are the names of "
+                      "media files. Their directories and extensions are "
+                      "ignored.")
+    parser.add_option("--profile", action="store", type="string",
+                      dest="profile",
+                      default = None,
+                      help = "Write how long each <RegExp> of the scraper "
+                      "took, and how much it matched, to this file when we "
+                      "exit. 'lookup_many' is not profiled. The debug log "
+                      "is not written while profiling.")
+    parser.add_option("--flame-graph", action="store", type="string",
+                      dest="flame_graph",
+                      default = None,
+                      help = "Write how long each <RegExp> of the scraper "
+                      "took to this file as folded stacks for a flame "
+                      "graph when we exit. The debug log is not written "
+                      "while profiling.")
     return parser
 
 ##################################################################
@@ -73,13 +138,36 @@ class CommandProcessor(object):
 
     ##################################################################
     #
-    def __init__(self, scraper_definition_file, logger = logging.getLogger()):
+    def __init__(self, scraper_definition_file, logger = logging.getLogger(),
+                 cache_file = None, cache_ttl = None,
+                 definition_cache_dir = None):
         """
+        Arguments:
+        - `scraper_definition_file`: The XML scraper definition to use, or
+                                     the name of one we ship.
+        - `cache_file`: If given, the file of the DiskCache responses are
+                        kept in.
+        - `cache_ttl`: How many seconds cached responses are good for.
+        - `definition_cache_dir`: If given, the directory of the
+                                  DefinitionCache compiled definitions are
+                                  kept in.
         """
-        f = open(scraper_definition_file, 'r')
-        xml = f.read()
-        f.close()
-        self.scraper = scraper.Scraper(xml, logger)
+        if os.path.exists(scraper_definition_file):
+            f = open(scraper_definition_file, 'r')
+            xml = f.read()
+            f.close()
+        else:
+            xml = scraper.registry.definition(scraper_definition_file)
+        response_cache = None
+        if cache_file:
+            response_cache = scraper.DiskCache(cache_file)
+        definition_cache = None
+        if definition_cache_dir:
+            definition_cache = scraper.DefinitionCache(definition_cache_dir)
+        self.scraper = scraper.Scraper(xml, logger,
+                                       response_cache = response_cache,
+                                       cache_ttl = cache_ttl,
+                                       definition_cache = definition_cache)
 
     ##################################################################
     #
@@ -199,6 +287,113 @@ class CommandProcessor(object):
 
         return ep
 
+    ##################################################################
+    #
+    def cmd_lookup_many(self, titles, workers = None):
+        """
+        Look up all of the given titles, getting the details of the best
+        match for each, spread over a pool of processes. The result for
+        each title is printed as soon as it is done.
+
+        Arguments:
+        - `titles`: The list of titles to look up.
+        - `workers`: How many processes to use.
+        """
+        for result in self.scraper.lookup_many(titles, workers):
+            query = result["query"]
+            if "error" in result:
+                print "** %s: %s" % (query, result["error"])
+                continue
+            show = result["show"]
+            if show is None:
+                print "%s: no matches" % query
+                continue
+            line = "%s: %s (id: %s)" % (query,
+                                        show["title"].encode('ascii',
+                                                             'xmlcharrefreplace'),
+                                        show["id"])
+            if "episodes" in show:
+                line += ", %d episodes" % len(show["episodes"])
+            print line
+        return
+
+    ##################################################################
+    #
+    def cmd_batch(self, titles, jobs, fields = None):
+        """
+        Look up all of the given titles, up to `jobs` at a time, and write
+        the result for each to stdout as a line of JSON (see
+        Scraper.lookup_one() for what is in it) as soon as it is done.
+
+        The titles are looked up in this process, so the parser's budgets
+        are only checked between the matches of an expression (see
+        cmd_lookup_many() for one that can stop a runaway match.)
+
+        Arguments:
+        - `titles`: An iterable of the titles to look up.
+        - `jobs`: How many titles to look up at the same time.
+        - `fields`: If given, the list of the fields of each show to
+                    output.
+        """
+        for result in self.scraper.lookup_iter(titles, jobs, fields):
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+        return
+
+############################################################################
+#
+def read_titles(file_names, media_files = False):
+    """
+    Yield the titles, one per line, in the given files. If no files are
+    given, or a file name is '-', read standard input.
+
+    Lines are read as they come in so that we can be on the end of a
+    pipe.
+
+    Arguments:
+    - `file_names`: The list of files to read.
+    - `media_files`: If True each line is the name of a media file and
+                     the title is its name without its directory or
+                     extension.
+    """
+    if len(file_names) == 0:
+        file_names = ["-"]
+    for file_name in file_names:
+        if file_name == "-":
+            f = sys.stdin
+        else:
+            f = open(file_name, 'r')
+        for line in iter(f.readline, ""):
+            line = line.strip()
+            if media_files:
+                line = os.path.splitext(os.path.basename(line))[0]
+            if len(line) > 0:
+                yield line
+        if f is not sys.stdin:
+            f.close()
+    return
+
+############################################################################
+#
+def write_profile(profiler, profile_file = None, flame_graph_file = None):
+    """
+    Write out what our profiler recorded.
+
+    Arguments:
+    - `profiler`: The scraper.Profiler of our scraper.
+    - `profile_file`: If given, the file to write a report, the slowest
+                      <RegExp> first, to.
+    - `flame_graph_file`: If given, the file to write folded stacks for a
+                          flame graph to.
+    """
+    if profile_file:
+        with open(profile_file, "w") as f:
+            profiler.report(f)
+    if flame_graph_file:
+        with open(flame_graph_file, "w") as f:
+            profiler.write_folded(f)
+    return
+
 #############################################################################
 #
 def main():
@@ -220,10 +415,39 @@ def main():
     parser = setup_option_parser()
     (options, args) = parser.parse_args()
 
+    if options.list_scrapers:
+        for entry in scraper.Scraper.definitions():
+            print "%-20s %-12s %s" % (entry["name"], entry["content"],
+                                     entry["title"])
+        return
+
+    # The scraper definition is either a file or the name of one that we
+    # ship.
+    #
+    if options.scraper is None:
+        parser.error("--scraper is required.")
+    if not os.path.exists(options.scraper):
+        try:
+            entry = scraper.registry.entry(options.scraper)
+        except KeyError:
+            parser.error("'%s' is not a file or the name of one of our "
+                         "scraper definitions (see --list-scrapers)" % \
+                             options.scraper)
+        if not entry["supported"]:
+            parser.error("The '%s' definition is for '%s', which is not "
+                         "supported." % (entry["name"], entry["content"]))
+
     # XXX our verbose debugging logger.
     #
+    # When we are profiling we leave out the debug messages. Otherwise
+    # what we measure would mostly be the writing of whole pages to our
+    # log.
+    #
+    profiling = options.profile or options.flame_graph
     logger = logging.getLogger("scrape_cli")
     logger.setLevel(logging.DEBUG)
+    if profiling:
+        logger.setLevel(logging.INFO)
 #     ch = logging.StreamHandler()
     ch = logging.handlers.RotatingFileHandler("/tmp/scrape_cli.log")
     ch.setLevel(logging.DEBUG)
@@ -234,7 +458,32 @@ def main():
     # The command processor is what actually runs all of our commands. It is
     # tied to a specific scraper.
     #
-    cp = CommandProcessor(options.scraper, logger)
+    cp = CommandProcessor(options.scraper, logger, options.cache,
+                          options.cache_ttl, options.definition_cache)
+
+    # If we were asked to profile our scraper, what we find is written out
+    # however we exit.
+    #
+    if profiling:
+        profiler = cp.scraper.profile(scraper.Profiler())
+        atexit.register(write_profile, profiler, options.profile,
+                        options.flame_graph)
+
+    # If we were given a command on the command line, run it instead of
+    # our interactive loop.
+    #
+    if len(args) > 0:
+        titles = read_titles(args[1:], options.file_names)
+        if args[0] == "lookup_many":
+            cp.cmd_lookup_many(titles, options.workers)
+        elif args[0] == "batch":
+            fields = None
+            if options.fields:
+                fields = [f.strip() for f in options.fields.split(",")]
+            cp.cmd_batch(titles, options.jobs, fields)
+        else:
+            parser.error("'%s' is not a valid command." % args[0])
+        return
 
     # Print out the current settings..
     #
@@ -12,7 +12,6 @@ The scraper package. This defines the classes and functions of our scraper.
 #
 from scraper.scrap import *
 
-# XXX We want to provide a list of defines scrapers as a dictionary of some
-#     sort here, and have the Scraper able to take a name to lookup in this
-#     dict.. OR provide a file path to an xml scraper definition.
+# The scraper definitions we ship are listed by 'registry' (see
+# scraper.scrap.Registry), and Scraper.by_name() loads one of them by name.
 #
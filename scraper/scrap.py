@@ -20,18 +20,45 @@ from __future__ import with_statement
 # system imports
 #
 import sys
+import os
 import re
+import time
 import types
 import logging
+import zlib
+import socket
+import httplib
 import urllib
 import urllib2
 import urlparse
 import string
+import tempfile
 import zipfile
-import HTMLParser
+import threading
+import Queue
+import multiprocessing
+import json
+import cPickle
+import codecs
+import hashlib
+import difflib
+import sqlite3
+import select
+import sre_parse
+import sre_constants
+import htmlentitydefs
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from StringIO import StringIO
-from xml.dom.minidom import parseString, parse
-from xml.parsers.expat import ExpatError
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+# Unlike the C version, the python ElementTree lets us find out what line
+# of a document each element is on.
+#
+import xml.etree.ElementTree as PythonElementTree
 
 ##################################################################
 ##################################################################
@@ -63,17 +90,37 @@ FN_GET_EPISODE_LIST          = "GetEpisodeList"
 FN_GET_EPISODE_DETAILS       = "GetEpisodeDetails"
 FN_CREATE_SEARCH_RESULTS     = "CreateSearchResults"
 
+# How many buffers do we support. The default seems to be 9, but I
+# have seen one scraper xml file use 12, and the wiki says 9, but
+# a forum post says 20...
+#
+NUM_BUFFERS = 20
+
+# The version of what we compile a scraper definition in to (see
+# DefinitionCache.) It must be changed whenever RegExpStep,
+# ScraperFunction, Template or ScraperParser.COMPILED change so that no
+# definition compiled by an older version of this module is used.
+#
+ENGINE_VERSION = 3
+
 # Regular expression used in ScraperParser.parse_expression. No need to
 # keep recompiling it every time we run since it does not change.
 #
 #optional_re = re.compile("(.*)(\\\\\\(.*\\\\2.*)\\\\\\)(.*)")
 optional_re = re.compile(r"(.*)(\\\(.*\\2.*)\\\)(.*)", re.DOTALL)
 
-# Our re search for '!!!CLEAN!!!...!!!CLEAN!!!' and '!!!TRIM!!!...!!!TRIM!!!' bracketed
-# substrings.
+# Our re's for 'cleaning' match groups: one that matches HTML tags
+# and comments (including a tag cut off at the end of the group) so we
+# can strip them out, and one that matches HTML entity and character
+# references, as well as bare '&'s.
+#
+tag_re = re.compile(r'<!--.*?(-->|\Z)|<[!/?a-zA-Z][^>]*(>|\Z)', re.DOTALL)
+entity_re = re.compile(r'&(?:(#[0-9]+|#[xX][0-9a-fA-F]+|\w+);)?')
+
+# The entities that are also defined by XML. The results of our parsing
+# are XML documents so we leave these as they are.
 #
-clean_re = re.compile(r'!!!CLEAN!!!((?!!!!CLEAN!!!).*?)!!!CLEAN!!!',re.DOTALL)
-trim_re = re.compile(r'!!!TRIM!!!((?!!!!TRIM!!!).*?)!!!TRIM!!!',re.DOTALL)
+xml_entities = ("amp", "lt", "gt", "quot", "apos")
 
 # Our re for '$INFO[<foo>]' substitutions (where 'foo' is for now
 # going to be just alnum's. These are patterns in our output that are
@@ -81,32 +128,28 @@ trim_re = re.compile(r'!!!TRIM!!!((?!!!!TRIM!!!).*?)!!!TRIM!!!',re.DOTALL)
 #
 setting_re = re.compile(r'\$INFO\[(\w+)]')
 
-##################################################################
-##################################################################
+# Our re for tokenizing the input, output, and expression strings of a
+# scraper definition in to Template segments. It matches '$$<n>' buffer
+# references, '$INFO[<foo>]' setting references and the three character
+# string '\\n' (which stands for a newline.) The buffer numbers are
+# listed highest first so that '$$10' is matched in preference to '$$1'.
 #
-class MLStripper(HTMLParser.HTMLParser):
-    """
-    A simplistic HTMLParser sub-class that strips HTML tags from
-    given text.
-
-    XXX Should clean this up in to a re-callable objec that
-        we can just instantiate once and pass successive strings
-        to strip.
+template_re = re.compile(r'\$\$(%s)|\$INFO\[(\w+)]|(\\\\n)' % \
+                         "|".join(str(i) for i in range(NUM_BUFFERS, -1, -1)))
 
-    Cribbed from: http://code.activestate.com/recipes/440481/
+# Our re for the custom functions a step's output calls: the 'function'
+# attribute of the <url>'s in it.
+#
+url_function_re = re.compile(r'<url\b[^>]*\bfunction\s*=\s*["\']?([^"\'\s>]+)')
 
-    >>> x = MLStripper()
-    >>> x.feed('<p>Keep this Text  KEEP  123</p>')
-    >>> x.get_fed_data()
-    'Keep this Text  KEEP  123'
-    """
-    def __init__(self):
-        self.reset()
-        self.fed = []
-    def handle_data(self, d):
-        self.fed.append(d)
-    def get_fed_data(self):
-        return ''.join(self.fed)
+# Our re's for the charset of a response: the 'charset' parameter of its
+# Content-Type header, and the charset a <meta> tag or the XML
+# declaration at the top of an HTML or XML document says it is in.
+#
+charset_re = re.compile(r'charset\s*=\s*([^\s;]+)', re.I)
+meta_charset_re = re.compile(r'<meta[^>]+charset\s*=\s*["\']?([-\w.:]+)|'
+                             r'^\s*<\?xml[^>]+encoding\s*=\s*["\']([-\w.:]+)',
+                             re.I)
 
 ##################################################################
 ##################################################################
@@ -171,7 +214,25 @@ class BadXML(ScraperException):
     def __str__(self):
         return "BadXML: %s" % self.value
 
-# Some helper functions for navigating a DOM object.
+##################################################################
+##################################################################
+#
+class ParseTimeout(ScraperException):
+    """
+    Raised when a function of a scraper definition, or one of its
+    expressions, runs for longer than the ScraperParser allows.
+
+    The parser only notices this between the matches of an expression,
+    and between its steps, so a single match that runs away is not cut
+    short. Only Scraper.lookup_many() can stop one, by killing the
+    process it is running in.
+    """
+    def __init__(self, value = "Parse took too long"):
+        self.value = value
+    def __str__(self):
+        return "ParseTimeout: %s" % self.value
+
+# Some helper functions for navigating parsed XML.
 #
 
 ####################################################################
@@ -189,7 +250,7 @@ def get_int_attribute(element, attr, default = 0):
     - `element`:
     - `attr`:
     """
-    result = element.getAttribute(attr)
+    result = element.get(attr, "")
     if result == "":
         return default
     return int(result)
@@ -229,7 +290,7 @@ def try_float(data):
 
 ####################################################################
 #
-def try_url(data, cache = None, base_url = None):
+def try_url(data, cache = None, base_url = None, fetcher = None):
     """
     Like try_int() and try_float() except this tries to convert the
     string in to a URL object. If that fails it returns None.
@@ -239,1553 +300,5144 @@ def try_url(data, cache = None, base_url = None):
     """
     if data is None:
         return data
-    return ScrapeURL(data, cache = cache, base_url = base_url)
+    return ScrapeURL(data, cache = cache, base_url = base_url,
+                     fetcher = fetcher)
 
 ####################################################################
 #
-def get_child_data(node, tag_name, default = None):
+def strip_tags(text):
     """
-    A helper function -- get the data child node of the first child
-    node of `node` that has the name `tag_name`. If no such node
-    exists, or that node has text subnode, return the default value
-    that is passed in
+    Return the given text with any HTML tags and comments removed.
 
-    We use this pattern all the time when pulling text out of dom
-    where we have:
+    >>> strip_tags('<p>Keep this Text  <b>KEEP</b>  123</p>')
+    'Keep this Text  KEEP  123'
 
-       <foo><bar>some text</bar></foo>
+    Arguments:
+    - `text`: The string to strip HTML tags from.
+    """
+    return tag_re.sub("", text)
 
-    where `node` passed in a handle on <foo>
+####################################################################
+#
+def replace_entity(matchobj):
+    """
+    This function is intended to be called as an argument to the
+    regular expression object's 'sub()' method by 'decode_entities()'
 
     Arguments:
-    - `node`: The dom tag in which we are going to look for a specific tag name
-    - `tag_name`: The name of the tag we want to find.
-    - `default`: The default value if we can not find the tag, or it has no
-                 child data node.
+    - `matchobj`: The re matchobj that matched an entity reference.
     """
-    n = first_child(node, tag_name)
-    if n and n.firstChild:
-        return n.firstChild.data
-    else:
-        return default
+    name = matchobj.group(1)
+    if name is None:
+        # A bare '&' that is not part of an entity.
+        #
+        return "&amp;"
+    if name[0] == "#" or name in xml_entities:
+        return matchobj.group(0)
+    if name in htmlentitydefs.name2codepoint:
+        return "&#%d;" % htmlentitydefs.name2codepoint[name]
+    return "&amp;" + name + ";"
 
 ####################################################################
 #
-def first_child(tree, name, recurse = False):
+def decode_entities(text):
     """
-    Return the first child node with the given name. If `recurse` is
-    True then we do a depth first recursion looking for nodes with the
-    given name.
+    Convert the HTML entity references in the given text to something
+    that is valid in the XML documents that our scrapers produce: named
+    HTML entities become XML character references, the entities XML
+    itself defines and character references are left alone, and any '&'
+    that does not start an entity is escaped.
+
+    >>> decode_entities('Caf&eacute; &amp; Bar & Grill &#233;')
+    'Caf&#233; &amp; Bar &amp; Grill &#233;'
 
     Arguments:
-    - `name`: name of the node to look for.
-    - `recurse`: do we look through the entire tree, depth first, for this node?
+    - `text`: The string whose entities we want to convert.
     """
-    name = name.lower()
-    if not tree.hasChildNodes():
-        return None
-    for child in tree.childNodes:
-        if child.nodeType != child.ELEMENT_NODE:
-            continue
-        if child.tagName.lower() == name:
-            return child
-    return None
+    if "&" not in text:
+        return text
+    return entity_re.sub(replace_entity, text)
 
 ####################################################################
 #
-def next_sibling(node, name):
+def clean_text(text):
     """
-    Go through the next sibling nodes until we find one with the given name.
+    'Clean' a regexp match group: strip leading and trailing white space
+    and HTML tags from it and convert its HTML entities.
 
     Arguments:
-    - `node`: The node whose siblings we are going to search.
-    - `name`: The name of the node we are looking for.
+    - `text`: The string to clean.
     """
-    while node.nextSibling is not None:
-        node = node.nextSibling
-        if node.nodeType == node.ELEMENT_NODE and node.tagName == name:
-            return node
-    return None
+    return decode_entities(strip_tags(text.strip()))
 
-##################################################################
-##################################################################
+####################################################################
 #
-class ScrapeURL(object):
+def join_text(parts):
     """
+    Join the given strings, any of which may be unicode.
+
+    Text is kept as it is until it leaves the parser, but a page in a
+    charset we were not told of is a byte string that can not be mixed
+    with unicode. When that happens the unicode strings are encoded as
+    ASCII with XML character references in place of what ASCII does not
+    have, which is what every buffer used to be.
+
+    Arguments:
+    - `parts`: The list of strings to join.
     """
+    try:
+        return "".join(parts)
+    except UnicodeDecodeError:
+        return "".join(part.encode("ascii", "xmlcharrefreplace")
+                       if isinstance(part, unicode) else part
+                       for part in parts)
 
-    ##################################################################
-    #
-    def __init__(self, url, cache = { }, base_url = None):
-        """
-        We can be called with `url` being a string or a dom element
-        node. In the later case we need to parse the element node.
+####################################################################
+#
+def parse_xml(text):
+    """
+    Parse the given XML document and return its root element.
 
-        `url` - The url that this object wraps.
-        """
-        self.base_url = base_url
-        self.cache = cache
-        self.use_post = False
-        self.spoof_url = None
-        self.cache_key = None
-        self.function = None   # if the results of this URL need to be
-                               # parsed by a custom function
-        if type(url) in types.StringTypes:
-            self.parse_string(url)
-        else:
-            self.parse_element(url)
+    We use ElementTree (the C version if we have it) for everything
+    XML - scraper definitions, settings and every bit of output a
+    scraper function produces. The scraper outputs in particular are
+    parsed many times per lookup and we only ever want a handful of
+    text values out of them, so a full DOM is far more than we need.
 
-        # If we have no actual url then we can not do our url cleanups
-        # because they assume we have a string, so return now.
-        #
-        if self.url is None:
-            return
+    Raises ElementTree.ParseError if `text` is not well formed.
 
-        # This is not documented in any place but URL's within things like
-        # movie details are sometimes relative url's.. if the url we parsed
-        # out does not begin with 'http' and is not the empty string and
-        # if we got a base_url passed in, then combine the url with the base
-        # url.
-        #
-        if self.base_url and self.url != "" and self.url[0:4].lower() != "http":
-            self.url = self.base_url + self.url
-        return
+    Arguments:
+    - `text`: The XML document as a string. If it is unicode it is
+              handed to the parser encoded as utf-8.
+    """
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    return ElementTree.fromstring(text)
+
+##################################################################
+##################################################################
+#
+class LineNumberBuilder(PythonElementTree.TreeBuilder):
+    """
+    A tree builder for the python ElementTree's XMLParser that gives
+    every element it builds a 'sourceline' attribute: the line of the
+    document its start tag is on.
+    """
 
     ##################################################################
     #
-    def __str__(self):
-        result = ["<ScrapeURL, url: %s" % self.url]
-        if self.use_post:
-            result.append("use_post: %s" % self.use_post)
-        if self.spoof_url:
-            result.append("spoof_url: %s" % self.spoof_url)
-        if self.cache_key:
-            result.append("cache: %s" % self.cache_key)
-        if self.function:
-            result.append("function: %s" % self.function)
+    def __init__(self):
+        PythonElementTree.TreeBuilder.__init__(self)
+        self.parser = None
 
-        result.append(">")
-        return " ".join(result)
-    
     ##################################################################
     #
-    def get(self):
-        """
-        use the url we were configured with and get its content. Return the
-        content retrieved as a string.
+    def start(self, tag, attrs):
+        element = PythonElementTree.TreeBuilder.start(self, tag, attrs)
+        element.sourceline = self.parser.CurrentLineNumber
+        return element
 
-        NOTE: We will check our cache first for the cache key if we have
-              one and use that thus avoiding any network call.
-        """
-        # If we have a cache_key, see if there is data under that key
-        # in our url cache and use that if there is.
-        #
-        if self.cache_key and self.cache_key in self.cache:
-            return self.cache[self.cache_key]
+####################################################################
+#
+def parse_xml_lines(text):
+    """
+    Like parse_xml() except that every element of the tree we return
+    has a 'sourceline' attribute with the line of the document it is
+    on. This is a good deal slower than parse_xml() so we only do it
+    when we need to know.
 
-        # If the actual URL is the empty string, and we did not have a cached
-        # result for it, then we can not retrieve anything. Return None.
-        #
-        if self.url is None or len(self.url) == 0:
-            return None
+    Arguments:
+    - `text`: The XML document as a string.
+    """
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    builder = LineNumberBuilder()
+    parser = PythonElementTree.XMLParser(target = builder)
+    builder.parser = parser.parser
+    parser.feed(text)
+    return parser.close()
 
-        if not self.use_post:
-            # If we are NOT using 'POST' to query the URL we can create a
-            # simple urllib2.Request object.
-            #
-            req = urllib2.Request(self.url)
-        else:
-            # If we ARE using 'POST' then we need to interpret the
-            # parameters out of the URL and pass them as the 'data'
-            # parameter to the request object we are creating. This will
-            # cause 'urlopen()' to use POST to get the results.
-            #
-            o = urlparse.urlsplit(self.url)
-            req = urllib2.Request(o.scheme + "://" + o.netloc + o.path, o.query)
+####################################################################
+#
+def iter_children(text, name):
+    """
+    A generator that parses the given XML document incrementally and
+    yields the children of its root element with the given name, one
+    at a time, as soon as each has been completely parsed.
 
-        # If 'spoof_url' is NOT None, then we
-        # want our request to use the 'spoof_url' as its referrer
-        #
-        if self.spoof_url is not None:
-            req.add_header('Referer', self.spoof_url)
+    Elements that have been handed back are discarded once the caller
+    asks for the next one so a long document (like an episode list for
+    a show that has been running for decades) never has to be held in
+    memory as a whole tree.
 
-        # What we get from the remote site is UTF-8 so decode it in to unicode
-        # and then encode that as ASCII with characters that can not be
-        # represented in ASCII replaced with their XML character references.
-        #
-        f = urllib2.urlopen(req)
-        content_type = f.info()['Content-Type'].lower()
+    Raises ElementTree.ParseError if `text` is not well formed.
 
-        # Based on the content type we need to deal with the response
-        # in various ways, like unzip, or re-encoding as ascii.
-        #
-        if content_type == "application/zip":
-            # In zip files we extract all the individual files.
-            #
-            # NOTE: Since the zipfile.ZipFile class needs a file like object
-            #       with the 'seek()' method we use a StringIO to hold
-            #       our url result data.
-            #
-            result = []
-            stringy = StringIO(f.read())
-            z = zipfile.ZipFile(stringy, 'r')
-            members = z.namelist()
-            for member in members:
-                result.append(z.read(member))
-            z.close()
-            stringy.close()
-
-            # The way the scraper wants to work is that it gets all parts
-            # of such a zip file as a single string.. so join them all
-            # together (separated by a newline character, just because.)
-            #
-            result = "\n".join(result)
-        elif content_type[0:9] == "text/xml;":
-            ign,charset = content_type.split('=')
+    Arguments:
+    - `text`: The XML document as a string.
+    - `name`: The name of the child elements we want. Like
+              first_child() this is not case sensitive.
+    """
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    name = name.lower()
+    root = None
+    depth = 0
+    for event, element in ElementTree.iterparse(StringIO(text),
+                                                ("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and element.tag.lower() == name:
+            yield element
+            root.clear()
 
-            # XXX We should just return what we get and not encode it as
-            #     ascii. The end point should encode if it only wants to
-            #     see a string... (or maybe we SHOULD do this..)
-            #
-            result = f.read().decode(charset).encode("ascii",
-                                                     "xmlcharrefreplace")
-        else:
-            # Finally we do not know what to do with it.. just read it
-            # in to a string.
-            #
-            result = f.read()
+####################################################################
+#
+def element_text(element, default = None):
+    """
+    Return the text directly inside the given element as unicode. If
+    there is no element, or it has no text, return the default value.
 
-        f.close()
-        if self.cache_key:
-            self.cache[self.cache_key] = result
-        return result
+    Arguments:
+    - `element`: The element whose text we want (may be None)
+    - `default`: What to return if there is no text.
+    """
+    if element is None or not element.text:
+        return default
+    return unicode(element.text)
 
-    ##################################################################
-    #
-    def parse_element(self, element):
-        """
-        Parse the url dom element node.
+####################################################################
+#
+def element_xml(element):
+    """
+    Return the given element serialized back to a utf-8 XML string
+    without an XML declaration and without any text that trails the
+    element in its parent.
 
-        Arguments:
-        - `element`: a dom element node that we need to get a URL from.
-        """
-        if element.firstChild:
-            self.url = element.firstChild.data
-        else:
-            # This happens with these 'cache' url's. Need to figure
-            # out where the cache _comes from_
-            #
-            self.url = None
+    Arguments:
+    - `element`: The element to serialize.
+    """
+    tail = element.tail
+    element.tail = None
+    try:
+        return ElementTree.tostring(element, "utf-8")
+    finally:
+        element.tail = tail
 
-        self.spoof_url = element.getAttribute("spoof")
-        if element.hasAttribute("post"):
-            self.use_post = True
-        self.function = element.getAttribute("function")
-        self.cache_key = element.getAttribute("cache")
-        return
+####################################################################
+#
+def get_child_data(node, tag_name, default = None):
+    """
+    A helper function -- get the text of the first child element of
+    `node` that has the name `tag_name`. If no such element exists,
+    or that element has no text, return the default value that is
+    passed in
 
-    ##################################################################
-    #
-    def parse_string(self, xml_url):
-        """
-        We are given a string that is an xml document that we need to
-        parse for it for our url arguments. If it does not parse as an
-        xml document then we consider it to be the url string.
+    We use this pattern all the time when pulling text out of XML
+    where we have:
 
-        Arguments:
-        - `xml_url`: The string containing our xml URL document.
-        """
-        if len(xml_url) == 0:
-            raise BadURL("An empty string is not a valid URL.")
-        try:
-            dom = parseString(xml_url).firstChild
-            self.parse_element(dom)
-            dom.unlink()
-            dom = None
-        except ExpatError:
-            self.url = xml_url
-        return
+       <foo><bar>some text</bar></foo>
 
-##################################################################
-##################################################################
+    where `node` passed in a handle on <foo>
+
+    Arguments:
+    - `node`: The element in which we are going to look for a specific
+              tag name
+    - `tag_name`: The name of the tag we want to find.
+    - `default`: The default value if we can not find the tag, or it has no
+                 text.
+    """
+    return element_text(first_child(node, tag_name), default)
+
+####################################################################
 #
-class ScraperParser(object):
+def first_child(tree, name, recurse = False):
     """
-    A parser for xbmc/plex scraper xml files.
+    Return the first child element with the given name. If `recurse`
+    is True then we do a depth first recursion looking for elements
+    with the given name. Tag names are compared case insensitively.
+
+    Arguments:
+    - `name`: name of the element to look for.
+    - `recurse`: do we look through the entire tree, depth first, for this
+                 element?
     """
+    name = name.lower()
+    if recurse:
+        elements = tree.iter()
+        elements.next()
+    else:
+        elements = tree
+    for child in elements:
+        if child.tag.lower() == name:
+            return child
+    return None
 
-    # How many buffers do we support. The default seems to be 9, but I
-    # have seen one scraper xml file use 12, and the wiki says 9, but
-    # a forum post says 20...
-    #
-    NUM_BUFFERS = 20
+####################################################################
+#
+def children(tree, name):
+    """
+    Return a list of the child elements of `tree` with the given
+    name, in document order.
 
-    ##################################################################
-    #
-    def __init__(self, xml_document, logger = logging.getLogger()):
-        self.logger = logging.getLogger(logger.name + ".ScraperParser")
+    Like first_child() the first one is found case insensitively, but
+    after that only elements whose name is exactly `name` count. This
+    is how scraper definitions and outputs have always been read.
 
-        self.dom = parseString(xml_document)
-        self.doc = first_child(self.dom, "scraper")
-        if self.doc is None:
-            raise BadXML("The scraper XML document's first child is "
-                         "NOT <scraper>")
+    Arguments:
+    - `tree`: The element whose children we are going to search.
+    - `name`: The name of the elements we are looking for.
+    """
+    lower = name.lower()
+    result = []
+    for child in tree:
+        if result:
+            if child.tag == name:
+                result.append(child)
+        elif child.tag.lower() == lower:
+            result.append(child)
+    return result
 
-        self.name = self.doc.getAttribute("name").lower()
-        self.content = self.doc.getAttribute("content").lower()
+####################################################################
+#
+def step_elements(element):
+    """
+    Return the list of the elements of the <RegExp> steps nested
+    directly in the given <RegExp> or function element. If there are
+    no <RegExp>'s a <clear> is run in their place.
 
-        if self.name == "" or self.content == "":
-            raise BadXML("The <scraper> tag must have both a 'name' and "
-                         " 'content' attribute.")
+    Arguments:
+    - `element`: The <RegExp> or function element.
+    """
+    steps = children(element, "RegExp")
+    if not steps:
+        steps = children(element, "clear")[:1]
+    return steps
 
-        if self.content not in ("movies", "tvshows"):
-            raise BadXML("The <scraper> 'content' attribute must be 'movies' "
-                         "or 'tvshows'. '%s' is not recognized." % \
-                         self.content)
+##################################################################
+##################################################################
+#
+class MemoryCache(object):
+    """
+    A cache of responses for a Fetcher that lives only as long as the
+    process does. When the bodies it holds add up to more than
+    `max_bytes` the least recently used ones are dropped.
+    """
 
-        self.clear_buffers()
+    # By default how many bytes of responses we hold on to.
+    #
+    MAX_BYTES = 32 * 1024 * 1024
 
     ##################################################################
     #
-    def __del__(self):
+    def __init__(self, max_bytes = MAX_BYTES):
         """
+        Arguments:
+        - `max_bytes`: The most bytes of response bodies we hold on to.
         """
-        self.dom.unlink()
-
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
 
     ##################################################################
     #
-    def clear_buffers(self):
-        """
-        Set each parameter buffer to the empty string.
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, body, etag, last_modified, charset = entry
+            if expires is not None and expires < time.time():
+                # An expired entry is only worth keeping if it can be
+                # revalidated.
+                #
+                if etag or last_modified:
+                    self.entries[key] = entry
+                else:
+                    self.size -= len(body)
+                return None
 
-        We create one more then our number because the xml scrapers use a 1
-        based array.
-        """
-        self.m_param = ["" for x in range(self.NUM_BUFFERS + 1)]
-        return
+            # Re-inserting the entry makes it the most recently used.
+            #
+            self.entries[key] = entry
+            return (body, charset)
 
     ##################################################################
     #
-    def set_buffer(self, i, data, append = False):
-        """
-        Set a parameter buffer to given data. This also re-encodes the buffer
-        as an ASCII string replacing unicode references that do not map with
-        XML character references.
+    def get_stale(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, body, etag, last_modified, charset = entry
+            if not (etag or last_modified):
+                return None
+            return (body, etag, last_modified, charset)
 
-        Arguments:
-        - `i`: The 1-based index of the buffer to set.
-        - `data`: The data to set in to the buffer.
-        - `append`: Is the data appended to the buffer (True) or does it
-                    replace the contents of the buffer (False)
-        """
-        if i not in range(1, self.NUM_BUFFERS + 1):
-            raise IndexError("Error: Could not set buffer %d. Must be "
-                             "between 1 and 9" % i)
-        if type(data) == types.UnicodeType:
-            data = data.encode('ascii', 'xmlcharrefreplace')
-        if append:
-            self.logger.debug("set_buffer(%d), appending: %s" % (i,data))
-            self.m_param[i] += data
-        else:
-            self.logger.debug("set_buffer(%d): %s" % (i,data))
-            self.m_param[i] = data
+    ##################################################################
+    #
+    def put(self, key, body, ttl = None, etag = None, last_modified = None,
+            charset = None):
+        if len(body) > self.max_bytes:
+            return
+        expires = None
+        if ttl is not None:
+            expires = time.time() + ttl
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (expires, body, etag, last_modified, charset)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                ign, old = self.entries.popitem(last = False)
+                self.size -= len(old[1])
         return
 
     ##################################################################
     #
-    def get_buffer(self, i):
-        """
-        Return the value of the buffer at the given index.
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        return
 
-        Note: index is 1-based..
+    ##################################################################
+    #
+    def __len__(self):
+        return len(self.entries)
 
-        Arguments:
-        - `i`: 1-based index of parameter buffer to return.
-        """
+##################################################################
+##################################################################
+#
+class DiskCache(object):
+    """
+    A cache of responses for a Fetcher kept in a sqlite database so that
+    it outlives the process, ie: a library rescan run tomorrow does not
+    have to fetch the same detail pages that today's run did.
 
-        if i not in range(1, self.NUM_BUFFERS + 1):
-            raise IndexError("Error: Could not get buffer %d. Must be "
-                             "between 1 and 9" % i)
-        return self.m_param[i]
+    When the bodies it holds add up to more than `max_bytes` the least
+    recently used ones are deleted.
+    """
+
+    # By default how many bytes of responses we hold on to.
+    #
+    MAX_BYTES = 256 * 1024 * 1024
 
     ##################################################################
     #
-    def replace_buffers(self, dest):
+    def __init__(self, path, max_bytes = MAX_BYTES):
         """
-        In the string `dest` replace all occurrences of `$$1` through
-        `$$<n>` (where n == NUM_BUFFERS) with the contents of the
-        self.m_param list (where $$1 == self.m_param[0])
-
-        We also replace occurrences of the three character string
-        `\\n` with an actual newline (`\n`) Return the resulting string.
-
         Arguments:
-        - `dest`: string to carry out replacements on.
+        - `path`: The file name of the sqlite database. It is created if
+                  it does not exist.
+        - `max_bytes`: The most bytes of response bodies we hold on to.
         """
-        self.logger.debug("replace_buffers: dest string: '%s'" % dest)
-
-        # To keep things simpler we convert everything to simple
-        # strings, keeping intact unicode characters by replacing them
-        # with their XML character references.
-        #
-        if type(dest) == types.UnicodeType:
-            result = dest.encode('ascii', 'xmlcharrefreplace')
-        else:
-            result = dest
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
 
-        # We need to run through the list of parameter buffers backwards
-        # because we need to substitute $$10 before we substitute for $$1.
+        # The fetcher calls us from its worker threads. All use of the
+        # connection is serialized by our lock.
         #
-        for i in range(self.NUM_BUFFERS, -1, -1):
-            buff = self.m_param[i]
-            if type(buff) == types.UnicodeType:
-                buff = buff.encode('ascii', 'xmlcharrefreplace')
-            result = result.replace("$$%d" % i, buff)
-
-        self.logger.debug("replace_buffers: after replace: '%s'" % result)
-        result = result.replace(r'\\n', '\n')
-
-        # And replace our $INFO[<foo>] matches with their settings value.
+        self.db = sqlite3.connect(self.path, check_same_thread = False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                        "key TEXT PRIMARY KEY, body BLOB, size INTEGER, "
+                        "expires REAL, accessed REAL, etag TEXT, "
+                        "last_modified TEXT, charset TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed "
+                        "ON responses (accessed)")
+
+        # Caches made before we kept the validators and the charsets of
+        # responses do not have their columns.
         #
-        result = setting_re.sub(self.replace_setting, result)
-        return result
+        columns = [row[1] for row in
+                   self.db.execute("PRAGMA table_info(responses)")]
+        for column in ("etag", "last_modified", "charset"):
+            if column not in columns:
+                self.db.execute("ALTER TABLE responses ADD COLUMN %s TEXT" % \
+                                column)
+        self.db.commit()
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) "
+                                    "FROM responses").fetchone()[0]
 
     ##################################################################
     #
-    def check_condition(self, element):
-        """
-        <RegExp> statements may have a 'conditional' attribute. This attribute
-        is a test we need to apply to see if we should or should not evaluate
-        this expression.
-
-        If the condition named in the conditional attribute is set to 'True'
-        in our dict, then we return True, unless the conditional attribute
-        begins with a '!' in which case we invert the logic of our test.
-
-        If a conditional attribute does not exist in our conditions, it is the
-        same as it being set to 'False'.
-
-        Arguments:
-        - `element`: The element we are checking the conditional attribute of
-        """
-        conditional = element.getAttribute("conditional")
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT body, size, expires, etag, "
+                                  "last_modified, charset FROM responses "
+                                  "WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            body, size, expires, etag, last_modified, charset = row
+            if expires is not None and expires < now:
+                # An expired entry is only worth keeping if it can be
+                # revalidated.
+                #
+                if not (etag or last_modified):
+                    self.db.execute("DELETE FROM responses WHERE key = ?",
+                                    (key,))
+                    self.size -= size
+                body = None
+            else:
+                self.db.execute("UPDATE responses SET accessed = ? "
+                                "WHERE key = ?", (now, key))
+            self.db.commit()
+        if body is None:
+            return None
+        if charset is not None:
+            charset = str(charset)
+        return (str(body), charset)
 
-        # No condition, then we execute this statement.
-        #
-        if len(conditional) == 0:
-            return True
+    ##################################################################
+    #
+    def get_stale(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT body, etag, last_modified, "
+                                  "charset FROM responses WHERE key = ?",
+                                  (key,)).fetchone()
+        if row is None or not (row[1] or row[2]):
+            return None
 
-        # We have a conditional. See if it begins with a '!', which inverts
-        # our test.
+        # sqlite gives us back unicode. The headers we send are str.
         #
-        result = True
-        oc = conditional
-        if conditional[0] == '!':
-            result = False
-            conditional = conditional[1:]
+        body, etag, last_modified, charset = row
+        if etag is not None:
+            etag = str(etag)
+        if last_modified is not None:
+            last_modified = str(last_modified)
+        if charset is not None:
+            charset = str(charset)
+        return (str(body), etag, last_modified, charset)
 
-        if self.settings is not None and conditional in self.settings.ids:
-            if self.settings.value(conditional) is True:
-                return result
-            return not result
-        return not result
+    ##################################################################
+    #
+    def put(self, key, body, ttl = None, etag = None, last_modified = None,
+            charset = None):
+        if len(body) > self.max_bytes:
+            return
+        now = time.time()
+        expires = None
+        if ttl is not None:
+            expires = now + ttl
+        with self.lock:
+            row = self.db.execute("SELECT size FROM responses WHERE key = ?",
+                                  (key,)).fetchone()
+            if row is not None:
+                self.size -= row[0]
+            self.db.execute("INSERT OR REPLACE INTO responses "
+                            "(key, body, size, expires, accessed, etag, "
+                            "last_modified, charset) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (key, sqlite3.Binary(body), len(body), expires,
+                             now, etag, last_modified, charset))
+            self.size += len(body)
+            self.evict()
+            self.db.commit()
+        return
 
     ##################################################################
     #
-    def replace_setting(self, matchobj):
+    def evict(self):
         """
-        This method is intended to be called as an argument to the
-        regular expression object's 'sub()' method.
-        
-        After we have run our data through the regular expression
-        parser which builds up an XML string to return to our caller
-        we need to resolve any variable references that are in the
-        string.
-
-        ie: where '$INFO[<foo>]' appears in the input string we
-        replace with the value of the setting '<foo>' from our
-        settings.
-
-        If we come across a $INFO[<foo>] not in our settings we will
-        raise a KeyError.
-
-        NOTE: It is arguable that in production we should just stick
-              an empty string in place of settings we do not have.
-        
-        Arguments:
-        - `matchobj`: The re matchobj that matches our pattern
+        Delete the least recently used entries until we are back under
+        our size limit. Our caller holds our lock.
         """
-        # If the first (and only) match group contains the name of the
-        # setting that is going to provide the value to replace.
-        #
-        return self.settings.values[matchobj.group(1)]
+        while self.size > self.max_bytes:
+            rows = self.db.execute("SELECT key, size FROM responses "
+                                   "ORDER BY accessed LIMIT 32").fetchall()
+            if len(rows) == 0:
+                self.size = 0
+                break
+            for key, size in rows:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+                if self.size <= self.max_bytes:
+                    break
+        return
 
     ##################################################################
     #
-    def parse_expression(self, regexp_elt):
-        """
-
-        NOTE: The 'output' of this function is the side effect of running the
-              'replace_buffers()' method, the input being the parsed and
-              filled 'output' attribute format statement.
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.commit()
+            self.size = 0
+        return
 
-        Arguments:
-        - `regexp_elt`: The <RegExp> node that we are going to process.
+    ##################################################################
+    #
+    def close(self):
         """
-        # The input to our expression is an attribute of the regexp node
-        # which we perform a buffer replace on. This lets us feed the output
-        # of other regexp's in to this one provided our caller put the correct
-        # data in to the correct buffer.
-        #
-        # If the <RegExp> does not have an input attribute, we just snarf
-        # buffer 1 for our input.
-        #
-        input_data = regexp_elt.getAttribute("input")
-        self.logger.debug("%s++++ Entered parse expression, input='%s'" % \
-                              ("  "*self.regexp_level, input_data))
-        if len(input_data) > 0:
-            input_data = self.replace_buffers(input_data)
-        else:
-            input_data = self.get_buffer(1)
-
-        # The 'dest' attribute contains two bits of information: what buffer
-        # is the data written to, and do we append new data to the buffer or
-        # replace its contents.
-        #
-        # Think of 'dest' as the 'return value' buffer. It is where whoever
-        # called this <RegExp> node wants the output of processing this
-        # <RegExp> to be stored.
-        #
-        # If the attribute has a "+" at the end, we want to append to
-        # the buffer.
-        #
-        # NOTE: Buffers are defined as being 1-based, not 0-based..
-        #
-        append = False
-        dest_buffer = regexp_elt.getAttribute("dest")
-        if len(dest_buffer) == 0:
-            dest_buffer = 1
-        else:
-            if dest_buffer[-1] == "+":
-                append = True
-                dest_buffer = dest_buffer[:-1]
-            dest_buffer = int(dest_buffer)
-#             if not append:
-#                 # If we are NOT appending, then we clear the buffer to make
-#                 # sure that stray input does not leak to the output if we do
-#                 # not actually end up setting the destination buffer in this
-#                 # function.
-#                 #
-#                 self.set_buffer(dest_buffer, "")
-
-        # output is our format string that describes how we want the data
-        # we scrape outputted.
-        #
-        output_pattern = regexp_elt.getAttribute("output")
-        output_pattern = self.replace_buffers(output_pattern)
-        expression = first_child(regexp_elt, "expression")
-
-        # If they have no <expression> tag then we have nothing to parse.
-        #
-        if not expression:
-            return
-        if expression.firstChild:
-            str_expression = expression.firstChild.data
-            str_expression = setting_re.sub(self.replace_setting,
-                                             str_expression)
-        else:
-            str_expression = "(.*)"
-
-        attrs = expression.attributes
-        attrlist = []
-        if attrs:
-            for i in range(attrs.length):
-                a = attrs.item(i)
-                attrlist.append("%s='%s'" % (a.name, regexp_elt.getAttribute(a.name)))
-        self.logger.debug("%sparse_expression, pattern: '%s', %s" % \
-                              ("  "*self.regexp_level, output_pattern, ", ".join(attrlist)))
-        str_expression = self.replace_buffers(str_expression)
-        expression_re = re.compile(str_expression, re.DOTALL)
-
-        # Do we match the expression just once (repeat == False)?
-        #
-        repeat = False
-        if expression.getAttribute("repeat").lower() == "yes":
-            repeat = True
-
-        # If the expression does not matches and 'clear' is set, upon leaving
-        # this function, this buffer must empty, so we just empty it now.
-        #
-        if expression.getAttribute("clear").lower() == "yes":
-            self.set_buffer(dest_buffer, "")
-
-        # Do we clean (strip HTML, ANSIfy, etc) the respective regexp
-        # match group (by default, yes we do.)
-        #
-        clean = [True,True,True,True,True,True,True,True,True]
-        for c in expression.getAttribute("noclean").split(','):
-            if c in ('1','2','3','4','5','6','7','8','9'):
-                clean[int(c)-1] = False
-
-        # Do we trim trailing (leading too?) white space from the respective
-        # regexp match group (by default, no we do not.)
-        #
-        trim = [False,False,False,False,False,False,False,False,False]
-        for c in expression.getAttribute("trim").split(','):
-            if c in ('1','2','3','4','5','6','7','8','9'):
-                trim[int(c)-1] == True
+        Close our database connection.
+        """
+        with self.lock:
+            self.db.close()
+        return
 
-        optional = get_int_attribute(expression, "optional", None)
-        compare = get_int_attribute(expression, "compare", None)
-        if compare:
-            self.set_buffer(compare, self.get_buffer(compare).lower())
+    ##################################################################
+    #
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
 
-        # For every \<n> that occurs in our output string that is meant to be
-        # cleaned or trimmed quote it with '!!!CLEAN!!!' and '!!!TRIM!!!'
-        # respectively so that we know post processing what sections we need
-        # to clean or trim.
-        #
-        # XXX maybe we should just 'clean' and 'trim' the replacement string
-        #     when we replace \<n> with it, by passing the 'trim' and 'clean'
-        #     arrays in to the 'replace_buffers()' method that does the
-        #     replacements. Be a bit nicer then this hackish way of doing it.
-        #
-        for i_buf in range(0,8):
-            temp = "\\%d" % (i_buf + 1)
-            if clean[i_buf]:
-                output_pattern = output_pattern.replace(temp,
-                                        "!!!CLEAN!!!" + temp + "!!!CLEAN!!!")
-            if trim[i_buf]:
-                output_pattern = output_pattern.replace(temp,
-                                        "!!!TRIM!!!" + temp + "!!!TRIM!!!")
+##################################################################
+##################################################################
+#
+class HTTPSession(object):
+    """
+    The HTTP layer under our Fetcher.
 
+    We talk to the same few hosts over and over again so instead of
+    opening a new connection for every request, the way urllib2 does, we
+    keep the connections we have finished with open and reuse them for
+    later requests to the same host. We also ask for compressed responses
+    and uncompress them, and follow redirects.
 
-        self.logger.debug("parse_expression: for re '%s', output pattern is: '%s'" % (str_expression, output_pattern))
-        # For every match of our expression re in the current input do..
-        #
-        for m in expression_re.finditer(input_data):
-            dbg = []
-            for g in m.groups():
-                if g is not None:
-                    dbg.append(g[:20])
-            self.logger.debug("parse_expression: matched: %s" % repr(dbg))
+    Responses whose content type is one of SPOOL_TYPES (the zip archives
+    some sites serve their data as) are not read in to memory. They are
+    streamed in to a temporary file that is only kept in memory while it
+    is small.
 
-            # If we are not appending to our destination buffer, be sure to
-            # clear it.. this is in case nothing matches and we end up not
-            # setting anything in the buffer. Since we are looping, every
-            # additional match we need to append (in this function)
-            #
-            if not append:
-                self.set_buffer(dest_buffer, "")
-                append = True
+    Proxies are taken from the environment, like urllib2 does.
+    """
 
-            # This block of code is very confusing. It basically seems to
-            # remove the '\<n>'
-            if optional:
-                self.logger.debug("Need the optional param in buffer "
-                                  "\\%d" % optional)
-                param = m.expand(r'\%d' % optional)
-                m2 = optional_re.search(output_pattern)
-                raise NotImplemented
+    # By default how many seconds we wait for a connection to be made,
+    # and for a response once it has been.
+    #
+    CONNECT_TIMEOUT = 10
+    READ_TIMEOUT = 30
 
-#                 sz_param = m.group(optional)
-#                 reg2 = re.compile("(.*)(\\\\\\(.*\\\\2.*)\\\\\\)(.*)",re.DOTALL)
-#                 m2 = reg2.search(output_pattern)
-#                 if m2:
-#                     if szParam and szParam != "":
-#                         output_pattern = output_pattern[:m2.start(2)] + \
-#                             output_pattern[m2.end(2):]
-#                     else:
-#                         # output_pattern = output_pattern
-#                         # bloody confusing
-#                         pass
+    # How many redirects we follow for a single request, and the most
+    # idle connections we keep open to any one host.
+    #
+    MAX_REDIRECTS = 5
+    MAX_IDLE = 4
 
-            i_len = len(m.group(1))
-            try:
-                result = m.expand(output_pattern)
-#                 self.logger.debug("parse_expression: result: %s" % result)
-            except re.error:
-                result = None
-            if result is not None and len(result) > 0:
-                result = self.clean(result)
-                result = self.replace_buffers(result)
-#                 self.logger.debug("parse_expression: after cleaning: %s" % result)
-                if compare is not None:
-                    if result.lower().find(self.get_buffer(compare)) != -1:
-                        self.set_buffer(dest_buffer, result, append)
-                else:
-                    self.set_buffer(dest_buffer, result, append)
+    # The content types of the responses we spool, how big a spooled
+    # response gets before it goes to disk, and how much of it we read at
+    # a time.
+    #
+    SPOOL_TYPES = ("application/zip",)
+    SPOOL_BYTES = 1024 * 1024
+    CHUNK_BYTES = 64 * 1024
 
-            # If repeat is not set then we exit after one iteration
-            # through all the patterns that matched our regexp.
-            #
-            if not repeat:
-                break
-        self.logger.debug("parse_expression: output: buffer: %d, '%s'" % (dest_buffer,self.get_buffer(dest_buffer)))
-        self.logger.debug("%s---- Leaving parse expression" % ("  "*self.regexp_level))
-        return
+    USER_AGENT = "Python-urllib/%s" % urllib2.__version__
 
     ##################################################################
     #
-    def parse_regexp(self, regexp_elt):
+    def __init__(self, connect_timeout = CONNECT_TIMEOUT,
+                 read_timeout = READ_TIMEOUT, proxies = None,
+                 logger = logging.getLogger()):
         """
-
         Arguments:
-        - `regexp_elt`:
+        - `connect_timeout`: Seconds to wait for a connection to be made.
+        - `read_timeout`: Seconds to wait on a connection once it is made.
+        - `proxies`: A dict of scheme to proxy url. If None we use the
+                     proxies set in the environment.
         """
+        self.logger = logging.getLogger(logger.name + ".HTTPSession")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.proxies = proxies
+        if self.proxies is None:
+            self.proxies = urllib.getproxies()
+        self.idle = { }
+        self.lock = threading.Lock()
 
-        self.regexp_level += 1
-        self.logger.debug("%s^^^ entering parse_regexp" % "  "*self.regexp_level)
-        # We loop over regexp_elt and its sibling <RegExp> elements
-        # until there are no more.
-        #
-        while regexp_elt:
-
-            # XXX Debugging
-            attrs = regexp_elt.attributes
-            attrlist = []
-            if attrs:
-                for i in range(attrs.length):
-                    a = attrs.item(i)
-                    attrlist.append("%s='%s'" % (a.name, regexp_elt.getAttribute(a.name)))
-            self.logger.debug("%sregexp, %s" % ("  "*self.regexp_level, ", ".join(attrlist)))
+    ##################################################################
+    #
+    def connection(self, scheme, host):
+        """
+        Return a connection for a request to the given host, and the key
+        it goes back in to our idle connections under when the request is
+        done. If we have an idle connection we return that, otherwise we
+        make a new one.
 
-            # We skip regexp's whose condition does not evaluate to True
-            #
-            if self.check_condition(regexp_elt):
-                # If this element has a child <RegExp> element, then loop
-                # over it and its sibling <RegExp> elements, performing a
-                # depth-first parsing of <RegExp> elements.
-                #
-                child_regexp_elt = first_child(regexp_elt, "RegExp")
-                if child_regexp_elt:
-                    self.logger.debug("parse_regexp: recursing")
-                    self.parse_regexp(child_regexp_elt)
-                    self.logger.debug("parse_regexp: finished recursion")
-                else:
-                    child_regexp_elt = first_child(regexp_elt, "clear")
-                    if child_regexp_elt:
-                        self.parse_regexp(child_regexp_elt)
+        Arguments:
+        - `scheme`: 'http' or 'https'
+        - `host`: The host (and port) the request is for.
+        """
+        proxy = None
+        if scheme in self.proxies and \
+                not urllib.proxy_bypass(host.split(":")[0]):
+            proxy = urlparse.urlsplit(self.proxies[scheme])[1]
+        key = (scheme, host, proxy)
+
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return key, idle.pop(), True
+
+        if scheme == "https":
+            if proxy:
+                conn = httplib.HTTPSConnection(proxy,
+                                               timeout = self.connect_timeout)
+                conn.set_tunnel(host)
+            else:
+                conn = httplib.HTTPSConnection(host,
+                                               timeout = self.connect_timeout)
+        else:
+            conn = httplib.HTTPConnection(proxy or host,
+                                          timeout = self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return key, conn, False
 
-                # Parse this <RegExp> node..
-                #
-                self.parse_expression(regexp_elt)
+    ##################################################################
+    #
+    def release(self, key, conn):
+        """
+        Put a connection we are done with back with our idle connections
+        so that the next request for the same host can use it.
 
-            # And loop until we run out of sibling <RegExp> nodes.
-            #
-            regexp_elt = next_sibling(regexp_elt, "RegExp")
-        self.logger.debug("%svvv leaving parse_regexp" % "  "*self.regexp_level)
-        self.regexp_level -= 1
+        Arguments:
+        - `key`: The key connection() returned with the connection.
+        - `conn`: The connection.
+        """
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.MAX_IDLE:
+                idle.append(conn)
+                return
+        conn.close()
         return
 
     ##################################################################
     #
-    def parse(self, tag_name, settings = None):
+    def request(self, method, url, data = None, headers = { }):
         """
+        Make one request, without following redirects. Returns the
+        response with its body read (and uncompressed) in to its 'body'
+        attribute. For a response that we spool 'body' is the file it was
+        spooled in to (see spool().)
 
         Arguments:
-        - `tag_name`: The name of the tag we wish to parse.
+        - `method`: 'GET' or 'POST'
+        - `url`: The absolute url to make the request of.
+        - `data`: The body of a POST request.
+        - `headers`: Any additional headers to send.
         """
-        self.settings = settings
-
-        child_element = first_child(self.doc, tag_name)
-        if child_element is None:
-            raise BadXML("No such tag <%s>" % tag_name)
+        o = urlparse.urlsplit(url)
+        scheme = o.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise BadURL("Can not fetch '%s', only http and https "
+                         "URL's are supported." % url)
+
+        all_headers = { "User-Agent" : self.USER_AGENT,
+                        "Accept-Encoding" : "gzip, deflate" }
+        all_headers.update(headers)
+        if data is not None:
+            all_headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        # A connection we reuse may have been closed by the server while
+        # it sat idle. If so we try again, once, with a new connection.
+        #
+        while True:
+            conn = None
+            reused = False
+            try:
+                key, conn, reused = self.connection(scheme, o.netloc)
 
-        result_buffer = get_int_attribute(child_element, "dest", 1)
-        self.logger.debug("parse: Parsing tag <%s>, dest buffer: %d" % \
-                          (tag_name, result_buffer))
+                # Only a request sent to a plain http proxy uses the
+                # absolute url.
+                #
+                path = url
+                if key[2] is None or scheme == "https":
+                    path = urlparse.urlunsplit(("", "", o.path or "/",
+                                                o.query, ""))
+                conn.request(method, path, data, all_headers)
+                response = conn.getresponse()
+                content_type = response.getheader("Content-Type") or ""
+                if content_type.split(";")[0].strip().lower() in \
+                        self.SPOOL_TYPES:
+                    response.body = self.spool(response, method, url)
+                else:
+                    response.body = response.read()
+                break
+            except (httplib.HTTPException, socket.error), e:
+                if conn is not None:
+                    conn.close()
+                if reused and not isinstance(e, socket.timeout):
+                    continue
+                raise FetchFailed("%s %s: %s" % (method, url, e))
+            except FetchFailed:
+                # The body could not be uncompressed, and we do not know
+                # how much of it was left unread.
+                #
+                conn.close()
+                raise
 
-        # Now we loop over the <RegExp> elements under <'tag_name'>
-        # doing our 'prepare_parse' call on those.
-        #
-        # NOTE: regexp_level is entirely for debugging so we can
-        #       printout how deep we are in nested <regexp>'s.
-        #
-        self.regexp_level = 0
-        self.parse_regexp(first_child(child_element, "RegExp"))
+        if response.will_close:
+            conn.close()
+        else:
+            self.release(key, conn)
 
-        # our return result is the contents of the parameter buffer.
-        # We clear the buffers after we are done our work.
-        #
-        # NOTE: 'dest' is 1-9, not 0-8
+        # A spooled response was uncompressed as it was read.
         #
-        result = self.get_buffer(result_buffer)
-        self.logger.debug("parse tag <%s>, result: '%s'" % (tag_name, result))
+        if not isinstance(response.body, str):
+            return response
 
-#         if child_element.getAttribute("clearbuffers").lower() != "no":
-#             self.clear_buffers()
-        self.clear_buffers()
-        result = setting_re.sub(self.replace_setting, result)
-        self.logger.debug("parse, 2nd check tag <%s>, result: '%s'" % (tag_name,result))
-        return result
+        encoding = (response.getheader("Content-Encoding") or "").lower()
+        try:
+            if encoding == "gzip":
+                response.body = zlib.decompress(response.body,
+                                                16 + zlib.MAX_WBITS)
+            elif encoding == "deflate":
+                # Some servers send a raw deflate stream instead of a zlib
+                # one.
+                #
+                try:
+                    response.body = zlib.decompress(response.body)
+                except zlib.error:
+                    response.body = zlib.decompress(response.body,
+                                                    -zlib.MAX_WBITS)
+        except zlib.error, e:
+            raise FetchFailed("%s %s: bad %s content: %s" % \
+                              (method, url, encoding, e))
+        return response
 
     ##################################################################
     #
-    def clean_substr(self, match_obj):
+    def spool(self, response, method, url):
         """
-        Clean a substring by stripping out HTML and converting entity
-        references to ANSI characters. Used by 'self.clean()'.
-
-        Returns the cleaned substring.
+        Read the body of the given response, uncompressing it as we go if
+        it is compressed, in to a temporary file and return that file,
+        positioned at its start.
 
         Arguments:
-        - `match_obj`: The regexp match object whose group(1) needs to be
-                       cleaned.
+        - `response`: The response whose body we read.
+        - `method`: The method of the request, for our error messages.
+        - `url`: The url of the request, for our error messages.
         """
-        x = MLStripper()
-        x.feed(match_obj.group(1).strip())
-        return x.get_fed_data()
+        encoding = (response.getheader("Content-Encoding") or "").lower()
+        decompressor = None
+        if encoding == "gzip":
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        spooled = tempfile.SpooledTemporaryFile(self.SPOOL_BYTES)
+        try:
+            while True:
+                chunk = response.read(self.CHUNK_BYTES)
+                if not chunk:
+                    break
+                if encoding == "deflate" and decompressor is None:
+                    # Some servers send a raw deflate stream instead of a
+                    # zlib one. A zlib stream starts with a header whose
+                    # first two bytes are a multiple of 31.
+                    #
+                    wbits = -zlib.MAX_WBITS
+                    if len(chunk) >= 2 and ord(chunk[0]) & 0x0f == 8 and \
+                            (ord(chunk[0]) * 256 + ord(chunk[1])) % 31 == 0:
+                        wbits = zlib.MAX_WBITS
+                    decompressor = zlib.decompressobj(wbits)
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk)
+                spooled.write(chunk)
+            if decompressor is not None:
+                spooled.write(decompressor.flush())
+        except zlib.error, e:
+            spooled.close()
+            raise FetchFailed("%s %s: bad %s content: %s" % \
+                              (method, url, encoding, e))
+        except:
+            spooled.close()
+            raise
+        spooled.seek(0)
+        return spooled
 
     ##################################################################
     #
-    def trim_substr(self, match_obj):
+    def open(self, method, url, data = None, headers = { }):
         """
-        Trims a substring by stripping out trailing white space in the first
-        match group. Used by 'self.clean()'.
+        Make a request, following any redirects. Returns the final
+        response with its body read in to its 'body' attribute.
 
-        Returns the trimmed group 1 substring.
+        If the final response is an error we raise FetchFailed.
 
         Arguments:
-        - `match_obj`: The regexp match object whose group(1) needs to be
-                       trimmed.
+        - `method`: 'GET' or 'POST'
+        - `url`: The absolute url to make the request of.
+        - `data`: The body of a POST request.
+        - `headers`: Any additional headers to send.
         """
-        return match_obj.group(1).strip()
+        for i in range(self.MAX_REDIRECTS + 1):
+            response = self.request(method, url, data, headers)
+            location = response.getheader("Location")
+            if response.status not in (301, 302, 303, 307, 308) or \
+                    location is None:
+                break
+            url = urlparse.urljoin(url, location)
+            self.logger.debug("open: redirected to %s" % url)
+
+            # Like browsers (and urllib2) we turn a POST in to a GET when
+            # redirected by anything other than a 307 or 308.
+            #
+            if response.status not in (307, 308):
+                method = "GET"
+                data = None
+        else:
+            raise FetchFailed("%s %s: too many redirects" % (method, url))
+
+        if response.status >= 400:
+            raise FetchFailed("%s %s: %d %s" % (method, url, response.status,
+                                                response.reason))
+        return response
 
     ##################################################################
     #
-    def clean(self, str_dirty):
+    def close(self):
         """
-        This will take a string that may have directives indicating that
-        parts of it need to be 'cleaned' and 'trimmed.' We 'clean' and
-        'trim' those indicated parts of the string and return the result.
-
-        In the string there will be parts of the string quoted by
-        '!!!CLEAN!!!' '!!!CLEAN!!!' and '!!!TRIM!!!' '!!!TRIM!!!.
-
-        The substrings that are surrounded by 'CLEAN' pairs have any
-        HTML in them converted to ANSI.
-
-        The substrings that are surrounded by 'TRIM' have white space
-        trimmed from their end.
-
-        XXX I really need to find a better way to do this.. like
-            cleaning and trimming the argument string before it is put
-            inside our result string.
-
-        Arguments:
-        - `str_dirty`:
+        Close all of our idle connections.
         """
-        i = 0
-        result = ""
-
-        # See if there are any substrings that need to be cleaned.
-        #
-        result = clean_re.sub(self.clean_substr, str_dirty)
-        result = trim_re.sub(self.trim_substr, result)
+        with self.lock:
+            idle = self.idle
+            self.idle = { }
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+        return
 
-        # The regular expression only matches cases where there was a
-        # non-emptry string to be cleaned and trimmed, so we do
-        # another pass that just removes any "!!!CLEAN!!!!!!CLEAN!!!"
-        # from the string.
-        #
-        result = result.replace("!!!CLEAN!!!!!!CLEAN!!!", "")
-        result = result.replace("!!!TRIM!!!!!!TRIM!!!", "")
+##################################################################
+##################################################################
+#
+class InFlight(object):
+    """
+    A request that one of the Fetcher's threads is making. Any other
+    thread that wants the response to the same request waits for it to
+    be done and uses its result (or raises its exception) instead of
+    making the request again.
+    """
 
-        return result
+    ##################################################################
+    #
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
 
 ##################################################################
 ##################################################################
 #
-class Settings(object):
+class Fetcher(object):
+    """
+    The fetch engine behind ScrapeURL.get().
+
+    Getting the details for a show, running a movie's custom functions, or
+    getting a series' episode guide each need the contents of several
+    URL's before the parser can do anything with them. The fetcher lets us
+    get all of those at the same time, using a pool of worker threads,
+    instead of one after the other.
+
+    So that we do not hammer any one site there is also a limit on how
+    many requests we will have outstanding to any one host at a time, and
+    a request that is already being made for one URL (ie: the credits page
+    that several of IMDb's custom functions share) is not made again for
+    another at the same time. The second waits for the response to the
+    first.
+
+    If the fetcher has a cache the responses to its requests are kept
+    there for `ttl` seconds and requests that have a response in the
+    cache are not made at all. Once a response that had an ETag or a
+    Last-Modified header expires the next request for it is made
+    conditional, so if it has not changed the server need only say so.
+
+    The cache may be a MemoryCache, a DiskCache, or anything else with
+    their methods:
+
+    - get(key): The tuple (body, charset) of the entry stored under the
+      key (see request_key()), or None if there is no such entry or it
+      has expired.
+    - get_stale(key): The tuple (body, etag, last_modified, charset) of
+      the entry stored under the key whether it has expired or not, or
+      None if there is no such entry or it has neither an ETag nor a
+      Last-Modified to revalidate it with.
+    - put(key, body, ttl = None, etag = None, last_modified = None,
+          charset = None):
+      Store the body under the key for `ttl` seconds (None for ever),
+      along with the ETag and Last-Modified of its response and the
+      charset of its text.
+    - clear(): Remove every entry.
+
+    What is stored is the body after we have unzipped it, as bytes, and
+    the charset it is in. We decode it in to unicode, which is what the
+    parser works on, when we take it out (see decode())
     """
-    Scrapers can have settings. The purpose of this class is to hold
-    the definition of those setting as given by the scraper so that
-    other code can interrogate them for dispaly and setting in a UI.
 
-    A setting definition has a label, id, type, value, and optionally
-    a default.
+    # By default, how many worker threads we fetch with and how many
+    # requests we will make to a single host at the same time.
+    #
+    WORKERS = 4
+    PER_HOST = 2
 
-    The settings object also holds the current state of the settings
-    as well as their default.
+    # By default how many seconds a response is kept in our cache.
+    #
+    TTL = 24 * 60 * 60
 
-    XXX I wonder if we should have a 'setting' class that is an
-        individual setting instead of a settings class. I am using a
-        settings class that holds all of the settings to make the
-        parsing of the settings definitions and passing them around a
-        little more collected.
-    """
+    # How far in to an HTML or XML document we look for a declaration of
+    # the charset it is in.
+    #
+    SNIFF_BYTES = 2048
 
     ##################################################################
     #
-    def __init__(self, settings_xml):
+    def __init__(self, workers = WORKERS, per_host = PER_HOST,
+                 logger = logging.getLogger(), cache = None, ttl = TTL,
+                 session = None):
         """
-        A settings object is initialized with the '<settings>' XML
-        output of the scraper. We take this and parse it into a set of
-        dictionaries that describe the settings and their values. The
-        key for these dictionaries is the setting id.
+        Arguments:
+        - `workers`: The number of worker threads to fetch URL's with.
+        - `per_host`: The most requests we make to one host at a time.
+        - `cache`: The cache to keep responses in (see above.) If None
+                   we do not cache responses.
+        - `ttl`: How many seconds a response is kept in our cache.
+        - `session`: The HTTPSession we make our requests with. If None
+                     we create one with the default timeouts.
         """
-        # The list of setting ids.
-        #
-        # XXX This is redundant. We could just get the ids from
-        #     getting the values of any of our dicts.
+        self.logger = logging.getLogger(logger.name + ".Fetcher")
+        self.workers = workers
+        self.per_host = per_host
+        self.cache = cache
+        self.ttl = ttl
+        self.session = session
+        if self.session is None:
+            self.session = HTTPSession(logger = self.logger)
+        self.pool = None
+        self.host_limits = { }
+        self.lock = threading.Lock()
+
+        # The requests being made right now, by request_key(), each an
+        # InFlight.
         #
-        self.ids = []
-        self.values = { }
-        self.types = { }
-        self.defaults = { }
-        self.labels = { }
-
-        if settings_xml:
-            dom = parseString(settings_xml)
-            s = dom.firstChild
+        self.in_flight = { }
 
-            setting = first_child(s, "setting")
-            while setting:
-                setting_id = setting.getAttribute("id")
+    ##################################################################
+    #
+    def host_limit(self, url):
+        """
+        Return the semaphore that limits the number of requests we have
+        outstanding to the host of the given url.
 
-                # I know the 'sep' setting has no id. I am not sure what it is
-                # used for so I am just going to skip it.
-                #
-                if setting_id != "":
-                    self.ids.append(setting_id)
-                    self.labels[setting_id] = setting.getAttribute("label")
-                    self.types[setting_id] = setting.getAttribute("type")
+        Arguments:
+        - `url`: The url string whose host we want the semaphore for.
+        """
+        host = urlparse.urlsplit(url)[1].lower()
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(
+                    self.per_host)
+            return self.host_limits[host]
 
-                    # For bool's actually set the default value to True or
-                    # False.  otherwise it is all strings to us.
-                    #
-                    default = setting.getAttribute("default")
-                    if self.types[setting_id] == "bool":
-                        self.defaults[setting_id] = (default.lower() == 'true')
-                    else:
-                        self.defaults[setting_id] = default
+    ##################################################################
+    #
+    def fetch(self, url, revalidate = False):
+        """
+        Get the content of the given ScrapeURL. Return the content
+        retrieved as a string.
 
-                    # Settings start out with their default value.
-                    #
-                    self.values[setting_id] = self.defaults[setting_id]
-                setting = next_sibling(setting, "setting")
+        NOTE: We will check the url's cache first for the cache key if it
+              has one and use that thus avoiding any network call.
 
-            dom.unlink()
-            dom = None
+        Arguments:
+        - `url`: The ScrapeURL to get the content of.
+        - `revalidate`: If True we ask the server even if we have an
+                        unexpired response in our cache. The request is
+                        conditional if that response can be revalidated.
+        """
+        # If we have a cache_key, see if there is data under that key
+        # in our url cache and use that if there is.
+        #
+        if not revalidate and url.cache_key and url.cache_key in url.cache:
+            return url.cache[url.cache_key]
 
-        # There is always an 'override' setting - "override", which is
-        # set based on the Language Override setting in the scraper.
+        # If the actual URL is the empty string, and we did not have a cached
+        # result for it, then we can not retrieve anything. Return None.
         #
-        if 'override' not in self.ids:
-            self.ids.append("override")
-            self.values["override"] = False
-            self.types["override"] = "bool"
-            self.defaults["override"] = False
-            self.labels["override"] = "Language Override"
+        if url.url is None or len(url.url) == 0:
+            return None
 
-        # The default language for now is english!
+        # If we have already fetched this (and it has not expired) then
+        # we have nothing to do.
         #
-        if 'language' not in self.ids:
-            self.ids.append("language")
-            self.values["language"] = "en"
-            self.types["language"] = "string"
-            self.defaults["language"] = "en"
-            self.labels["language"] = "Language"
+        key = self.request_key(url)
+        if self.cache is not None and not revalidate:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.logger.debug("fetch: %s (cached)" % url.url)
+                result = self.decode(*cached)
+                if url.cache_key:
+                    url.cache[url.cache_key] = result
+                return result
 
-        return
+        # If another thread is making the same request we wait for its
+        # response instead of making the request again. Otherwise we let
+        # the others know that we are making it.
+        #
+        with self.lock:
+            pending = self.in_flight.get(key)
+            making = pending is None
+            if making:
+                pending = InFlight()
+                self.in_flight[key] = pending
+
+        if making:
+            try:
+                pending.result = self.retrieve(url, key)
+            except Exception, e:
+                pending.error = e
+                raise
+            finally:
+                with self.lock:
+                    del self.in_flight[key]
+                pending.done.set()
+        else:
+            self.logger.debug("fetch: %s (already being fetched)" % url.url)
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+        result = pending.result
+
+        # Only some of the members of a zip archive are not what anyone
+        # else looking under the url's cache key expects to find.
+        #
+        if url.cache_key and url.members is None:
+            url.cache[url.cache_key] = result
+        return result
 
     ##################################################################
     #
-    def value(self, setting_id):
+    def retrieve(self, url, key):
         """
-        Return the value of the given setting.
+        Make the request for the given ScrapeURL (conditional if we have
+        a stale response to it that we can revalidate), put the response
+        in our cache, and return its content, decoded. See fetch()
 
         Arguments:
-        - `setting_id`: The string id for this setting. If the setting
-                        does not exist we go out on a limb and return False.
+        - `url`: The ScrapeURL to get the content of.
+        - `key`: The request_key() of the url.
         """
-        if setting_id not in self.values:
-            return False
-        return self.values[setting_id]
+        method, target, data = self.request_parts(url)
+        stale = None
+        if self.cache is not None and method == "GET":
+            stale = self.cache.get_stale(key)
+
+        # If 'spoof_url' is NOT None, then we
+        # want our request to use the 'spoof_url' as its referrer
+        #
+        headers = { }
+        if url.spoof_url:
+            headers['Referer'] = url.spoof_url
+
+        # If we have a response we can revalidate we only want it sent
+        # again if it has changed.
+        #
+        if stale is not None:
+            ign, etag, last_modified, ign = stale
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        # If we ARE using 'POST' then the parameters from the URL are
+        # sent as the body of the request.
+        #
+        if method != "POST":
+            data = None
+
+        with self.host_limit(url.url):
+            self.logger.debug("fetch: %s" % url.url)
+            response = self.session.open(method, target, data, headers)
+
+        if response.status == 304 and stale is not None:
+            self.logger.debug("fetch: %s (not modified)" % url.url)
+            body, etag, last_modified, charset = stale
+            etag = response.getheader("ETag", etag)
+            last_modified = response.getheader("Last-Modified", last_modified)
+        else:
+            content_type = response.getheader("Content-Type", "")
+            body = self.read_response(content_type, response.body,
+                                      url.members)
+            charset = self.charset(content_type, body)
+            etag = response.getheader("ETag")
+            last_modified = response.getheader("Last-Modified")
+
+        if self.cache is not None:
+            self.cache.put(key, body, self.ttl, etag, last_modified, charset)
+        return self.decode(body, charset)
 
     ##################################################################
     #
-    def set_value(self, setting_id, value):
+    def request_parts(self, url):
         """
-        Set the given setting to the given value.
+        Return the method, url and POST data of the request we make for
+        the given ScrapeURL.
 
-        NOTE: You can only set values for id's that exist.
-
-        XXX We should do type checking on the value.
+        When a ScrapeURL says to use 'POST' the query parameters of its url
+        are sent as the body of the request instead.
 
         Arguments:
-        - `setting_id`: The id for the setting..
-        - `value`: The value to set it to.
+        - `url`: The ScrapeURL we are making a request for.
         """
-        if setting_id not in self.values:
-            raise KeyError
-
-        if self.types[setting_id] == "bool":
-            self.values[setting_id] = (value.lower() == 'true')
-        else:
-            self.defaults[setting_id] = value
-        return
+        if not url.use_post:
+            return ("GET", url.url, "")
+        o = urlparse.urlsplit(url.url)
+        return ("POST", o.scheme + "://" + o.netloc + o.path, o.query)
 
     ##################################################################
     #
-    def reset(self, setting_id = None):
+    def request_key(self, url):
         """
-        Reset a setting to its default value. If no id is given then all
-        of the values are reset to their defaults.
+        Return the key the response to the request for the given
+        ScrapeURL is stored under in our cache. It is a digest of the
+        method, url, POST data, and referrer of the request, and the zip
+        archive members we want from its response.
 
         Arguments:
-        - `setting_id`: The id to reset.
+        - `url`: The ScrapeURL we are making a request for.
         """
-        if setting_id is None:
-            self.values = self.defaults.copy()
-        else:
-            self.values[setting_id] = self.defaults[setting_id]
-        return
+        parts = list(self.request_parts(url))
+        parts.append(url.spoof_url or "")
+        if url.members is not None:
+            parts.extend(url.members)
+        parts = [p.encode("utf-8") if isinstance(p, unicode) else p
+                 for p in parts]
+        return hashlib.sha1("\n".join(parts)).hexdigest()
 
     ##################################################################
     #
-    def __str__(self):
-        result = []
-        for setting_id in self.ids:
-            result.append("id: %s, label: '%s', type: %s, default: '%s', " \
-                              "value: '%s'" % (setting_id,
-                                               self.labels[setting_id],
-                                               self.types[setting_id],
-                                               self.defaults[setting_id],
-                                               self.values[setting_id]))
-        return "< Setting: %s >" % "; ".join(result)
+    def read_response(self, content_type, body, members = None):
+        """
+        Return the body of the response to one of our requests, unzipped
+        if it is a zip archive, as a string of bytes.
 
-##################################################################
-##################################################################
-#
-class Scraper(object):
-    """
-    The work horse object that is given an XML file, a show name, and
-    what data to extract via the scraper defined in the XML file.
-    """
+        Arguments:
+        - `content_type`: The Content-Type header of the response.
+        - `body`: The body of the response. Either a string or the file
+                  the session spooled it in to.
+        - `members`: If the response is a zip archive, the names of the
+                     members we want from it. If None, or the archive has
+                     none of them, we want all of its members.
+        """
+        content_type = content_type.lower()
 
-    # Regular expressions we use precompiled here for efficiency and all that.
-    #
-    # NOTE: the '\+' means match a proceeding plus-sign.. which is the url
-    # escaped value for the space character.
-    #
-    re_tags = re.compile(r"\+(ac3|custom|dc|divx|dsr|dsrip|dutch|dvd|dvdrip|dvdscr|fragment|fs|hdtv|internal|limited|multisubs|ntsc|ogg|ogm|pal|pdtv|proper|repack|rerip|retail|se|svcd|swedish|unrated|ws|xvid|xxx|cd[1-9]|\[.*\])(\+|$)")
+        # A zip archive is unzipped. Anything else is used as it is.
+        #
+        if content_type == "application/zip":
+            # NOTE: Since the zipfile.ZipFile class needs a file like object
+            #       with the 'seek()' method we use a StringIO to hold
+            #       our url result data if the session did not spool it.
+            #
+            if isinstance(body, basestring):
+                body = StringIO(body)
+            try:
+                z = zipfile.ZipFile(body, 'r')
+                result = self.read_members(z, members)
+                z.close()
+            except (zipfile.BadZipfile, zlib.error), e:
+                raise FetchFailed("bad zip archive: %s" % e)
+            finally:
+                body.close()
+            return result
+
+        if not isinstance(body, basestring):
+            spooled = body
+            body = spooled.read()
+            spooled.close()
+        return body
 
     ##################################################################
     #
-    def __init__(self, scraper_xml, logger = logging.getLogger()):
-        """
-        `scraper_xml` - A string that is the XML scraper we are testing.
+    def charset(self, content_type, body):
         """
-        self.logger = logging.getLogger(logger.name + ".Scraper")
-        self.m_result = ""
-        self.s_xml = scraper_xml
-        self.parser = ScraperParser(scraper_xml, self.logger)
-        self.written_data = { }
+        Return the charset the text of a response is in, or None if we
+        can not tell (or it is not text.)
 
-        # As we fetch data from various web resources we store
-        # the results in a cache because later fetches may refer to
-        # cached items to parse additional data out. No need to re-fetch
-        # this from the network if we already have fetched a copy.
-        #
-        self.cache = { }
+        This is the 'charset' of its Content-Type header or, failing
+        that, for HTML and XML, the charset a <meta> tag or the XML
+        declaration at the top of the document says it is in.
 
-        # We need the settings parsed before the user does any lookups
-        #
+        Arguments:
+        - `content_type`: The Content-Type header of the response.
+        - `body`: The body of the response, as read_response() returns it.
+        """
+        charset = None
+        m = charset_re.search(content_type)
+        if m:
+            charset = m.group(1)
+        else:
+            media_type = content_type.split(";")[0].strip().lower()
+            if media_type.startswith("text/") or media_type.endswith("xml"):
+                m = meta_charset_re.search(body, 0, self.SNIFF_BYTES)
+                if m:
+                    charset = m.group(1) or m.group(2)
+        if charset is None:
+            return None
+        charset = charset.strip("'\"").lower()
         try:
-            settings_xml = self.parser.parse(FN_GET_SETTINGS)
-        except BadXML:
-            settings_xml = None
-        self.settings = Settings(settings_xml)
-
-        return
+            codecs.lookup(charset)
+        except LookupError:
+            self.logger.debug("fetch: unknown charset '%s'" % charset)
+            return None
+        return charset
 
     ##################################################################
     #
-    def write_result(self, file_name):
+    def decode(self, body, charset):
         """
-        XXX Another C++ function that can be simplified away.
+        Return the body of a response as unicode text if we know the
+        charset it is in. Otherwise it is returned as the string it is.
 
-        Output the contents of self.m_result in to the file with the
-        given file name
+        This is where text from the sites we scrape enters the parser, so
+        that a page of Cyrillic, say, is matched as the letters that it
+        is and not as several bytes, or a '&#NNNN;' reference, for each.
 
         Arguments:
-        - `file_name`: The name of the file to write the results in to.
+        - `body`: The body of the response, as read_response() returns it.
+        - `charset`: The charset it is in (see charset()), or None.
         """
-        f = file(file_name, "w")
-        f.write(self.m_result)
-        f.close()
+        if charset is None or body is None:
+            return body
+        return body.decode(charset, "replace")
 
     ##################################################################
     #
-    def read_file(self, file_name):
+    def read_members(self, z, members = None):
         """
-        XXX another C++ function to trivially replace in Python
+        Return the content of the members we want from the given zip
+        archive.
+
+        The way the scraper wants to work is that it gets all parts of
+        such a zip file as a single string, so when we want more than one
+        member we join them all together (separated by a newline
+        character, just because.) A single member is returned as it is.
 
-        returns the contents of the given file name as a string.
         Arguments:
-        - `file_name`: Name of the file to read.
+        - `z`: The zipfile.ZipFile of the archive.
+        - `members`: The names of the members we want, or None for all of
+                     them.
         """
-        f = file(file_name, "r")
-        temp = f.read()
-        f.close()
+        names = z.namelist()
+        if members is not None:
+            wanted = [m for m in members if m in names]
+            if len(wanted) > 0:
+                names = wanted
+
+        if len(names) == 1:
+            return z.read(names[0])
+        return "\n".join([z.read(name) for name in names])
 
     ##################################################################
     #
-    def custom_function(self, url, entity = None):
+    def fetch_all(self, urls, revalidate = False):
         """
-        We are passed a ScrapeURL object that has a custom function.
-
-        We ask the URL object for its data. If it returns any we then
-        pass that in to the scraper to process via the specific function,
-        if it has it (and it should because the scraper is what gave us the
-        custom function to invoke.)
-
-        If the results we get back have any <url></url>'s that also
-        have a 'function' attribute then we recurse calling ourselves
-        with those custom functions.
+        Get the content of every one of the given ScrapeURL's, in
+        parallel, and return the list of their contents in the same order
+        as the URL's we were given.
 
-        We also pass the results of a custom function (before
-        recursing) to entity object if we were passed it.  If the
-        entity has a method 'fn_<foo>' where <foo> is the custom
-        function we have just parsed, then we pass the results of the
-        custom function to that method on the entity.
+        If any of the fetches fail the exception is raised from here.
 
         Arguments:
-        - `url`: A ScrapeURL object whose data we pass to the scraper to parse
-                 via the specified custom function
-        - `entity`: The entity that will parse the results of our custom
-                    functions.
+        - `urls`: A list of ScrapeURL's to get the content of.
+        - `revalidate`: Passed on to fetch()
         """
-        self.logger.debug("custom_function: '%s' entering" % url.function)
+        if len(urls) == 0:
+            return []
+        if len(urls) == 1 or self.workers <= 1:
+            return [self.fetch(url, revalidate) for url in urls]
 
-        # We must have a custom function and poking this URL for its data
-        # must return some data in order for us to bother trying to parse
-        # the data.
-        #
-        if url.function is None:
-            self.logger.debug("custom_function: '%s' leaving" % url.function)
-            return None
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+            pool = self.pool
+        return pool.map(lambda url: self.fetch(url, revalidate), urls)
 
-        url_data = url.get()
-        if url_data is None:
-            self.logger.debug("custom_function: '%s' leaving" % url.function)
-            return None
+    ##################################################################
+    #
+    def close(self):
+        """
+        Shut down our pool of worker threads, if we have started it, and
+        close our session's idle connections.
+        """
+        with self.lock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+        self.session.close()
+        return
 
-        # As is usual with such things, the input data goes in to buffer
-        # one of our parser.
+# The fetcher used by ScrapeURL's that were not given one.
+#
+default_fetcher = Fetcher()
+
+##################################################################
+##################################################################
+#
+class ScrapeURL(object):
+    """
+    """
+
+    ##################################################################
+    #
+    def __init__(self, url, cache = { }, base_url = None, fetcher = None):
+        """
+        We can be called with `url` being a string or an XML element
+        node. In the later case we need to parse the element node.
+
+        `url` - The url that this object wraps.
+        `fetcher` - The Fetcher that gets our content. If not given we use
+                    the module's default_fetcher.
+        """
+        self.base_url = base_url
+        self.cache = cache
+        self.fetcher = fetcher
+        if self.fetcher is None:
+            self.fetcher = default_fetcher
+        self.use_post = False
+        self.spoof_url = None
+        self.cache_key = None
+        self.function = None   # if the results of this URL need to be
+                               # parsed by a custom function
+        self.members = None    # if our url is a zip archive, the names of
+                               # the members we want from it (None means
+                               # all of them)
+        if type(url) in types.StringTypes:
+            self.parse_string(url)
+        else:
+            self.parse_element(url)
+
+        # If we have no actual url then we can not do our url cleanups
+        # because they assume we have a string, so return now.
         #
-        self.parser.set_buffer(1, url_data)
-        details = self.parser.parse(url.function, self.settings)
+        if self.url is None:
+            return
 
-        if details is None or details == "":
-            self.logger.debug("custom_function: '%s' leaving" % url.function)
+        # This is not documented in any place but URL's within things like
+        # movie details are sometimes relative url's.. if the url we parsed
+        # out does not begin with 'http' and is not the empty string and
+        # if we got a base_url passed in, then combine the url with the base
+        # url.
+        #
+        if self.base_url and self.url != "" and self.url[0:4].lower() != "http":
+            self.url = self.base_url + self.url
+        return
+
+    ##################################################################
+    #
+    def __str__(self):
+        result = ["<ScrapeURL, url: %s" % self.url]
+        if self.use_post:
+            result.append("use_post: %s" % self.use_post)
+        if self.spoof_url:
+            result.append("spoof_url: %s" % self.spoof_url)
+        if self.cache_key:
+            result.append("cache: %s" % self.cache_key)
+        if self.function:
+            result.append("function: %s" % self.function)
+
+        result.append(">")
+        return " ".join(result)
+    
+    ##################################################################
+    #
+    def get(self, revalidate = False):
+        """
+        use the url we were configured with and get its content. Return the
+        content retrieved as a string.
+
+        The actual work is done by our Fetcher (see Fetcher.fetch())
+
+        Arguments:
+        - `revalidate`: If True check with the server that any cached
+                        content is still current. See Fetcher.fetch()
+        """
+        return self.fetcher.fetch(self, revalidate)
+
+    ##################################################################
+    #
+    def parse_element(self, element):
+        """
+        Parse the url element.
+
+        Arguments:
+        - `element`: an XML element that we need to get a URL from.
+        """
+        # When there is no text this is one of these 'cache' url's.
+        # Need to figure out where the cache _comes from_
+        #
+        self.url = element_text(element)
+
+        self.spoof_url = element.get("spoof", "")
+        if "post" in element.attrib:
+            self.use_post = True
+        self.function = element.get("function", "")
+        self.cache_key = element.get("cache", "")
+        return
+
+    ##################################################################
+    #
+    def parse_string(self, xml_url):
+        """
+        We are given a string that is an xml document that we need to
+        parse for it for our url arguments. If it does not parse as an
+        xml document then we consider it to be the url string.
+
+        Arguments:
+        - `xml_url`: The string containing our xml URL document.
+        """
+        if len(xml_url) == 0:
+            raise BadURL("An empty string is not a valid URL.")
+
+        # Almost every url we are handed is a plain url, so do not bother
+        # the XML parser with anything that can not be an XML document.
+        #
+        if not xml_url.lstrip().startswith("<"):
+            self.url = xml_url
             return
+        try:
+            self.parse_element(parse_xml(xml_url))
+        except ElementTree.ParseError:
+            self.url = xml_url
+        return
+
+##################################################################
+##################################################################
+#
+class RegexCache(object):
+    """
+    A bounded, least recently used, cache of compiled regular expressions.
+
+    Most <expression>'s in a scraper definition refer to buffers or
+    settings so they can only be compiled once those have been
+    substituted in. Python's own 're' cache is far too small for the
+    number of expressions in a definition like imdb.xml so each
+    ScraperParser keeps its own cache keyed by the final expression
+    string. It may be used from many threads at once.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, max_size = 256):
+        """
+        Arguments:
+        - `max_size`: The most compiled expressions we will hold on to.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.patterns = OrderedDict()
+        self.lock = threading.Lock()
 
-        dom = parseString(details)
-        d = dom.firstChild
+    ##################################################################
+    #
+    def compile(self, expression):
+        """
+        Return the compiled (with re.DOTALL) form of the given expression
+        string, compiling and caching it if we do not already have it.
 
-        # See if our entity knows how to deal with the results of this
-        # custom function.
+        Arguments:
+        - `expression`: The fully substituted expression string.
+        """
+        with self.lock:
+            # Popping and re-inserting moves it to the most recently used
+            # end of our dict.
+            #
+            pattern = self.patterns.pop(expression, None)
+            if pattern is not None:
+                self.hits += 1
+                self.patterns[expression] = pattern
+                return pattern
+            self.misses += 1
+
+        # We compile outside of the lock so that other threads are not
+        # held up by a long compile.
         #
-        if entity and hasattr(entity, "fn_" + url.function):
-            getattr(entity, "fn_" + url.function)(details)
+        pattern = re.compile(expression, re.DOTALL)
+        with self.lock:
+            if expression not in self.patterns and \
+                    len(self.patterns) >= self.max_size:
+                self.patterns.popitem(last = False)
+            self.patterns[expression] = pattern
+        return pattern
+
+    ##################################################################
+    #
+    def clear(self):
+        """
+        Empty the cache and reset our hit and miss counters.
+        """
+        with self.lock:
+            self.patterns.clear()
+            self.hits = 0
+            self.misses = 0
+        return
+
+    ##################################################################
+    #
+    def __len__(self):
+        return len(self.patterns)
+
+    ##################################################################
+    #
+    def __str__(self):
+        return "<RegexCache, size: %d/%d, hits: %d, misses: %d>" % \
+            (len(self.patterns), self.max_size, self.hits, self.misses)
+
+##################################################################
+##################################################################
+#
+class Template(object):
+    """
+    An input, output, or expression string from a scraper definition
+    split once in to its literal text, '$$<n>' buffer references and
+    '$INFO[<foo>]' setting references.
+
+    Rendering a template with a set of buffers and settings is then a
+    single join instead of a str.replace() pass over the whole string for
+    every buffer.
+
+    >>> t = Template("<a>$$1</a>$$10")
+    >>> buffers = BufferStore()
+    >>> buffers.set(1, "x"); buffers.set(10, "y")
+    >>> t.render(buffers, None)
+    '<a>x</a>y'
+    """
+
+    # The kinds of segments a template is made up of.
+    #
+    LITERAL = 0
+    BUFFER = 1
+    SETTING = 2
+
+    ##################################################################
+    #
+    def __init__(self, text):
+        """
+        Arguments:
+        - `text`: The string to tokenize.
+        """
+        # Unicode text is kept as unicode so that an expression matches
+        # the characters of a page, not their character references.
+        #
+        self.text = text
+
+        self.segments = []
+        literal = []
+        pos = 0
+        for m in template_re.finditer(text):
+            literal.append(text[pos:m.start()])
+            pos = m.end()
+            if m.group(3):
+                literal.append('\n')
+                continue
+
+            # There is no buffer 0, and '$$0' has always been replaced by
+            # nothing.
+            #
+            if m.group(1) == "0":
+                continue
+            literal = "".join(literal)
+            if literal:
+                self.segments.append((self.LITERAL, literal))
+            literal = []
+            if m.group(1) is not None:
+                self.segments.append((self.BUFFER, int(m.group(1))))
+            else:
+                self.segments.append((self.SETTING, m.group(2)))
+        literal.append(text[pos:])
+        literal = "".join(literal)
+        if literal or not self.segments:
+            self.segments.append((self.LITERAL, literal))
+
+        # A template with only literal text renders to the same string
+        # every time.
+        #
+        self.is_static = len(self.segments) == 1 and \
+            self.segments[0][0] == self.LITERAL
+        self.static = None
+        if self.is_static:
+            self.static = self.segments[0][1]
+
+        # The buffers this template reads.
+        #
+        self.buffers = set(value for kind, value in self.segments
+                           if kind == self.BUFFER)
+        return
+
+    ##################################################################
+    #
+    def render(self, buffers, settings):
+        """
+        Return our string with every buffer reference replaced by the
+        contents of that buffer and every setting reference replaced by the
+        value of that setting.
+
+        If we come across a $INFO[<foo>] not in our settings we will raise
+        a KeyError.
+
+        Arguments:
+        - `buffers`: The BufferStore to read buffers from.
+        - `settings`: The Settings object to resolve $INFO[<foo>] with.
+        """
+        if self.is_static:
+            return self.static
+
+        result = []
+        for kind, value in self.segments:
+            if kind == self.LITERAL:
+                result.append(value)
+            elif kind == self.BUFFER:
+                result.append(buffers.get(value))
+            else:
+                result.append(settings.values[value])
+        return join_text(result)
+
+    ##################################################################
+    #
+    def __len__(self):
+        return len(self.text)
+
+    ##################################################################
+    #
+    def __str__(self):
+        if isinstance(self.text, unicode):
+            return self.text.encode("ascii", "xmlcharrefreplace")
+        return self.text
+
+# The quantifiers of a parsed regular expression.
+#
+repeat_ops = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+####################################################################
+#
+def unbounded_repeat(tree):
+    """
+    Return True if the given parsed regular expression has a quantifier
+    with no upper bound ('*', '+', '{n,}') anywhere in it.
+
+    Arguments:
+    - `tree`: The sre_parse.parse() result, or part of it.
+    """
+    for op, av in tree:
+        if op in repeat_ops:
+            if av[1] == sre_constants.MAXREPEAT or unbounded_repeat(av[2]):
+                return True
+        elif op == sre_constants.BRANCH:
+            if any(unbounded_repeat(branch) for branch in av[1]):
+                return True
+        elif op in (sre_constants.SUBPATTERN, sre_constants.ASSERT,
+                    sre_constants.ASSERT_NOT):
+            if unbounded_repeat(av[-1]):
+                return True
+    return False
+
+####################################################################
+#
+def find_hazards(tree, hazards):
+    """
+    The work of expression_hazards(): add the descriptions of the hazards
+    in the given parsed regular expression to the given list.
+
+    Arguments:
+    - `tree`: The sre_parse.parse() result, or part of it.
+    - `hazards`: The list to add to.
+    """
+    # Groups do not change what is matched so we look through them to
+    # the sequence of things they match.
+    #
+    items = []
+    pending = list(reversed(list(tree)))
+    while pending:
+        op, av = pending.pop()
+        if op == sre_constants.SUBPATTERN:
+            pending.extend(reversed(list(av[-1])))
         else:
-            print "Entity did not support custom function '%s'" % url.function
+            items.append((op, av))
+
+    previous = None
+    for op, av in items:
+        if op not in repeat_ops:
+            if op == sre_constants.BRANCH:
+                for branch in av[1]:
+                    find_hazards(branch, hazards)
+            elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+                find_hazards(av[1], hazards)
+            previous = None
+            continue
 
-        # Now see if we have any custom functions in our results.. if we
-        # do, recurse for each one we find.
+        body = list(av[2])
+        if av[1] > 1 and unbounded_repeat(body):
+            hazards.append("nested quantifiers, ie: '([0-9]+)+'")
+        elif av[1] == sre_constants.MAXREPEAT and previous is not None and \
+                (previous == body or
+                 [(sre_constants.ANY, None)] in (previous[:1], body[:1])):
+            hazards.append("two unbounded quantifiers in a row that can "
+                           "match the same text, ie: '.*?[0-9]+'")
+        find_hazards(body, hazards)
+        previous = None
+        if av[1] == sre_constants.MAXREPEAT:
+            previous = body
+    return
+
+####################################################################
+#
+def expression_hazards(expression):
+    """
+    Look for the things in an <expression> that can make it take
+    exponential, or at least a high power of, time in the length of its
+    input to fail to match. Returns a list of descriptions of what we
+    found, which is empty if we found nothing or the expression does
+    not parse.
+
+    Buffer and setting references are left out since what is put in
+    their place is almost always literal text.
+
+    Arguments:
+    - `expression`: The <expression> text.
+    """
+    expression = template_re.sub(lambda m: m.group(3) and "\n" or "",
+                                 expression)
+    try:
+        tree = sre_parse.parse(expression, re.DOTALL)
+    except (re.error, OverflowError):
+        return []
+    hazards = []
+    find_hazards(tree, hazards)
+
+    # Each kind of hazard only needs to be mentioned once.
+    #
+    return sorted(set(hazards), key = hazards.index)
+
+##################################################################
+##################################################################
+#
+class RegExpStep(object):
+    """
+    A compiled <RegExp> node from a scraper definition.
+
+    All of the attributes of the <RegExp> node and its <expression>
+    child are read once, when the scraper definition is loaded, so that
+    running the step does not need to go back to the XML. The nested
+    <RegExp> nodes are compiled in to a list of child steps that are
+    run before this step, in order.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, element, path = None):
+        """
+        Arguments:
+        - `element`: The <RegExp> element we are compiling.
+        - `path`: Where in the definition this <RegExp> is, ie:
+                  'GetDetails/RegExp[2]/RegExp[1]'
+        """
+        self.tag_name = element.tag
+        self.path = path or element.tag
+
+        # The line of the definition we are on, and the labels of us and
+        # the steps we are nested in, are only filled in for a parser that
+        # is being profiled (see ScraperParser.profile())
         #
-        u = first_child(d, "url")
-        while u:
-            sub_url = ScrapeURL(u, cache = self.cache)
-            self.custom_function(sub_url, entity)
-            u = next_sibling(u, "url")
-            
-        dom.unlink()
-        self.logger.debug("custom_function: '%s' leaving" % url.function)
+        self.line = None
+        self.frames = None
+
+        # The 'conditional' attribute names a setting that must be True
+        # for this step to be run. If it begins with a '!' the test is
+        # inverted.
+        #
+        self.conditional = element.get("conditional", "")
+        self.invert_condition = False
+        if self.conditional[0:1] == "!":
+            self.invert_condition = True
+            self.conditional = self.conditional[1:]
+
+        # The input template. If it is the empty string we read our input
+        # from buffer 1 when we are run.
+        #
+        self.input = Template(element.get("input", ""))
+
+        # The 'dest' attribute says what buffer the results go in to, and
+        # if there is a trailing "+" that we append to that buffer instead
+        # of replacing its contents.
+        #
+        self.append = False
+        dest_buffer = element.get("dest", "")
+        try:
+            if len(dest_buffer) == 0:
+                self.dest = 1
+            else:
+                if dest_buffer[-1] == "+":
+                    self.append = True
+                    dest_buffer = dest_buffer[:-1]
+                self.dest = int(dest_buffer)
+        except ValueError:
+            raise BadXML("<%s> has an invalid 'dest' attribute: '%s'" % \
+                         (self.tag_name, element.get("dest", "")))
+
+        # Child <RegExp> nodes are run, depth first, before this node. If
+        # there are none, a <clear> child is run in their place.
+        #
+        self.children = [RegExpStep(child, "%s/%s[%d]" % \
+                                        (self.path, child.tag, i + 1))
+                         for i, child in enumerate(step_elements(element))]
+
+        self.compile_expression(element)
+
+        # Whether what we compute is ever read, and the buffers that are
+        # not read again once we have run. These are filled in by our
+        # ScraperFunction (see ScraperFunction.analyze())
+        #
+        self.live = True
+        self.release = []
         return
 
     ##################################################################
     #
-    def create_search_url(self, search_string):
+    def compile_expression(self, element):
         """
+        Read the <expression> child of our <RegExp> node and the
+        attributes that control how it is matched and how the match
+        groups are put in to our output.
+
         Arguments:
-        - `search_string`: The name of the show, movie, whatever we are trying
-                           to look up.
+        - `element`: The <RegExp> element we are compiling.
         """
-        # Quote the search string so that we can pass it as an argument in a
-        # query URL.
+        self.output = Template(element.get("output", ""))
+        expression = first_child(element, "expression")
+
+        # If there is no <expression> tag then running this step only
+        # runs its children.
         #
-        # We also treat all '.', '-', and '_' as spaces so translate those
-        # to spaces before we quote.
+        self.has_expression = expression is not None
+        self.hazards = []
+        if not self.has_expression:
+            return
+
+        self.expression = Template(element_text(expression, "(.*)"))
+        self.hazards = expression_hazards(self.expression.text)
+
+        # An expression that refers to no buffers and no settings is the
+        # same every time we run it so we compile it now. Everything else
+        # is compiled, after substitution, through the parser's
+        # RegexCache.
         #
-        table = string.maketrans(".-_", "   ")
-        search_string = search_string.lower()
+        self.expression_re = None
+        if self.expression.is_static:
+            try:
+                self.expression_re = re.compile(self.expression.static,
+                                                re.DOTALL)
+            except re.error:
+                # Leave it to be compiled, and fail, when we are run.
+                #
+                pass
+
+        self.repeat = expression.get("repeat", "").lower() == "yes"
+        self.clear = expression.get("clear", "").lower() == "yes"
+
+        # Do we clean (strip HTML, ANSIfy, etc) the respective regexp
+        # match group (by default, yes we do.)
+        #
+        self.clean = set(range(1, 10))
+        for c in expression.get("noclean", "").split(','):
+            if c in ('1','2','3','4','5','6','7','8','9'):
+                self.clean.discard(int(c))
+
+        # Do we trim leading and trailing white space from the respective
+        # regexp match group (by default, no we do not.)
+        #
+        self.trim = set()
+        for c in expression.get("trim", "").split(','):
+            if c in ('1','2','3','4','5','6','7','8','9'):
+                self.trim.add(int(c))
+
+        try:
+            self.optional = get_int_attribute(expression, "optional", None)
+            self.compare = get_int_attribute(expression, "compare", None)
+        except ValueError:
+            raise BadXML("<expression> in <%s dest='%s'> has an invalid "
+                         "'optional' or 'compare' attribute" % \
+                         (self.tag_name, element.get("dest", "")))
+
+        # If neither our output or our expression change from run to run
+        # we can parse our output in to its match group references once,
+        # now.
+        #
+        self.output_template = None
+        if self.output.is_static and self.expression_re is not None:
+            try:
+                self.output_template = sre_parse.parse_template(
+                    self.output.static, self.expression_re)
+            except re.error:
+                pass
+        return
+
+    ##################################################################
+    #
+    def reads(self):
+        """
+        Return the set of buffers that running this step (not counting
+        its children) reads.
+
+        These are only the buffers our attributes refer to. Text that
+        spells out a '$$<n>' reference in a page we match, or in a
+        buffer, is assumed to not be one.
+        """
+        if len(self.input) > 0:
+            result = set(self.input.buffers)
+        else:
+            result = set([1])
+        if not self.has_expression:
+            return result
+
+        result |= self.output.buffers
+        result |= self.expression.buffers
+        if self.compare is not None:
+            result.add(self.compare)
+
+        # What we append to our destination buffer is added to what is
+        # already in it, unless we clear it first.
+        #
+        if self.append and not self.clear:
+            result.add(self.dest)
+        return result
+
+    ##################################################################
+    #
+    def __getstate__(self):
+        """
+        We are pickled without our compiled expression (see
+        DefinitionCache.) A step that is loaded compiles it through its
+        parser's RegexCache when it is first run so that a definition
+        that is loaded does not compile expressions it never runs.
+        """
+        state = self.__dict__.copy()
+        if "expression_re" in state:
+            state["expression_re"] = None
+        return state
+
+    ##################################################################
+    #
+    def __str__(self):
+        result = ["<%s" % self.tag_name]
+        if self.conditional:
+            result.append("conditional: %s%s" % \
+                          (self.invert_condition and "!" or "",
+                           self.conditional))
+        result.append("input: '%s'" % self.input)
+        result.append("dest: %d%s" % (self.dest, self.append and "+" or ""))
+        if self.has_expression:
+            result.append("expression: '%s'" % self.expression)
+        result.append(">")
+        return " ".join(result)
+
+##################################################################
+##################################################################
+#
+class ScraperFunction(object):
+    """
+    A compiled function tag (<GetSearchResults>, <GetDetails>,
+    <GetEpisodeList>, ...) from a scraper definition. It holds the buffer
+    the result of the function is read from and the list of top level
+    <RegExp> steps that are run, in order, to compute it.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, element):
+        """
+        Arguments:
+        - `element`: The element of the function we are compiling.
+        """
+        self.name = element.tag
+        try:
+            self.dest = get_int_attribute(element, "dest", 1)
+        except ValueError:
+            raise BadXML("<%s> has an invalid 'dest' attribute: '%s'" % \
+                         (self.name, element.get("dest", "")))
+
+        self.steps = [RegExpStep(regexp, "%s/%s[%d]" % \
+                                     (self.name, regexp.tag, i + 1))
+                      for i, regexp in enumerate(children(element, "RegExp"))]
+        self.analyze()
+        return
+
+    ##################################################################
+    #
+    def all_steps(self):
+        """
+        A generator of all of our steps, nested ones included, each
+        before the steps nested in it.
+        """
+        pending = list(reversed(self.steps))
+        while pending:
+            step = pending.pop()
+            yield step
+            pending.extend(reversed(step.children))
+
+    ##################################################################
+    #
+    def run_order(self, steps = None, guarded = False):
+        """
+        A generator of (step, guarded) for all of our steps, nested ones
+        included, in the order they are run: each after the steps nested
+        in it. 'guarded' is True for a step that is only run if a
+        'conditional' attribute, its own or that of a step it is nested
+        in, holds.
+
+        Arguments:
+        - `steps`: The steps to walk. If None, our top level steps.
+        - `guarded`: Whether the steps are nested in a conditional step.
+        """
+        if steps is None:
+            steps = self.steps
+        for step in steps:
+            step_guarded = guarded or step.conditional != "" or \
+                step.invert_condition
+            for nested in self.run_order(step.children, step_guarded):
+                yield nested
+            yield (step, step_guarded)
+
+    ##################################################################
+    #
+    def analyze(self):
+        """
+        Work out which buffers are read after each of our steps, going
+        back from our result buffer, which is the only one that is read
+        once we are done.
+
+        A step whose destination buffer (and 'compare' buffer) is not
+        read again before it is overwritten does nothing we need, so it
+        is marked as not live and is not run (the steps nested in it
+        still are.) Each step that is run gets the list of buffers it
+        reads for the last time so that they, and whatever pages they
+        hold, are released as soon as it is done.
+        """
+        live = set([self.dest])
+        for step, guarded in reversed(list(self.run_order())):
+            step.live = step.has_expression and \
+                (step.dest in live or step.compare in live)
+            step.release = []
+            if not step.live:
+                continue
+
+            reads = step.reads()
+            step.release = sorted(reads - live)
+
+            # A step that clears its destination buffer overwrites it, as
+            # long as it is sure to be run. Otherwise, if its expression
+            # does not match, what was in the buffer is left there.
+            #
+            if step.clear and not guarded:
+                live.discard(step.dest)
+            live |= reads
+        return
+
+##################################################################
+##################################################################
+#
+class Tracer(object):
+    """
+    The diagnostics of the scraper engine. These are debug messages
+    about every buffer, match and step, often with whole pages in them,
+    so they must cost nothing when no one is listening.
+
+    Whether anyone is listening is worked out once by refresh() and kept
+    in our 'enabled' attribute. Callers check it before they build what
+    they want to say, and what they say is only formatted once the
+    logger has decided it wants it:
+
+        if tracer.enabled:
+            tracer.event("set_buffer", "set_buffer(%(buffer)d): %(data)s",
+                         buffer = i, data = data)
+
+    Every event has a name and its fields, which are handed as is to our
+    listeners (see add_listener()) and used to format its message for our
+    logger.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, logger = logging.getLogger()):
+        """
+        Arguments:
+        - `logger`: The logger our events are written to at DEBUG level.
+        """
+        self.logger = logger
+        self.listeners = []
+        self.refresh()
+
+    ##################################################################
+    #
+    def refresh(self):
+        """
+        Work out again whether our events go anywhere: if our logger logs
+        DEBUG messages or we have any listeners. Our ScraperParser does this
+        at the start of every function it runs so changes to the logging
+        configuration are seen there. Returns the new 'enabled'.
+        """
+        self.enabled = len(self.listeners) > 0 or \
+            self.logger.isEnabledFor(logging.DEBUG)
+        return self.enabled
+
+    ##################################################################
+    #
+    def add_listener(self, listener):
+        """
+        Call the given function with the name and the dict of the fields
+        of every event from now on.
+
+        Arguments:
+        - `listener`: The function to call.
+        """
+        self.listeners = self.listeners + [listener]
+        self.refresh()
+        return
+
+    ##################################################################
+    #
+    def remove_listener(self, listener):
+        """
+        Stop calling a function given to add_listener().
+
+        Arguments:
+        - `listener`: The function to stop calling.
+        """
+        self.listeners = [l for l in self.listeners if l is not listener]
+        self.refresh()
+        return
+
+    ##################################################################
+    #
+    def event(self, name, message, **fields):
+        """
+        Record an event. Callers should check our 'enabled' attribute
+        first so they do not gather the fields when they are not wanted.
+
+        Arguments:
+        - `name`: The name of the event, ie: 'expression.match'
+        - `message`: The message for our logger, a format string for the
+                     dict of the fields, ie: 'matched: %(groups)r'
+        - `fields`: The fields of the event.
+        """
+        for listener in self.listeners:
+            listener(name, fields)
+
+        # The logger formats the message itself, and only if it is going
+        # to write it out.
+        #
+        if fields:
+            self.logger.debug(message, fields)
+        else:
+            self.logger.debug(message)
+        return
+
+##################################################################
+##################################################################
+#
+class BufferStore(object):
+    """
+    The parameter buffers of a ParseContext: a fixed number of slots,
+    numbered from 1 like the '$$<n>' references to them, each holding
+    a string.
+
+    Strings are kept as we are given them. Unicode text is not encoded
+    until the result of a function leaves the parser (see
+    ScraperParser.parse()) so that our expressions are not run over
+    pages several times their size, ie: every letter of a page in
+    Cyrillic being a '&#NNNN;' character reference.
+
+    What is appended to a buffer, once for every match of a repeated
+    expression, is kept as a list of chunks that is only joined when the
+    buffer is read, instead of copying the whole buffer every time.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, size = NUM_BUFFERS):
+        """
+        Arguments:
+        - `size`: How many buffers we have.
+        """
+        self.size = size
+
+        # Slot 0 is never used.
+        #
+        self.slots = [""] * (size + 1)
+
+        # The chunks of the buffers that have been appended to since they
+        # were last read, by buffer number.
+        #
+        self.chunks = { }
+
+    ##################################################################
+    #
+    def clear(self):
+        """
+        Set every buffer to the empty string.
+        """
+        self.slots[:] = [""] * (self.size + 1)
+        self.chunks.clear()
+        return
+
+    ##################################################################
+    #
+    def get(self, i):
+        """
+        Return the contents of the given buffer.
+
+        Arguments:
+        - `i`: The 1-based number of the buffer.
+        """
+        if not 1 <= i <= self.size:
+            raise IndexError("Error: Could not get buffer %d. Must be "
+                             "between 1 and %d" % (i, self.size))
+        if self.chunks and i in self.chunks:
+            self.slots[i] = join_text(self.chunks.pop(i))
+        return self.slots[i]
+
+    ##################################################################
+    #
+    def set(self, i, data, append = False):
+        """
+        Set, or append to, the contents of the given buffer.
+
+        Arguments:
+        - `i`: The 1-based number of the buffer.
+        - `data`: The string to put in it.
+        - `append`: If True the data is added to the end of what is
+                    already in the buffer.
+        """
+        if not 1 <= i <= self.size:
+            raise IndexError("Error: Could not set buffer %d. Must be "
+                             "between 1 and %d" % (i, self.size))
+        if append:
+            chunks = self.chunks.get(i)
+            if chunks is None:
+                self.chunks[i] = [self.slots[i], data]
+            else:
+                chunks.append(data)
+            return
+        if self.chunks:
+            self.chunks.pop(i, None)
+        self.slots[i] = data
+        return
+
+##################################################################
+##################################################################
+#
+class ParseContext(object):
+    """
+    The state of one run of a function of a scraper definition: its
+    parameter buffers, the settings it sees, and how deeply nested in
+    <RegExp>'s it is.
+
+    The ScraperParser itself holds only the compiled definition, which
+    nothing changes once it is loaded. Each call to its parse() method
+    gets a context of its own so the one parser can be shared by many
+    threads.
+    """
+
+    # How many buffers do we support (see the module level NUM_BUFFERS.)
+    #
+    NUM_BUFFERS = NUM_BUFFERS
+
+    ##################################################################
+    #
+    def __init__(self, settings = None, logger = logging.getLogger(),
+                 tracer = None):
+        """
+        Arguments:
+        - `settings`: The Settings the function sees.
+        - `logger`: The logger our events go to if we are not given a
+                    tracer.
+        - `tracer`: The Tracer of our ScraperParser.
+        """
+        self.logger = logger
+        self.tracer = tracer or Tracer(logger)
+        self.settings = settings
+
+        # When the function being run must be done by (see
+        # ScraperParser.function_budget), or None.
+        #
+        self.deadline = None
+
+        # NOTE: regexp_level is entirely for debugging so we can
+        #       printout how deep we are in nested <regexp>'s.
+        #
+        self.regexp_level = 0
+        self.buffers = BufferStore(self.NUM_BUFFERS)
+
+    ##################################################################
+    #
+    def clear_buffers(self):
+        """
+        Set each parameter buffer to the empty string.
+        """
+        self.buffers.clear()
+        return
+
+    ##################################################################
+    #
+    def set_buffer(self, i, data, append = False):
+        """
+        Set a parameter buffer to given data. Unicode data is kept as
+        unicode (see BufferStore.)
+
+        Arguments:
+        - `i`: The 1-based index of the buffer to set.
+        - `data`: The data to set in to the buffer.
+        - `append`: Is the data appended to the buffer (True) or does it
+                    replace the contents of the buffer (False)
+        """
+        if self.tracer.enabled:
+            self.tracer.event("set_buffer", "set_buffer(%(buffer)d)%(how)s: "
+                              "%(data)s", buffer = i, data = data,
+                              how = append and ", appending" or "")
+        self.buffers.set(i, data, append)
+        return
+
+    ##################################################################
+    #
+    def get_buffer(self, i):
+        """
+        Return the value of the buffer at the given index.
+
+        Note: index is 1-based..
+
+        Arguments:
+        - `i`: 1-based index of parameter buffer to return.
+        """
+        return self.buffers.get(i)
+
+    ##################################################################
+    #
+    def replace_setting(self, matchobj):
+        """
+        This method is intended to be called as an argument to the
+        regular expression object's 'sub()' method.
+        
+        After we have run our data through the regular expression
+        parser which builds up an XML string to return to our caller
+        we need to resolve any variable references that are in the
+        string.
+
+        ie: where '$INFO[<foo>]' appears in the input string we
+        replace with the value of the setting '<foo>' from our
+        settings.
+
+        If we come across a $INFO[<foo>] not in our settings we will
+        raise a KeyError.
+
+        NOTE: It is arguable that in production we should just stick
+              an empty string in place of settings we do not have.
+        
+        Arguments:
+        - `matchobj`: The re matchobj that matches our pattern
+        """
+        # If the first (and only) match group contains the name of the
+        # setting that is going to provide the value to replace.
+        #
+        return self.settings.values[matchobj.group(1)]
+
+##################################################################
+##################################################################
+#
+class Profiler(object):
+    """
+    Collects statistics on every <RegExp> step a ScraperParser runs
+    while this is its profiler (see ScraperParser.profile()): how many
+    times it was run, how long its expression took, and how much input
+    it was given, how many matches that got and how much output was
+    left in its destination buffer.
+
+    The time of a step is that of its own expression only. The steps
+    nested in it are counted separately.
+    """
+
+    # What report() can sort by, and which of our statistics that is.
+    #
+    SORT_KEYS = { "time"    : 1,
+                  "calls"   : 0,
+                  "input"   : 2,
+                  "matches" : 3,
+                  "output"  : 4 }
+
+    ##################################################################
+    #
+    def __init__(self):
+        # For every step we have seen, the step and the list of its
+        # calls, seconds, input bytes, matches and output bytes.
+        #
+        self.stats = { }
+        self.lock = threading.Lock()
+
+    ##################################################################
+    #
+    def record(self, step, seconds, input_size, matches, output_size):
+        """
+        Add one run of the given step to our statistics.
+
+        Arguments:
+        - `step`: The RegExpStep that was run.
+        - `seconds`: How long its expression took.
+        - `input_size`: How long its input was.
+        - `matches`: How many times its expression matched.
+        - `output_size`: How long its destination buffer was afterwards.
+        """
+        with self.lock:
+            entry = self.stats.get(id(step))
+            if entry is None:
+                entry = self.stats[id(step)] = (step, [0, 0.0, 0, 0, 0])
+            stats = entry[1]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += input_size
+            stats[3] += matches
+            stats[4] += output_size
+        return
+
+    ##################################################################
+    #
+    def clear(self):
+        """
+        Forget everything we have recorded.
+        """
+        with self.lock:
+            self.stats = { }
+        return
+
+    ##################################################################
+    #
+    def report(self, out = sys.stdout, sort = "time", limit = None):
+        """
+        Write out a table of our statistics, one line per step, the
+        biggest first.
+
+        Arguments:
+        - `out`: The file to write to.
+        - `sort`: What to sort the steps by: one of SORT_KEYS
+        - `limit`: If given, write out only this many steps.
+        """
+        index = self.SORT_KEYS[sort]
+        with self.lock:
+            entries = sorted(self.stats.values(),
+                             key = lambda entry: entry[1][index],
+                             reverse = True)
+        if limit is not None:
+            entries = entries[:limit]
+
+        out.write("%8s %10s %10s %12s %9s %12s  %s\n" % \
+                  ("calls", "total ms", "ms/call", "input bytes",
+                   "matches", "output bytes", "step"))
+        for step, (calls, seconds, input_size, matches, output_size) \
+                in entries:
+            where = step.path
+            if step.line is not None:
+                where += " (line %d)" % step.line
+            out.write("%8d %10.2f %10.3f %12d %9d %12d  %s\n" % \
+                      (calls, seconds * 1000.0, seconds * 1000.0 / calls,
+                       input_size, matches, output_size, where))
+        return
+
+    ##################################################################
+    #
+    def write_folded(self, out):
+        """
+        Write out the time of every step in the 'folded stacks' format
+        that flame graph tools (ie: flamegraph.pl) read: one line per
+        step with the semicolon separated steps it is nested in, itself
+        last, followed by the microseconds it took.
+
+        Arguments:
+        - `out`: The file to write to.
+        """
+        with self.lock:
+            entries = self.stats.values()
+        for step, stats in sorted(entries, key = lambda entry: entry[0].path):
+            frames = step.frames or tuple(step.path.split("/"))
+            out.write("%s %d\n" % (";".join(frames),
+                                   int(round(stats[1] * 1000000))))
+        return
+
+##################################################################
+##################################################################
+#
+class ScraperParser(object):
+    """
+    A parser for xbmc/plex scraper xml files.
+    """
+
+    # How many buffers do we support (see the module level NUM_BUFFERS.)
+    #
+    NUM_BUFFERS = NUM_BUFFERS
+
+    # How many compiled expressions we keep in our RegexCache.
+    #
+    REGEX_CACHE_SIZE = 256
+
+    # The default of how many seconds one <expression> may spend matching
+    # its input, and one call to parse() may run for, before they are
+    # stopped with a ParseTimeout. None for no limit. Each parser's
+    # 'expression_budget' and 'function_budget' may be set on their own.
+    #
+    # We can only check these between matches. A single match that runs
+    # away can only be stopped by killing the process it is running in
+    # (see 'clock' and Scraper.lookup_many())
+    #
+    EXPRESSION_BUDGET = 10.0
+    FUNCTION_BUDGET = 60.0
+
+    # Our attributes that are compiled from our definition. These are
+    # what a DefinitionCache keeps for us (see compiled())
+    #
+    COMPILED = ("name", "content", "cache_persistence", "functions",
+                "hazards")
+
+    ##################################################################
+    #
+    def __init__(self, xml_document, logger = logging.getLogger(),
+                 compiled = None):
+        """
+        Arguments:
+        - `xml_document`: The XML scraper definition.
+        - `compiled`: If given, what compiled() returned for a parser of
+                      the same definition, which we use instead of
+                      compiling the definition again.
+        """
+        self.logger = logging.getLogger(logger.name + ".ScraperParser")
+        self.tracer = Tracer(self.logger)
+
+        # We keep the definition around for when we need the line numbers
+        # of its steps.
+        #
+        self.xml_document = xml_document
+        if compiled is None:
+            self.compile()
+        else:
+            self.__dict__.update(compiled)
+
+        self.expression_budget = self.EXPRESSION_BUDGET
+        self.function_budget = self.FUNCTION_BUDGET
+
+        # Expressions that have to be compiled after their buffers and
+        # settings have been substituted in are cached here.
+        #
+        self.regex_cache = RegexCache(self.REGEX_CACHE_SIZE)
+
+        # The Profiler we record the runs of our steps in, if any.
+        #
+        self.profiler = None
+
+        # If set, a shared multiprocessing value that parse() sets to when
+        # it started running a function, and back to 0 when it is done,
+        # so that another process can tell when we have been stuck in one
+        # for longer than our function_budget.
+        #
+        self.clock = None
+
+        # The buffers that set_buffer() fills in for the next call to
+        # parse(), for callers that still use the parser that way. Each
+        # thread has its own.
+        #
+        self.local = threading.local()
+
+    ##################################################################
+    #
+    def compile(self):
+        """
+        Compile our definition in to our COMPILED attributes.
+        """
+        doc = parse_xml(self.xml_document)
+        if doc.tag.lower() != "scraper":
+            raise BadXML("The scraper XML document's first child is "
+                         "NOT <scraper>")
+
+        self.name = doc.get("name", "").lower()
+        self.content = doc.get("content", "").lower()
+
+        if self.name == "" or self.content == "":
+            raise BadXML("The <scraper> tag must have both a 'name' and "
+                         " 'content' attribute.")
+
+        if self.content not in ("movies", "tvshows"):
+            raise BadXML("The <scraper> 'content' attribute must be 'movies' "
+                         "or 'tvshows'. '%s' is not recognized." % \
+                         self.content)
+
+        # How long the responses to the requests made for this definition
+        # may be cached for. Like XBMC we take this from the <scraper>
+        # tag's 'cachePersistence' attribute, given as 'hh:mm'. None if the
+        # definition does not say.
+        #
+        self.cache_persistence = None
+        persistence = doc.get("cachePersistence", "")
+        if persistence != "":
+            try:
+                hours, ign, minutes = persistence.partition(":")
+                self.cache_persistence = (int(hours) * 60 + \
+                                          int(minutes or 0)) * 60
+            except ValueError:
+                raise BadXML("The <scraper> 'cachePersistence' attribute "
+                             "must be of the form 'hh:mm', not '%s'" % \
+                             persistence)
+
+        # Compile every function tag of the definition in to a
+        # ScraperFunction. Tag names are looked up case insensitively and,
+        # like first_child(), the first tag with a given name wins.
+        #
+        self.functions = { }
+        for child in doc:
+            name = child.tag.lower()
+            if name not in self.functions:
+                self.functions[name] = ScraperFunction(child)
+
+        # Note the expressions that could take forever to run on a page
+        # they were not written for (see expression_hazards()) so that
+        # whoever looks after the definition can find them.
+        #
+        # They are only logged here, when the definition is compiled. A
+        # parser loaded from what compiled() returned does not log them
+        # again, and so does not have to parse its definition again to
+        # find out what lines they are on (see location())
+        #
+        self.hazards = [ ]
+        for function in self.functions.itervalues():
+            for step in function.all_steps():
+                self.hazards.extend((step, hazard) for hazard in step.hazards)
+        if self.logger.isEnabledFor(logging.INFO):
+            for step, hazard in self.hazards:
+                self.logger.info("%s: <expression> has %s: '%s'",
+                                 self.location(step), hazard, step.expression)
+        return
+
+    ##################################################################
+    #
+    def compiled(self):
+        """
+        Return a dict of our COMPILED attributes, which may be pickled and
+        given to the constructor of another parser of the same definition.
+        """
+        return dict((attr, getattr(self, attr)) for attr in self.COMPILED)
+
+    ##################################################################
+    #
+    def custom_function_calls(self):
+        """
+        Return a dict of the name of each of our functions, in lower
+        case, to the set of the names, also in lower case, of the custom
+        functions its output may call: those named by the 'function'
+        attribute of a <url> in the output of one of its steps.
+        """
+        calls = { }
+        for name, function in self.functions.iteritems():
+            calls[name] = set(called.lower() for step in function.all_steps()
+                              for called in url_function_re.findall(
+                                  step.output.text))
+        return calls
+
+    ##################################################################
+    #
+    def profile(self, profiler = None):
+        """
+        Record every <RegExp> step we run from now on in the given
+        Profiler, or, if it is None, stop profiling. Returns the profiler.
+
+        The first time we are profiled we find out the line of the
+        definition each of our steps is on.
+
+        Arguments:
+        - `profiler`: The Profiler to record in.
+        """
+        if profiler is not None:
+            self.number_steps()
+        self.profiler = profiler
+        return profiler
+
+    ##################################################################
+    #
+    def number_steps(self):
+        """
+        Fill in the 'line' and 'frames' of every one of our steps, if we
+        have not already. We parse our definition again to do this since
+        the XML parser we load it with does not keep track of lines.
+        """
+        lines = { }
+        doc = parse_xml_lines(self.xml_document)
+        seen = set()
+        for element in doc:
+            if element.tag.lower() in seen:
+                continue
+            seen.add(element.tag.lower())
+            pending = [(element.tag, element)]
+            while pending:
+                path, parent = pending.pop()
+                lines[path] = parent.sourceline
+                for i, child in enumerate(step_elements(parent)):
+                    pending.append(("%s/%s[%d]" % (path, child.tag, i + 1),
+                                    child))
+
+        for function in self.functions.itervalues():
+            frames = { function.name : (function.name,) }
+            for step in function.all_steps():
+                if step.frames is not None:
+                    continue
+                step.line = lines.get(step.path)
+                parent, ign, name = step.path.rpartition("/")
+                if step.line is not None:
+                    name = "%s:%d" % (name, step.line)
+                step.frames = frames[parent] + (name,)
+                frames[step.path] = step.frames
+        return
+
+    ##################################################################
+    #
+    def location(self, step):
+        """
+        Return where in our definition the given step is, for messages,
+        ie: 'GetDetails/RegExp[2]/RegExp[1] (line 57)'
+
+        Arguments:
+        - `step`: One of our RegExpStep's.
+        """
+        if step.frames is None:
+            self.number_steps()
+        if step.line is None:
+            return step.path
+        return "%s (line %d)" % (step.path, step.line)
+
+    ##################################################################
+    #
+    def context(self):
+        """
+        Return the ParseContext that set_buffer() and get_buffer() work
+        on in this thread, creating it if need be. The next call to
+        parse() in this thread that is not given its own buffers runs
+        with it.
+        """
+        context = getattr(self.local, "context", None)
+        if context is None:
+            context = ParseContext(logger = self.logger,
+                                   tracer = self.tracer)
+            self.local.context = context
+        return context
+
+    ##################################################################
+    #
+    def clear_buffers(self):
+        """
+        Set each parameter buffer of this thread's pending ParseContext to
+        the empty string.
+        """
+        self.local.context = None
+        return
+
+    ##################################################################
+    #
+    def set_buffer(self, i, data, append = False):
+        """
+        Set a parameter buffer of this thread's pending ParseContext (see
+        context()) to the given data. Callers that can should pass their
+        buffers to parse() instead.
+
+        Arguments:
+        - `i`: The 1-based index of the buffer to set.
+        - `data`: The data to set in to the buffer.
+        - `append`: Is the data appended to the buffer (True) or does it
+                    replace the contents of the buffer (False)
+        """
+        self.context().set_buffer(i, data, append)
+        return
+
+    ##################################################################
+    #
+    def get_buffer(self, i):
+        """
+        Return the value of the buffer at the given index of this thread's
+        pending ParseContext.
+
+        Arguments:
+        - `i`: 1-based index of parameter buffer to return.
+        """
+        return self.context().get_buffer(i)
+
+    ##################################################################
+    #
+    def replace_buffers(self, dest, context):
+        """
+        In the string `dest` replace all occurrences of `$$1` through
+        `$$<n>` (where n == NUM_BUFFERS) with the contents of the
+        context's buffers (where $$1 == context.get_buffer(1)), and all
+        occurrences of `$INFO[<foo>]` with the value of the setting `<foo>`.
+
+        We also replace occurrences of the three character string
+        `\\n` with an actual newline (`\n`) Return the resulting string.
+
+        `dest` may be a string, which we tokenize, or an already tokenized
+        Template.
+
+        Arguments:
+        - `dest`: string or Template to carry out replacements on.
+        - `context`: The ParseContext of the function being run.
+        """
+        if not isinstance(dest, Template):
+            dest = Template(dest)
+        result = dest.render(context.buffers, context.settings)
+        if self.tracer.enabled:
+            self.tracer.event("replace_buffers", "replace_buffers: "
+                              "'%(template)s', after replace: '%(result)s'",
+                              template = dest, result = result)
+        return result
+
+    ##################################################################
+    #
+    def check_condition(self, step, context):
+        """
+        <RegExp> statements may have a 'conditional' attribute. This attribute
+        is a test we need to apply to see if we should or should not evaluate
+        this expression.
+
+        If the condition named in the conditional attribute is set to 'True'
+        in our dict, then we return True, unless the conditional attribute
+        begins with a '!' in which case we invert the logic of our test.
+
+        If a conditional attribute does not exist in our conditions, it is the
+        same as it being set to 'False'.
+
+        Arguments:
+        - `step`: The compiled RegExpStep we are checking the conditional of
+        - `context`: The ParseContext of the function being run.
+        """
+        # No condition, then we execute this statement.
+        #
+        if len(step.conditional) == 0 and not step.invert_condition:
+            return True
+
+        # We have a conditional. If it began with a '!' we invert our test.
+        #
+        result = not step.invert_condition
+        conditional = step.conditional
+
+        settings = context.settings
+        if settings is not None and conditional in settings.ids:
+            if settings.value(conditional) is True:
+                return result
+            return not result
+        return not result
+
+    ##################################################################
+    #
+    def parse_expression(self, step, context):
+        """
+
+        NOTE: The 'output' of this function is the side effect of running the
+              'replace_buffers()' method, the input being the parsed and
+              filled 'output' attribute format statement.
+
+        Arguments:
+        - `step`: The compiled RegExpStep that we are going to process.
+        - `context`: The ParseContext of the function being run.
+
+        Returns how long our input was and how many times our expression
+        matched it, for our profiler.
+        """
+        # The input to our expression is an attribute of the regexp node
+        # which we perform a buffer replace on. This lets us feed the output
+        # of other regexp's in to this one provided our caller put the correct
+        # data in to the correct buffer.
+        #
+        # If the <RegExp> does not have an input attribute, we just snarf
+        # buffer 1 for our input.
+        #
+        tracer = self.tracer
+        if tracer.enabled:
+            tracer.event("expression.enter", "%(indent)s++++ Entered parse "
+                         "expression, input='%(input)s'", step = step,
+                         input = step.input,
+                         indent = "  " * context.regexp_level)
+        if len(step.input) > 0:
+            input_data = self.replace_buffers(step.input, context)
+        else:
+            input_data = context.get_buffer(1)
+
+        # Think of 'dest' as the 'return value' buffer. It is where whoever
+        # called this <RegExp> node wants the output of processing this
+        # <RegExp> to be stored.
+        #
+        # NOTE: Buffers are defined as being 1-based, not 0-based..
+        #
+        append = step.append
+        dest_buffer = step.dest
+
+        # If they have no <expression> tag then we have nothing to parse.
+        #
+        if not step.has_expression:
+            return (len(input_data), 0)
+
+        # output is our format string that describes how we want the data
+        # we scrape outputted.
+        #
+        output_pattern = self.replace_buffers(step.output, context)
+
+        if step.expression_re is not None:
+            expression_re = step.expression_re
+            str_expression = expression_re.pattern
+        else:
+            str_expression = self.replace_buffers(step.expression, context)
+            expression_re = self.regex_cache.compile(str_expression)
+
+        # If the expression does not matches and 'clear' is set, upon leaving
+        # this function, this buffer must empty, so we just empty it now.
+        #
+        if step.clear:
+            context.set_buffer(dest_buffer, "")
+
+        optional = step.optional
+        compare = step.compare
+        if compare:
+            context.set_buffer(compare, context.get_buffer(compare).lower())
+
+        # Parse the output pattern in to its literal parts and its match
+        # group references once, instead of once for every match. If it
+        # does not parse no match will produce any output.
+        #
+        output_template = step.output_template
+        if output_template is None:
+            try:
+                output_template = sre_parse.parse_template(output_pattern,
+                                                           expression_re)
+            except re.error:
+                output_template = None
+
+        if tracer.enabled:
+            tracer.event("expression.pattern", "%(indent)sparse_expression, "
+                         "for re '%(expression)s', output pattern is: "
+                         "'%(output)s', %(step)s", step = step,
+                         expression = str_expression, output = output_pattern,
+                         indent = "  " * context.regexp_level)
+        # We give up on the expression if it has run for longer than it
+        # may, or than what is left of the function's time. We can only
+        # check between matches, and once it is done, since the 're'
+        # module can not be interrupted in the middle of one.
+        #
+        start = time.time()
+        deadline = context.deadline
+        if self.expression_budget is not None and \
+                (deadline is None or
+                 start + self.expression_budget < deadline):
+            deadline = start + self.expression_budget
+
+        # For every match of our expression re in the current input do..
+        #
+        matches = 0
+        for m in expression_re.finditer(input_data):
+            matches += 1
+            if deadline is not None and time.time() > deadline:
+                self.out_of_time(step, start, matches, input_data,
+                                 str_expression)
+            if tracer.enabled:
+                tracer.event("expression.match", "parse_expression: matched: "
+                             "%(groups)r", step = step,
+                             groups = [g[:20] for g in m.groups()
+                                       if g is not None])
+
+            # If we are not appending to our destination buffer, be sure to
+            # clear it.. this is in case nothing matches and we end up not
+            # setting anything in the buffer. Since we are looping, every
+            # additional match we need to append (in this function)
+            #
+            if not append:
+                context.set_buffer(dest_buffer, "")
+                append = True
+
+            # This block of code is very confusing. It basically seems to
+            # remove the '\<n>'
+            if optional:
+                if tracer.enabled:
+                    tracer.event("expression.optional", "Need the optional "
+                                 "param in buffer \\%(buffer)d", step = step,
+                                 buffer = optional)
+                param = m.expand(r'\%d' % optional)
+                m2 = optional_re.search(output_pattern)
+                raise NotImplemented
+
+#                 sz_param = m.group(optional)
+#                 reg2 = re.compile("(.*)(\\\\\\(.*\\\\2.*)\\\\\\)(.*)",re.DOTALL)
+#                 m2 = reg2.search(output_pattern)
+#                 if m2:
+#                     if szParam and szParam != "":
+#                         output_pattern = output_pattern[:m2.start(2)] + \
+#                             output_pattern[m2.end(2):]
+#                     else:
+#                         # output_pattern = output_pattern
+#                         # bloody confusing
+#                         pass
+
+            result = self.expand(m, output_template, step)
+            if result is not None and len(result) > 0:
+                result = self.replace_buffers(result, context)
+#                 self.logger.debug("parse_expression: after cleaning: %s" % result)
+                if compare is not None:
+                    if result.lower().find(context.get_buffer(compare)) != -1:
+                        context.set_buffer(dest_buffer, result, append)
+                else:
+                    context.set_buffer(dest_buffer, result, append)
+
+            # If repeat is not set then we exit after one iteration
+            # through all the patterns that matched our regexp.
+            #
+            if not step.repeat:
+                break
+
+        if deadline is not None and time.time() > deadline:
+            self.out_of_time(step, start, matches, input_data, str_expression)
+        if tracer.enabled:
+            tracer.event("expression.leave", "parse_expression: output: "
+                         "buffer: %(buffer)d, '%(output)s'\n%(indent)s---- "
+                         "Leaving parse expression", step = step,
+                         buffer = dest_buffer, matches = matches,
+                         output = context.get_buffer(dest_buffer),
+                         indent = "  " * context.regexp_level)
+        return (len(input_data), matches)
+
+    ##################################################################
+    #
+    def out_of_time(self, step, start, matches, input_data, expression):
+        """
+        Raise the ParseTimeout for a step whose expression ran past its
+        deadline (see parse_expression())
+
+        Arguments:
+        - `step`: The RegExpStep.
+        - `start`: When its expression started matching.
+        - `matches`: How many times it had matched.
+        - `input_data`: The input it was matching.
+        - `expression`: The expression, after substitution.
+        """
+        raise ParseTimeout("%s: gave up on <expression> after %.1f seconds "
+                           "and %d matches on %d bytes of input: '%s'" % \
+                           (self.location(step), time.time() - start,
+                            matches, len(input_data), expression))
+
+    ##################################################################
+    #
+    def parse_regexp(self, steps, context):
+        """
+        Run a list of compiled <RegExp> steps in order. Each step has its
+        children run, depth-first, before it is run itself.
+
+        Arguments:
+        - `steps`: The list of RegExpStep's to run.
+        - `context`: The ParseContext of the function being run.
+        """
+
+        context.regexp_level += 1
+        tracer = self.tracer
+        if tracer.enabled:
+            tracer.event("regexp.enter", "%(indent)s^^^ entering parse_regexp",
+                         indent = "  " * context.regexp_level)
+        for step in steps:
+            if tracer.enabled:
+                tracer.event("regexp.step", "%(indent)sregexp, %(step)s",
+                             step = step, indent = "  " * context.regexp_level)
+            if context.deadline is not None and time.time() > context.deadline:
+                raise ParseTimeout("%s: <%s> ran for more than %s seconds" % \
+                                   (self.location(step),
+                                    step.path.partition("/")[0],
+                                    self.function_budget))
+
+            # We skip regexp's whose condition does not evaluate to True
+            #
+            if self.check_condition(step, context):
+                # If this step has child steps then we run them first,
+                # performing a depth-first parsing of <RegExp> elements.
+                #
+                if step.children:
+                    self.parse_regexp(step.children, context)
+
+                # A step whose output is never read is not run (see
+                # ScraperFunction.analyze())
+                #
+                if not step.live:
+                    continue
+
+                # Parse this <RegExp> node..
+                #
+                profiler = self.profiler
+                if profiler is None:
+                    self.parse_expression(step, context)
+                else:
+                    start = time.time()
+                    input_size, matches = self.parse_expression(step,
+                                                                context)
+                    profiler.record(step, time.time() - start, input_size,
+                                    matches,
+                                    len(context.get_buffer(step.dest)))
+
+                # Let go of the buffers no step after this one reads.
+                #
+                for i in step.release:
+                    context.buffers.set(i, "")
+
+        if tracer.enabled:
+            tracer.event("regexp.leave", "%(indent)svvv leaving parse_regexp",
+                         indent = "  " * context.regexp_level)
+        context.regexp_level -= 1
+        return
+
+    ##################################################################
+    #
+    def parse(self, tag_name, settings = None, buffers = None):
+        """
+        Run the function (tag) of the given name and return its result.
+
+        Everything the run changes is kept in a ParseContext of its own so
+        any number of threads may be running functions of the same parser
+        at the same time.
+
+        Arguments:
+        - `tag_name`: The name of the tag we wish to parse.
+        - `settings`: The Settings the function sees.
+        - `buffers`: A list of the strings to put in buffers 1, 2, ... If
+                     None the buffers filled in by set_buffer() are used.
+        """
+        function = self.functions.get(tag_name.lower())
+        if function is None:
+            raise BadXML("No such tag <%s>" % tag_name)
+        tracer = self.tracer
+        tracer.refresh()
+
+        if buffers is None:
+            context = self.context()
+            self.clear_buffers()
+        else:
+            context = ParseContext(logger = self.logger,
+                                   tracer = self.tracer)
+            for i, data in enumerate(buffers):
+                context.set_buffer(i + 1, data)
+        context.settings = settings
+        context.deadline = None
+        if self.function_budget is not None:
+            context.deadline = time.time() + self.function_budget
+
+        result_buffer = function.dest
+        if tracer.enabled:
+            tracer.event("parse.enter", "parse: Parsing tag <%(tag)s>, dest "
+                         "buffer: %(buffer)d", tag = tag_name,
+                         buffer = result_buffer)
+
+        # Now we run the compiled <RegExp> steps under <'tag_name'>.
+        #
+        clock = self.clock
+        if clock is not None:
+            clock.value = time.time()
+        try:
+            self.parse_regexp(function.steps, context)
+        finally:
+            if clock is not None:
+                clock.value = 0
+
+        # our return result is the contents of the parameter buffer.
+        #
+        # NOTE: 'dest' is 1-9, not 0-8
+        #
+        result = setting_re.sub(context.replace_setting,
+                                context.get_buffer(result_buffer))
+
+        # What we return is an ASCII string, as it has always been, so
+        # this is where text is finally encoded.
+        #
+        if isinstance(result, unicode):
+            result = result.encode("ascii", "xmlcharrefreplace")
+        if tracer.enabled:
+            tracer.event("parse.leave", "parse tag <%(tag)s>, result: "
+                         "'%(result)s'", tag = tag_name, result = result)
+        return result
+
+    ##################################################################
+    #
+    def expand(self, match, output_template, step):
+        """
+        Like the match object's 'expand()' method, return the output
+        template with each of its match group references replaced by the
+        contents of that group. Before they are put in to the output
+        each group is 'cleaned' and 'trimmed' as the step asks for.
+
+        Like 'expand()' if the output refers to a group that does not
+        exist or that did not participate in the match, we fail, but we
+        return None instead of raising an exception.
+
+        Arguments:
+        - `match`: The match object for one match of our expression.
+        - `output_template`: The output pattern as parsed by
+                             sre_parse.parse_template()
+        - `step`: The compiled RegExpStep being run.
+        """
+        if output_template is None:
+            return None
+        groups, literals = output_template
+        literals = literals[:]
+        for index, group in groups:
+            try:
+                data = match.group(group)
+            except IndexError:
+                return None
+            if data is None:
+                return None
+            if group in step.clean:
+                data = clean_text(data)
+            if group in step.trim:
+                data = data.strip()
+            literals[index] = data
+        return join_text(literals)
+
+##################################################################
+##################################################################
+#
+class DefinitionCache(object):
+    """
+    Keeps compiled scraper definitions, and the output of their
+    <GetSettings>, in a directory so that a Scraper for a definition that
+    has been compiled before, by any process, can be created without
+    compiling it again.
+
+    Each definition is kept in a file of its own named after the sha1 of
+    ENGINE_VERSION and the definition's XML. A definition that changes,
+    or a new version of this module, gets a new file. Files that can not
+    be read are ignored (and replaced.)
+    """
+
+    ##################################################################
+    #
+    def __init__(self, directory, logger = logging.getLogger()):
+        """
+        Arguments:
+        - `directory`: The directory to keep compiled definitions in. It
+                       is created if it does not exist.
+        """
+        self.directory = directory
+        self.logger = logging.getLogger(logger.name + ".DefinitionCache")
+
+    ##################################################################
+    #
+    def key(self, xml):
+        """
+        Return the key, and file name, of the given definition.
+
+        Arguments:
+        - `xml`: The XML scraper definition.
+        """
+        if isinstance(xml, unicode):
+            xml = xml.encode("utf-8")
+        return hashlib.sha1("%d\n%s" % (ENGINE_VERSION, xml)).hexdigest()
+
+    ##################################################################
+    #
+    def get(self, xml):
+        """
+        Return what was put() for the given definition, or None if we do
+        not have it.
+
+        Arguments:
+        - `xml`: The XML scraper definition.
+        """
+        key = self.key(xml)
+        try:
+            with open(os.path.join(self.directory, key), "rb") as f:
+                version, stored_key, value = cPickle.load(f)
+        except IOError:
+            return None
+        except Exception, e:
+            self.logger.info("Can not read compiled definition %s: %s",
+                             key, e)
+            return None
+        if version != ENGINE_VERSION or stored_key != key:
+            return None
+        return value
+
+    ##################################################################
+    #
+    def put(self, xml, value):
+        """
+        Keep the given value for the given definition. If we can not
+        write it out we carry on without it.
+
+        Arguments:
+        - `xml`: The XML scraper definition.
+        - `value`: What to keep, which must be picklable.
+        """
+        key = self.key(xml)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+
+            # We write to a file of our own and rename it in to place so
+            # that other processes never see a partly written one.
+            #
+            fd, temp_name = tempfile.mkstemp(dir = self.directory,
+                                             prefix = key + ".")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    cPickle.dump((ENGINE_VERSION, key, value), f,
+                                 cPickle.HIGHEST_PROTOCOL)
+                os.rename(temp_name, os.path.join(self.directory, key))
+            except:
+                os.unlink(temp_name)
+                raise
+        except (OSError, IOError, cPickle.PicklingError), e:
+            self.logger.info("Can not write compiled definition %s: %s",
+                             key, e)
+        return
+
+##################################################################
+##################################################################
+#
+class Settings(object):
+    """
+    Scrapers can have settings. The purpose of this class is to hold
+    the definition of those setting as given by the scraper so that
+    other code can interrogate them for dispaly and setting in a UI.
+
+    A setting definition has a label, id, type, value, and optionally
+    a default.
+
+    The settings object also holds the current state of the settings
+    as well as their default.
+
+    XXX I wonder if we should have a 'setting' class that is an
+        individual setting instead of a settings class. I am using a
+        settings class that holds all of the settings to make the
+        parsing of the settings definitions and passing them around a
+        little more collected.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, settings_xml):
+        """
+        A settings object is initialized with the '<settings>' XML
+        output of the scraper. We take this and parse it into a set of
+        dictionaries that describe the settings and their values. The
+        key for these dictionaries is the setting id.
+        """
+        # The list of setting ids.
+        #
+        # XXX This is redundant. We could just get the ids from
+        #     getting the values of any of our dicts.
+        #
+        self.ids = []
+        self.values = { }
+        self.types = { }
+        self.defaults = { }
+        self.labels = { }
+
+        if settings_xml:
+            for setting in children(parse_xml(settings_xml), "setting"):
+                setting_id = setting.get("id", "")
+
+                # I know the 'sep' setting has no id. I am not sure what it is
+                # used for so I am just going to skip it.
+                #
+                if setting_id != "":
+                    self.ids.append(setting_id)
+                    self.labels[setting_id] = setting.get("label", "")
+                    self.types[setting_id] = setting.get("type", "")
+
+                    # For bool's actually set the default value to True or
+                    # False.  otherwise it is all strings to us.
+                    #
+                    default = setting.get("default", "")
+                    if self.types[setting_id] == "bool":
+                        self.defaults[setting_id] = (default.lower() == 'true')
+                    else:
+                        self.defaults[setting_id] = default
+
+                    # Settings start out with their default value.
+                    #
+                    self.values[setting_id] = self.defaults[setting_id]
+
+        # There is always an 'override' setting - "override", which is
+        # set based on the Language Override setting in the scraper.
+        #
+        if 'override' not in self.ids:
+            self.ids.append("override")
+            self.values["override"] = False
+            self.types["override"] = "bool"
+            self.defaults["override"] = False
+            self.labels["override"] = "Language Override"
+
+        # The default language for now is english!
+        #
+        if 'language' not in self.ids:
+            self.ids.append("language")
+            self.values["language"] = "en"
+            self.types["language"] = "string"
+            self.defaults["language"] = "en"
+            self.labels["language"] = "Language"
+
+        return
+
+    ##################################################################
+    #
+    def value(self, setting_id):
+        """
+        Return the value of the given setting.
+
+        Arguments:
+        - `setting_id`: The string id for this setting. If the setting
+                        does not exist we go out on a limb and return False.
+        """
+        if setting_id not in self.values:
+            return False
+        return self.values[setting_id]
+
+    ##################################################################
+    #
+    def set_value(self, setting_id, value):
+        """
+        Set the given setting to the given value.
+
+        NOTE: You can only set values for id's that exist.
+
+        XXX We should do type checking on the value.
+
+        Arguments:
+        - `setting_id`: The id for the setting..
+        - `value`: The value to set it to.
+        """
+        if setting_id not in self.values:
+            raise KeyError
+
+        if self.types[setting_id] == "bool":
+            self.values[setting_id] = (value.lower() == 'true')
+        else:
+            self.defaults[setting_id] = value
+        return
+
+    ##################################################################
+    #
+    def reset(self, setting_id = None):
+        """
+        Reset a setting to its default value. If no id is given then all
+        of the values are reset to their defaults.
+
+        Arguments:
+        - `setting_id`: The id to reset.
+        """
+        if setting_id is None:
+            self.values = self.defaults.copy()
+        else:
+            self.values[setting_id] = self.defaults[setting_id]
+        return
+
+    ##################################################################
+    #
+    def __str__(self):
+        result = []
+        for setting_id in self.ids:
+            result.append("id: %s, label: '%s', type: %s, default: '%s', " \
+                              "value: '%s'" % (setting_id,
+                                               self.labels[setting_id],
+                                               self.types[setting_id],
+                                               self.defaults[setting_id],
+                                               self.values[setting_id]))
+        return "< Setting: %s >" % "; ".join(result)
+
+##################################################################
+##################################################################
+#
+class Scraper(object):
+    """
+    The work horse object that is given an XML file, a show name, and
+    what data to extract via the scraper defined in the XML file.
+    """
+
+    # How many calls the asynchronous methods (alookup(),
+    # Show.aget_details(), Series.aget_episode_list() and
+    # Episode.aget_details()) run at the same time.
+    #
+    ASYNC_WORKERS = 8
+
+    # How many seconds past its parser's function_budget a lookup_many()
+    # worker may be stuck in one function before it is killed, and how
+    # often we check.
+    #
+    WORKER_GRACE = 5.0
+    WORKER_POLL = 1.0
+
+    # The years in a search string, and a year in parentheses at the end
+    # of the title of a search result, ie: 'The Matrix (1999)'
+    #
+    re_year = re.compile(r"(?<![0-9])((?:19|20)[0-9][0-9])(?![0-9])")
+    re_title_year = re.compile(r"\s*\(((?:19|20)[0-9][0-9])\)\s*$")
+
+    # What we turn in to a single space when comparing titles.
+    #
+    re_punctuation = re.compile(r"[\W_]+", re.UNICODE)
+
+    # Regular expressions we use precompiled here for efficiency and all that.
+    #
+    # NOTE: the '\+' means match a proceeding plus-sign.. which is the url
+    # escaped value for the space character.
+    #
+    re_tags = re.compile(r"\+(ac3|custom|dc|divx|dsr|dsrip|dutch|dvd|dvdrip|dvdscr|fragment|fs|hdtv|internal|limited|multisubs|ntsc|ogg|ogm|pal|pdtv|proper|repack|rerip|retail|se|svcd|swedish|unrated|ws|xvid|xxx|cd[1-9]|\[.*\])(\+|$)")
+
+    ##################################################################
+    #
+    def __init__(self, scraper_xml, logger = logging.getLogger(),
+                 fetcher = None, response_cache = None, cache_ttl = None,
+                 definition_cache = None):
+        """
+        `scraper_xml` - A string that is the XML scraper we are testing.
+        `fetcher` - The Fetcher used to get the content of our URL's. If
+                    not given we create one with the default number of
+                    workers and per host limit.
+        `response_cache` - The cache the fetcher we create keeps
+                           responses in (ie: a DiskCache.) If not given
+                           it uses a MemoryCache.
+        `cache_ttl` - How many seconds the fetcher we create keeps
+                      responses for. If not given we use the definition's
+                      'cachePersistence', or failing that Fetcher.TTL.
+        `definition_cache` - If given, the DefinitionCache our compiled
+                             definition and settings are loaded from, or,
+                             if it does not have them, saved in.
+        """
+        self.logger = logging.getLogger(logger.name + ".Scraper")
+        self.m_result = ""
+        self.s_xml = scraper_xml
+        self.definition_cache = definition_cache
+        self.written_data = { }
+
+        # If our definition has been compiled before we do not need to
+        # compile it, or run its <GetSettings>, again.
+        #
+        compiled = None
+        if definition_cache is not None:
+            compiled = definition_cache.get(scraper_xml)
+        if compiled is not None:
+            self.parser = ScraperParser(scraper_xml, self.logger,
+                                        compiled["parser"])
+            settings_xml = compiled["settings"]
+        else:
+            self.parser = ScraperParser(scraper_xml, self.logger)
+
+            # We need the settings parsed before the user does any lookups
+            #
+            try:
+                settings_xml = self.parser.parse(FN_GET_SETTINGS)
+            except BadXML:
+                settings_xml = None
+            if definition_cache is not None:
+                definition_cache.put(scraper_xml,
+                                     { "parser"   : self.parser.compiled(),
+                                       "settings" : settings_xml })
+        self.settings = Settings(settings_xml)
+
+        # The fetcher gets the content of all of the URL's we create,
+        # several at a time when it can, and keeps the responses it gets
+        # around for as long as this definition says they are good for.
+        #
+        self.fetcher = fetcher
+        if self.fetcher is None:
+            if response_cache is None:
+                response_cache = MemoryCache()
+            if cache_ttl is None:
+                cache_ttl = self.parser.cache_persistence
+            if cache_ttl is None:
+                cache_ttl = Fetcher.TTL
+            self.fetcher = Fetcher(logger = self.logger,
+                                   cache = response_cache, ttl = cache_ttl)
+
+        # The pool the asynchronous methods run on is created when it is
+        # first needed.
+        #
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+        # As we fetch data from various web resources we store
+        # the results in a cache because later fetches may refer to
+        # cached items to parse additional data out. No need to re-fetch
+        # this from the network if we already have fetched a copy.
+        #
+        self.cache = { }
+        return
+
+    ##################################################################
+    #
+    @classmethod
+    def by_name(cls, name, **kwargs):
+        """
+        Return a Scraper for one of the definitions we ship, ie: 'imdb',
+        'tvdb', 'imdb tv'. See Registry.
+
+        Raises a KeyError if we ship no such definition, and BadXML if it
+        is one that we do not support.
+
+        Arguments:
+        - `name`: The name of the definition.
+        - `kwargs`: The other arguments of our constructor.
+        """
+        xml = registry.definition(name)
+        entry = registry.entry(name)
+        if not entry["supported"]:
+            raise BadXML("The '%s' definition is for '%s', which is not "
+                         "supported" % (entry["name"], entry["content"]))
+        return cls(xml, **kwargs)
+
+    ##################################################################
+    #
+    @classmethod
+    def definitions(cls, content = None):
+        """
+        Return the manifest entries of the definitions we ship that we
+        support, without loading any of them. See Registry.entries()
+
+        Arguments:
+        - `content`: If given, only the definitions for this type of
+                     content, ie: 'movies' or 'tvshows'
+        """
+        return registry.entries(content, supported = True)
+
+    ##################################################################
+    #
+    def write_result(self, file_name):
+        """
+        XXX Another C++ function that can be simplified away.
+
+        Output the contents of self.m_result in to the file with the
+        given file name
+
+        Arguments:
+        - `file_name`: The name of the file to write the results in to.
+        """
+        f = file(file_name, "w")
+        f.write(self.m_result)
+        f.close()
+
+    ##################################################################
+    #
+    def read_file(self, file_name):
+        """
+        XXX another C++ function to trivially replace in Python
+
+        returns the contents of the given file name as a string.
+        Arguments:
+        - `file_name`: Name of the file to read.
+        """
+        f = file(file_name, "r")
+        temp = f.read()
+        f.close()
+
+    ##################################################################
+    #
+    def parse(self, function, buffers):
+        """
+        Run the given function of our scraper definition with the given
+        list of strings in its buffers, the first one in buffer 1, and
+        return the result.
+
+        Arguments:
+        - `function`: The name of the function (tag) to run.
+        - `buffers`: The strings to put in buffers 1, 2, ...
+        """
+        return self.parser.parse(function, self.settings, buffers)
+
+    ##################################################################
+    #
+    def profile(self, profiler = None):
+        """
+        Record every <RegExp> step our definition runs from now on in the
+        given Profiler, or, if it is None, stop profiling. Returns the
+        profiler. See ScraperParser.profile()
+
+        Arguments:
+        - `profiler`: The Profiler to record in.
+        """
+        return self.parser.profile(profiler)
+
+    ##################################################################
+    #
+    def run_async(self, function, args = (), callback = None):
+        """
+        Run the given function on our pool of worker threads and return
+        the multiprocessing.pool.AsyncResult for it, without waiting for
+        it to finish. The result's get() method waits for and returns
+        the function's value, raising any exception it raised.
+
+        At most ASYNC_WORKERS calls are run at the same time; the rest
+        wait in the pool's queue.
+
+        Arguments:
+        - `function`: The function to call.
+        - `args`: The arguments to call it with.
+        - `callback`: If given, called with the function's value when it
+                      returns (on one of the pool's threads.)
+        """
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.ASYNC_WORKERS)
+            pool = self.pool
+        return pool.apply_async(function, args, callback = callback)
+
+    ##################################################################
+    #
+    def close(self):
+        """
+        Shut down the pool the asynchronous methods run on, waiting for
+        any calls still running, and then close our fetcher.
+        """
+        with self.pool_lock:
+            pool = self.pool
+            self.pool = None
+        if pool is not None:
+            pool.close()
+            pool.join()
+        self.fetcher.close()
+        return
+
+    ##################################################################
+    #
+    def custom_function(self, url, entity = None, url_data = None):
+        """
+        We are passed a ScrapeURL object that has a custom function.
+
+        We ask the URL object for its data (unless our caller already
+        has and passes it to us.) If it returns any we then
+        pass that in to the scraper to process via the specific function,
+        if it has it (and it should because the scraper is what gave us the
+        custom function to invoke.)
+
+        If the results we get back have any <url></url>'s that also
+        have a 'function' attribute then we recurse calling ourselves
+        with those custom functions.
+
+        We also pass the results of a custom function (before
+        recursing) to entity object if we were passed it.  If the
+        entity has a method 'fn_<foo>' where <foo> is the custom
+        function we have just parsed, then we pass the results of the
+        custom function to that method on the entity.
+
+        Arguments:
+        - `url`: A ScrapeURL object whose data we pass to the scraper to parse
+                 via the specified custom function
+        - `entity`: The entity that will parse the results of our custom
+                    functions.
+        - `url_data`: The already fetched content of `url`, if any.
+        """
+        self.logger.debug("custom_function: '%s' entering" % url.function)
+
+        # We must have a custom function and poking this URL for its data
+        # must return some data in order for us to bother trying to parse
+        # the data.
+        #
+        if not url.function:
+            self.logger.debug("custom_function: '%s' leaving" % url.function)
+            return None
+
+        if url_data is None:
+            url_data = url.get()
+        if url_data is None:
+            self.logger.debug("custom_function: '%s' leaving" % url.function)
+            return None
+
+        # As is usual with such things, the input data goes in to buffer
+        # one of our parser.
+        #
+        details = self.parse(url.function, [url_data])
+
+        if details is None or details == "":
+            self.logger.debug("custom_function: '%s' leaving" % url.function)
+            return
+
+        d = parse_xml(details)
+
+        # See if our entity knows how to deal with the results of this
+        # custom function.
+        #
+        if entity and hasattr(entity, "fn_" + url.function):
+            getattr(entity, "fn_" + url.function)(details)
+        else:
+            self.logger.debug("Entity did not support custom function '%s'" % \
+                              url.function)
+
+        # Now see if we have any custom functions in our results.. if we
+        # do, recurse for all of them.
+        #
+        sub_urls = [ScrapeURL(u, cache = self.cache, fetcher = self.fetcher)
+                    for u in children(d, "url")]
+
+        self.custom_functions(sub_urls, entity)
+        self.logger.debug("custom_function: '%s' leaving" % url.function)
+        return
+
+    ##################################################################
+    #
+    def custom_functions(self, urls, entity = None):
+        """
+        Invoke custom_function() on each of the given URL's in turn. The
+        content of all of the URL's is fetched, in parallel, before any of
+        the custom functions are run.
+
+        Arguments:
+        - `urls`: A list of ScrapeURL objects with custom functions.
+        - `entity`: The entity that will parse the results of our custom
+                    functions.
+        """
+        urls = [url for url in urls if url.function]
+        for url, url_data in zip(urls, self.fetcher.fetch_all(urls)):
+            self.custom_function(url, entity, url_data)
+        return
+
+    ##################################################################
+    #
+    def clean_search_string(self, search_string):
+        """
+        Return the given search string quoted for use in a query URL with
+        any file name tags (see re_tags) and what follows them cut off.
+
+        Arguments:
+        - `search_string`: The name of the show, movie, whatever we are trying
+                           to look up.
+        """
+        # Quote the search string so that we can pass it as an argument in a
+        # query URL.
+        #
+        # We also treat all '.', '-', and '_' as spaces so translate those
+        # to spaces before we quote.
+        #
+        # A unicode search string is quoted as UTF-8, like the titles we
+        # read from files.
+        #
+        if isinstance(search_string, unicode):
+            search_string = search_string.encode("utf-8")
+        table = string.maketrans(".-_", "   ")
+        search_string = search_string.lower()
         search_string = urllib.quote_plus(search_string.translate(table))
 
-        # If the search string matches our 'tags' regular expression, then
-        # we use only what comes before tag that matched instead of the
-        # entire search string.
-        #
-        # This is to clip off parts of file names used as search terms have
-        # other bits of metadata in the file name that we do NOT want to
-        # carry along, like 'dvd,'ntsc,' group names, etc.
-        #
-        # XXX It is this regexp we will need to enhance to work with titles
-        #     that have fangroups proceeding them.
-        #
-        m = self.re_tags.search(search_string)
-        if m:
-            search_string = search_string[:m.start(1)]
+        # If the search string matches our 'tags' regular expression, then
+        # we use only what comes before tag that matched instead of the
+        # entire search string.
+        #
+        # This is to clip off parts of file names used as search terms have
+        # other bits of metadata in the file name that we do NOT want to
+        # carry along, like 'dvd,'ntsc,' group names, etc.
+        #
+        # XXX It is this regexp we will need to enhance to work with titles
+        #     that have fangroups proceeding them.
+        #
+        m = self.re_tags.search(search_string)
+        if m:
+            search_string = search_string[:m.start(1)]
+        return search_string
+
+    ##################################################################
+    #
+    def create_search_url(self, search_string):
+        """
+        Arguments:
+        - `search_string`: The name of the show, movie, whatever we are trying
+                           to look up.
+        """
+        search_string = self.clean_search_string(search_string)
+
+        # Now, parse the <CreateSearchUrl></CreateSearchUrl> tag. We pass
+        # the name of what we want the search url to search for in via
+        # buffer #1.
+        #
+        url = self.parse(FN_CREATE_SEARCH_URL, [search_string])
+
+        return url
+
+    ##################################################################
+    #
+    def get_search_results(self, url):
+        """
+        Get the search results from some online movie/tv web service as
+        specified by the URL given.
+
+        Arguments:
+        - `url`: The URL to use to search for results.
+        """
+        src_url = ScrapeURL(url, cache = self.cache, fetcher = self.fetcher)
+        self.logger.debug("get_search_results: downloading %s" % src_url.url)
+        url_data = src_url.get()
+
+        # We pass the page we got from the url, and the url itself into
+        # our scaper parser as buffer parameters 1 & 2.
+        #
+        # Parse the <GetSearchResults> tag from our XML definition.
+        #
+        search_results = self.parse(FN_GET_SEARCH_RESULTS,
+                                    [url_data, src_url.url])
+        return search_results
+
+    ##################################################################
+    #
+    def old_get_details(self, entity):
+        """
+        Get the show details based on the given search results.
+
+        Arguments:
+        - `search_results`: element of our search results for a term.
+        """
+        self.logger.debug("get_details: entered")
+
+        # For every <url> tag that this entity has, we fetch the details it
+        # provides.
+        #
+        i = 0
+        for link in children(entity, "url"):
+            i += 1
+            src_url = ScrapeURL(link, cache = self.cache)
+            url_data = src_url.get()
+
+            # If we get back an object with an iterator then we loop over the
+            # elements in our src data, putting successive one in successive
+            # buffers.
+            #
+            if hasattr(url_data, '__iter__'):
+                for j,data in enumerate(url_data):
+                    self.parser.set_buffer(i+j, data)
+                i += j
+            else:
+                self.parser.set_buffer(i, url_data)
+                # XXX for debugging purposes again we write out the details
+                #     we get in uniquely named files that correspond to the
+                #     param buffer we use for the url data.
+                #
+                with open("details.%d.html" % i, "w") as f:
+                    f.write(url_data)
+
+        # Now we get the url based id used to identify this entity, if we
+        # have one. This is passed in to the parser as the next free
+        # parameter buffer.
+        #
+        # XXX NOTE: the xml scraper seems to always expect the id in
+        #           buffer 2 (and then details html in buffer 1.)
+        #
+        entity_id = first_child(entity, "id")
+        if entity_id is not None:
+            entity_id = element_text(entity_id)
+            self.parser.set_buffer(i+1, entity_id)
+            self.logger.debug("get_details: buffer: %d entity id: %s" % \
+                              (i+1,entity_id))
+
+        details = self.parser.parse(FN_GET_DETAILS, self.settings)
+
+        # XXX I think we only need this file for debugging. Eventually
+        #     we will just remove this output statement.
+        #
+        with open("details.%s.xml" % entity_id, "w") as f:
+            f.write(details)
+
+        self.logger.debug("get_details: leaving")
+        return details
+
+    ##################################################################
+    #
+    def old_get_episode_list(self, details):
+        """
+
+        Arguments:
+        - `details`:
+        """
+        self.logger.debug("get_episode_list: entering")
+
+        details = parse_xml(details)
+
+        if len(details) == 0 or details[0].tag != "episodeguide":
+            # We do not have episode guide information for this
+            # XXX Did we lookup movie info for a tv series? Probably
+            #     means that this current search path should be skipped.
+            #
+            return []
+
+        link = first_child(first_child(details, "episodeguide"), "url")
+        episode_lists = []
+        i = 0
+        while link:
+            i += 1
+            src_url = ScrapeURL(url, cache = self.cache)
+            self.logger.debug("get_episode_list: %d: %s" % (i, src_url.url))
+            url_data = src_url.get()
+
+            # XXX file exists for debugging
+            #
+            with open("episodelist.%d.html" % i, "w") as f:
+                f.write(url_data)
+
+            episode_lists.append(url_data)
+
+        # We have now retrieved all of the episode lists for this series
+        # One by one, pass them through our parser.
+        #
+        episode_list_results = []
+        for i, episode_list in enumerate(episode_lists):
+            self.parser.set_buffer(1, episode_list)
+            episode_list_result = self.parser.parse(FN_GET_EPISODE_LIST,
+                                                    self.settings)
+
+            # XXX write retrieved parsed xml data for debugging
+            #
+            with open("episodelist.%d.xml" % i + 1) as f:
+                f.write(episode_list_result)
+
+            episode_list_results.append(episode_list_result)
+
+        self.logger.debug("get_episode_list: leaving")
+        return episode_list_results
+
+    ##################################################################
+    #
+    def old_get_episode_details(self, episode_list_result, i):
+        """
+
+        Arguments:
+        - `episode_list_result`: xml string with the episode list results
+        - `i`: I think this is the 'season' but I am not positive.
+        """
+        self.logger.debug("get_episode_details: entered (%d)" % i)
+        episode_guide = parse_xml(episode_list_result)
+
+        # XXX Hm.. is there a link for each episode?
+        #
+        link = first_child(first_child(episode_guide, "episode"), "url")
+        src_url = ScrapURL(link)
+        url_data = src_url.get()
+
+        with open("episodedetails.%d.html" % i, "w") as f:
+            f.write(url_data)
+
+        self.parser.set_buffer(1, url_data)
+
+        episode_details = self.parser.parse(FN_GET_EPISODE_DETAILS,
+                                            self.settings)
+
+        with open("episodedetails.%d.xml" % i, "w") as f:
+            f.write(episode_details)
+
+        return episode_details
+
+
+    ##################################################################
+    #
+    def get_episode_details(self, episode):
+        """
+        Augment the episode object with the finer details for it.
+
+        It returns the episode object that we update.
+
+        Arguments:
+        - `episode`: Episode object to get more details for.
+        """
+
+        url_data = episode.url.get()
+
+        # XXX Maybe we should just not return a list because we only use
+        #     the first element.
+        #
+        if hasattr(url_data, '__iter__'):
+            url_data = url_data[0]
+
+        episode_details = self.parse(FN_GET_EPISODE_DETAILS,
+                                     [url_data, episode.id])
+
+        self.logger.debug("Episode details: %s", episode_details)
+        episode.set_details(episode_details)
+        return episode
+
+    ##################################################################
+    #
+    def get_episode_list(self, show):
+        """
+        we return a list of Episode objects with their basic information
+        filled in.
+
+        Arguments:
+        - `show`: The Series object to get the episode list for.
+        """
+
+        # If the show has no episode guide url's, then there is nothing
+        # we can fetch..
+        #
+        if len(show.episode_guide_urls) == 0:
+            return []
+
+        episode_list = []
+
+        # Fetch all of the episode guides at once before we parse any of
+        # them.
+        #
+        guides = self.fetcher.fetch_all(show.episode_guide_urls)
+        for url, url_data in zip(show.episode_guide_urls, guides):
+            self.logger.debug("get_episode_list, data from: %s" % url.url)
+
+            # Now we run the GetEpisodeList rules on this data that
+            # we just retrieved.
+            #
+            # This gets us a XML string with the list of episodes in it.
+            # We go through each <episode> element as it is parsed creating
+            # an Episode object to append to our episode list
+            #
+            ep_list_result = self.parse(FN_GET_EPISODE_LIST,
+                                        [url_data, url.url])
+            for ep in iter_children(ep_list_result, "episode"):
+                episode_list.append(Episode(ep, show, self))
+        return episode_list
+
+    ##################################################################
+    #
+    def search(self, search_string):
+        """
+        Run the search for the given search string and return the list of
+        the <entity> elements of its results, in the order the site gave
+        them to us.
+
+        Arguments:
+        - `search_string`: What to look up.
+        """
+        url = self.create_search_url(search_string)
+        self.logger.debug("lookup: using search url: %s" % url)
+        search_results = self.get_search_results(url)
+
+        # Search results is an XML string with basic top level info about
+        # all the entities that matched our search string..
+        #
+        return children(parse_xml(search_results), "entity")
+
+    ##################################################################
+    #
+    def normalize_title(self, title):
+        """
+        Return the given title lower cased, with its punctuation, and
+        runs of white space, turned in to single spaces.
+
+        Arguments:
+        - `title`: The title to normalize.
+        """
+        return self.re_punctuation.sub(" ", title.lower()).strip()
+
+    ##################################################################
+    #
+    def rank(self, search_string, entities):
+        """
+        Score each of the given search results by how well it matches the
+        given search string and return a list of (score, entity) tuples,
+        the best first. Results with the same score stay in the order the
+        site gave them to us.
+
+        The score is how similar the normalized titles are (see
+        difflib.SequenceMatcher), between 0 and 1, adjusted by how well
+        the years match if both the search string and the result have
+        one. The search string is cleaned up as it is for the search (see
+        clean_search_string()) so a file name like
+        'The.Matrix.1999.DVDRip.XviD' is taken to be 'the matrix' from
+        1999.
+
+        Arguments:
+        - `search_string`: What was looked up.
+        - `entities`: The <entity> elements of the search results.
+        """
+        query = urllib.unquote_plus(self.clean_search_string(search_string))
+        year = None
+        years = self.re_year.findall(query)
+        if years:
+            year = int(years[-1])
+
+            # A title that is only a year, ie: '1984', is a title.
+            #
+            title = self.re_year.sub(" ", query)
+            if len(title.strip()) > 0:
+                query = title
+        query = self.normalize_title(query.decode("utf-8", "replace"))
+
+        ranked = []
+        for i, entity in enumerate(entities):
+            title = get_child_data(entity, "title", "")
+            entity_year = try_int(get_child_data(entity, "year"))
+            m = self.re_title_year.search(title)
+            if m:
+                title = title[:m.start()]
+                if entity_year is None:
+                    entity_year = int(m.group(1))
+
+            score = difflib.SequenceMatcher(None, query,
+                                            self.normalize_title(title)).ratio()
+
+            # Release dates often differ by a year from one country to the
+            # next, so an off by one year is only a little less good.
+            #
+            if year is not None and entity_year is not None:
+                if entity_year == year:
+                    score += 0.2
+                elif abs(entity_year - year) == 1:
+                    score += 0.1
+                else:
+                    score -= 0.2
+            ranked.append((score, i, entity))
+        ranked.sort(key = lambda r: (-r[0], r[1]))
+        return [(score, entity) for score, i, entity in ranked]
+
+    ##################################################################
+    #
+    def make_show(self, entity, score = None):
+        """
+        Return the Movie or Series, depending on what our definition is
+        for, for one <entity> of our search results.
+
+        Arguments:
+        - `entity`: The <entity> element.
+        - `score`: Its score from rank(), if it was ranked.
+        """
+        if self.parser.content == "movies":
+            show = Movie(entity, self)
+        else:
+            show = Series(entity, self)
+        show.score = score
+        return show
+
+    ##################################################################
+    #
+    def lookup(self, search_string, limit = None, best_only = False):
+        """
+        Based on the search string it will find a bunch of shows/movies that
+        match and return a list of search results.
+
+        If a `limit` is given, or `best_only`, the search results are
+        ranked by how well they match the search string (see rank()), the
+        best first, and only the shows we return are created. Otherwise
+        they are in the order the site gave them to us.
+
+        Arguments:
+        - `search_string`: What to look up.
+        - `limit`: If given, return at most this many of the best matches.
+        - `best_only`: If True return only the best match, as a list of
+                       one show (or none if nothing matched.)
+        """
+        entities = self.search(search_string)
+        if best_only:
+            limit = 1
+        if limit is None:
+            return [self.make_show(entity) for entity in entities]
+        return [self.make_show(entity, score) for score, entity in \
+                    self.rank(search_string, entities)[:limit]]
+
+    ##################################################################
+    #
+    def alookup(self, search_string, callback = None, limit = None,
+                best_only = False):
+        """
+        Like lookup() except it does not wait. It returns an AsyncResult
+        (see run_async()) whose value is the list of search results.
+
+        Arguments:
+        - `search_string`: What to look up.
+        - `callback`: If given, called with the list of search results
+                      once we have it.
+        - `limit`: Passed to lookup()
+        - `best_only`: Passed to lookup()
+        """
+        return self.run_async(self.lookup, (search_string, limit, best_only),
+                              callback)
+
+    ##################################################################
+    #
+    def lookup_one(self, title, fields = None, episodes = True):
+        """
+        Look up the given title, get the details of the show that best
+        matches it (see rank()), and, for tv shows, its episode list.
+        Return a dict with:
+
+        - 'query': the title
+        - 'results': how many shows matched it
+        - 'score': the best show's score
+        - 'show': the best show's as_dict(), or None if none matched
+
+        or, if looking up the title failed, instead of 'results' and
+        'show':
+
+        - 'error': what went wrong
+
+        A function that runs past its parser's budgets fails with a
+        ParseTimeout, but we run in this process, so that is only noticed
+        between two matches of an expression. One match that backtracks
+        for ever holds us up for ever (see lookup_many())
+
+        Arguments:
+        - `title`: The string to look up.
+        - `fields`: If given, the list of the fields of the show's
+                    as_dict() we want. Only those are returned, and only
+                    the details, custom functions and episode list that
+                    they need are gotten.
+        - `episodes`: If False we do not get the episode lists of tv shows.
+        """
+        result = { "query" : title }
+        try:
+            entities = self.search(title)
+            result["results"] = len(entities)
+            result["show"] = None
+            if len(entities) == 0:
+                return result
+
+            # Only the best match is ever turned in to a show.
+            #
+            score, entity = self.rank(title, entities)[0]
+            show = self.make_show(entity, score)
+            result["score"] = round(score, 3)
+
+            # We only get the show's details if we want more than the
+            # lookup told us, and then only the details we want.
+            #
+            if fields is None or \
+                    len(set(fields) - set(Show.LOOKUP_FIELDS)) > 0:
+                show.get_details(fields)
+                if episodes and isinstance(show, Series) and \
+                        (fields is None or "episodes" in fields):
+                    show.get_episode_list()
+            result["show"] = show.as_dict(fields)
+        except Exception, e:
+            result.pop("results", None)
+            result.pop("score", None)
+            result.pop("show", None)
+
+            # Our own exceptions already say what they are.
+            #
+            if isinstance(e, ScraperException):
+                result["error"] = str(e)
+            else:
+                result["error"] = "%s: %s" % (e.__class__.__name__, e)
+        return result
+
+    ##################################################################
+    #
+    def lookup_iter(self, titles, in_flight = ASYNC_WORKERS, fields = None,
+                    episodes = True):
+        """
+        Like lookup_many() except the titles are looked up by a pool of
+        threads in this process, all using this scraper. A thread can not
+        be killed, so a title stuck in one match of an expression is not
+        stopped (see lookup_one())
+
+        `titles` may be any iterable, ie: lines being read from a pipe. We
+        only take a title from it when there are fewer than `in_flight`
+        titles being looked up, or looked up but not yet taken from us.
 
-        # Now, parse the <CreateSearchUrl></CreateSearchUrl> tag. We pass
-        # the name of what we want the search url to search for in via
-        # buffer #1.
+        This is a generator that yields the dict that lookup_one()
+        returns, with the 'index' of the title added, for each title as
+        soon as it is done.
+
+        If reading `titles` raises an exception, we stop taking titles
+        from it and raise that exception once the titles we did take
+        have been handed back.
+
+        Arguments:
+        - `titles`: The strings to look up.
+        - `in_flight`: The most titles we look up at the same time.
+        - `fields`: Passed to lookup_one()
+        - `episodes`: Passed to lookup_one()
+        """
+        results = Queue.Queue()
+        slots = threading.Semaphore(in_flight)
+        stopped = threading.Event()
+        pool = ThreadPool(in_flight)
+        done = object()
+
+        def lookup(index, title):
+            result = self.lookup_one(title, fields, episodes)
+            result["index"] = index
+            return result
+
+        # The titles are read and handed to the pool by a thread of their
+        # own so that we can hand back results while waiting on a slow
+        # source of titles. If reading them fails, what went wrong is
+        # handed to us along with how many titles there were.
         #
-        self.parser.set_buffer(1,search_string)
-        url = self.parser.parse(FN_CREATE_SEARCH_URL, self.settings)
+        def feed():
+            count = 0
+            error = None
+            try:
+                for index, title in enumerate(titles):
+                    slots.acquire()
+                    if stopped.is_set():
+                        break
+                    pool.apply_async(lookup, (index, title),
+                                     callback = results.put)
+                    count += 1
+            except Exception:
+                error = sys.exc_info()
+            finally:
+                results.put((done, count, error))
+
+        feeder = threading.Thread(target = feed)
+        feeder.daemon = True
+        feeder.start()
 
-        return url
+        try:
+            total = None
+            error = None
+            count = 0
+            while total is None or count < total:
+                result = results.get()
+                if isinstance(result, tuple) and result[0] is done:
+                    ign, total, error = result
+                    continue
+                count += 1
+                slots.release()
+                yield result
+            if error is not None:
+                raise error[0], error[1], error[2]
+        finally:
+            # If our caller stopped early, let the feeder know.
+            #
+            stopped.set()
+            slots.release()
+            pool.terminate()
+        return
 
     ##################################################################
     #
-    def get_search_results(self, url):
+    def lookup_many(self, titles, workers = None, fields = None,
+                    episodes = True):
         """
-        Get the search results from some online movie/tv web service as
-        specified by the URL given.
+        Look up each of the given titles, get the details of the show
+        that best matches it (see rank()), and, for tv shows, its episode
+        list.
+
+        The work is spread over a pool of `workers` processes, each of
+        which loads our definition once. This is a generator that yields
+        the dict that lookup_one() returns, with the 'index' of the title
+        in `titles` added, for each title as soon as that title is done,
+        so they do not come back in the order they were given.
+
+        A title that fails does not stop the rest of the batch.
+
+        A parser can only stop a function that has run for longer than its
+        function_budget between two matches of an expression. A worker
+        that has been in one function for WORKER_GRACE seconds longer than
+        that is stuck in a single match, so we kill it and start another
+        in its place. Its title fails with a ParseTimeout.
 
         Arguments:
-        - `url`: The URL to use to search for results.
+        - `titles`: The strings to look up.
+        - `workers`: How many processes to use. The default is one per
+                     cpu.
+        - `fields`: Passed to lookup_one()
+        - `episodes`: If False we do not get the episode lists of tv shows.
         """
-        src_url = ScrapeURL(url, cache = self.cache)
-        self.logger.debug("get_search_results: downloading %s" % src_url.url)
-        url_data = src_url.get()
-
-        # We pass the page we got from the url, and the url itself into
-        # our scaper parser as buffer parameters 1 & 2.
+        # Our workers use the same settings we do, and the same disk cache
+        # if we have one.
         #
-        self.parser.set_buffer(1, url_data)
-        self.parser.set_buffer(2, src_url.url)
+        cache_file = None
+        if isinstance(self.fetcher.cache, DiskCache):
+            cache_file = self.fetcher.cache.path
+        definition_cache_dir = None
+        if self.definition_cache is not None:
+            definition_cache_dir = self.definition_cache.directory
+        init_args = (self.s_xml, self.settings.values, cache_file,
+                     self.fetcher.ttl, definition_cache_dir)
+        budget = self.parser.function_budget
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
+        jobs = ((i, title, fields, episodes) \
+                    for i, title in enumerate(titles))
+        idle = [LookupWorker(init_args) for i in range(workers)]
+        busy = []
+        try:
+            more = True
+            while True:
+                # Hand out titles to the workers that are free.
+                #
+                while more and idle:
+                    try:
+                        job = jobs.next()
+                    except StopIteration:
+                        more = False
+                        break
+                    worker = idle.pop()
+                    worker.send(job)
+                    busy.append(worker)
+                if not busy:
+                    break
+
+                ready, ign, ign = select.select([w.conn for w in busy], [],
+                                                [], self.WORKER_POLL)
+                now = time.time()
+                for worker in list(busy):
+                    if worker.conn in ready:
+                        try:
+                            result = worker.receive()
+                        except (EOFError, IOError):
+                            result = worker.failed("the worker process "
+                                                   "looking it up died")
+                    elif budget is not None and \
+                            worker.stuck(budget + self.WORKER_GRACE, now):
+                        result = worker.failed(str(ParseTimeout(
+                            "a function ran for more than %s seconds and "
+                            "could not be stopped, so the worker process "
+                            "looking it up was killed" % budget)))
+                    else:
+                        continue
 
-        # Parse the <GetSearchResults> tag from our XML definition.
-        #
-        search_results = self.parser.parse(FN_GET_SEARCH_RESULTS, self.settings)
-        return search_results
+                    # A worker that is done with its title goes back to
+                    # being free. One that failed is replaced.
+                    #
+                    busy.remove(worker)
+                    if worker.job is None:
+                        idle.append(worker)
+                    else:
+                        worker.stop()
+                        idle.append(LookupWorker(init_args))
+                    yield result
+        finally:
+            for worker in idle + busy:
+                worker.stop()
+        return
 
     ##################################################################
     #
-    def old_get_details(self, entity):
+    def old_lookup(self, search_string):
         """
-        Get the show details based on the given search results.
 
         Arguments:
-        - `search_results`: minidom of our search results for a term.
+        - `function`:
         """
-        self.logger.debug("get_details: entered")
+        self.logger.debug("lookup: entering (search string: '%s')" % \
+                          search_string)
 
-        # For every <url> tag that this entity has, we fetch the details it
-        # provides.
+        url = self.create_search_url(search_string)
+        self.logger.debug("lookup: using search url: %s" % url)
+        search_results = self.get_search_results(url)
+
+        return []
+        # Search results is an XML string with basic top level info about
+        # all the entities that matched our search string.. we want to get
+        # the details for each of them. We store the results in the list
+        # 'all_details'.
         #
-        link = first_child(entity, "url")
-        i = 0
-        while link:
-            i += 1
-            src_url = ScrapeURL(link, cache = self.cache)
-            url_data = src_url.get()
+        all_details = []
+        for entity in children(parse_xml(search_results), "entity"):
+            details = self.old_get_details(entity)
+            if details is not None:
+                all_details.append(details)
 
-            # If we get back an object with an iterator then we loop over the
-            # elements in our src data, putting successive one in successive
-            # buffers.
+        for details in all_details:
+            # Now based on whether we are use a XML definition for a tv show
+            # (series) or a movie that determines our next step. If our XML
+            # parser is for tv shows we fall in to 'get_episode_list',
+            # otherwise we fall in to a 'custom' function with our details
+            # as the input.
             #
-            if hasattr(url_data, '__iter__'):
-                for j,data in enumerate(url_data):
-                    self.parser.set_buffer(i+j, data)
-                i += j
+            if self.parser.content == "movies":
+                results.append(self.custom_functions(details))
             else:
-                self.parser.set_buffer(i, url_data)
-                # XXX for debugging purposes again we write out the details
-                #     we get in uniquely named files that correspond to the
-                #     param buffer we use for the url data.
+                # Otherwise we need to get the episode lists and episode
+                # details.
                 #
-                with open("details.%d.html" % i, "w") as f:
-                    f.write(url_data)
+                ep_lists = self.get_episode_list(details)
 
+                # Now we go through the episode list results and get the
+                # episode details..
+                #
+                results = []
+                for i, ep_list in enumerate(ep_lists):
+                    ep_details = self.get_episode_details(ep_list, i)
+                    results.append(self.custom_functions(ep_details))
 
-            link = next_sibling(link, "url")
+        self.logger.debug("lookup: results: %r", results)
+        self.logger.debug("lookup: leaving (search: '%s')" % search_string)
+        return results
 
-        # Now we get the url based id used to identify this entity, if we
-        # have one. This is passed in to the parser as the next free
-        # parameter buffer.
-        #
-        # XXX NOTE: the xml scraper seems to always expect the id in
-        #           buffer 2 (and then details html in buffer 1.)
-        #
-        entity_id = first_child(entity, "id")
-        if entity_id is not None:
-            entity_id = entity_id.firstChild.data
-            self.parser.set_buffer(i+1, entity_id)
-            self.logger.debug("get_details: buffer: %d entity id: %s" % \
-                              (i+1,entity_id))
+##################################################################
+##################################################################
+#
+class Registry(object):
+    """
+    The scraper definitions in a directory laid out like the one we ship,
+    'scraper/scrapers', with a sub-directory of definitions for each
+    kind of media ('video', 'music'.)
 
-        details = self.parser.parse(FN_GET_DETAILS, self.settings)
+    What we know about each definition without running it: its name,
+    content type, thumb, the functions it has, its settings and the hash
+    of its file, is kept in a manifest, 'manifest.json', in that
+    directory. Listing the definitions reads only the manifest. A
+    definition is only read when it is asked for.
 
-        # XXX I think we only need this file for debugging. Eventually
-        #     we will just remove this output statement.
-        #
-        with open("details.%s.xml" % entity_id, "w") as f:
-            f.write(details)
+    Definitions are named after their file, lower cased and without the
+    '.xml', ie: 'imdb', 'imdb tv', 'tvdb-new'. (The name attributes of
+    the definitions are not unique.)
 
-        self.logger.debug("get_details: leaving")
-        return details
+    Some of the definitions we ship are for content that our Scraper
+    does not support, ie: the music ones are for 'albums'. They are in
+    the manifest, marked as not supported.
+
+    The manifest we ship is rebuilt, after the definitions change, with:
+
+        python -c 'import scraper; scraper.registry.write_manifest()'
+
+    Definitions added since the manifest was written are read when we
+    load it, and entries whose definition has changed are refreshed
+    when it is read.
+    """
+
+    MANIFEST = "manifest.json"
 
     ##################################################################
     #
-    def old_get_episode_list(self, details):
+    def __init__(self, directory = None, logger = logging.getLogger()):
         """
-
         Arguments:
-        - `details`:
+        - `directory`: The directory of definitions. By default the one
+                       we ship.
         """
-        self.logger.debug("get_episode_list: entering")
+        if directory is None:
+            directory = os.path.join(os.path.dirname(__file__), "scrapers")
+        self.directory = directory
+        self.logger = logging.getLogger(logger.name + ".Registry")
+        self.manifest = None
+        self.definitions = { }
+        self.lock = threading.Lock()
 
-        details = parseString(details).firstChild
-        dom = parseString(details)
-        details = first_child(dom, "details")
+    ##################################################################
+    #
+    def files(self):
+        """
+        Return a dict of the name of each definition in our directory to
+        its file, relative to our directory.
+        """
+        files = { }
+        for kind in sorted(os.listdir(self.directory)):
+            if not os.path.isdir(os.path.join(self.directory, kind)):
+                continue
+            for file_name in sorted(os.listdir(os.path.join(self.directory,
+                                                            kind))):
+                name, ext = os.path.splitext(file_name)
+                if ext.lower() == ".xml":
+                    files[name.lower()] = "%s/%s" % (kind, file_name)
+        return files
 
-        if details.firstChild.tagName != "episodeguide":
-            # We do not have episode guide information for this
-            # XXX Did we lookup movie info for a tv series? Probably
-            #     means that this current search path should be skipped.
-            #
-            return []
+    ##################################################################
+    #
+    def describe(self, name, file_name, xml):
+        """
+        Return the manifest entry for a definition.
 
-        link = first_child(first_child(details, "episodeguide"), "url")
-        episode_lists = []
-        i = 0
-        while link:
-            i += 1
-            src_url = ScrapeURL(url, cache = self.cache)
-            self.logger.debug("get_episode_list: %d: %s" % (i, src_url.url))
-            url_data = src_url.get()
+        Arguments:
+        - `name`: Its name.
+        - `file_name`: Its file, relative to our directory.
+        - `xml`: The definition.
+        """
+        entry = { "name"      : name,
+                  "file"      : file_name,
+                  "title"     : "",
+                  "content"   : "",
+                  "thumb"     : None,
+                  "functions" : [],
+                  "settings"  : [],
+                  "supported" : False,
+                  "sha1"      : hashlib.sha1(xml).hexdigest() }
+
+        # A definition that is not even well formed is listed, as not
+        # supported, rather than keeping us from listing the others.
+        #
+        try:
+            doc = parse_xml(xml)
+        except ElementTree.ParseError, e:
+            self.logger.info("%s is not supported: %s", file_name, e)
+            return entry
+        entry.update(title = doc.get("name", ""),
+                     content = doc.get("content", "").lower(),
+                     thumb = doc.get("thumb") or None,
+                     functions = [child.tag for child in doc])
+
+        # Settings are made by running the definition's <GetSettings>, as
+        # a Scraper does, which we can only do for the content we support.
+        # A definition that we can not load at all is not supported.
+        #
+        try:
+            parser = ScraperParser(xml, self.logger)
+        except ScraperException, e:
+            self.logger.info("%s is not supported: %s", file_name, e)
+            return entry
+        entry["supported"] = True
+        try:
+            settings_xml = parser.parse(FN_GET_SETTINGS)
+        except BadXML:
+            settings_xml = None
+        settings = Settings(settings_xml)
+        entry["settings"] = [{ "id"      : setting_id,
+                               "label"   : settings.labels[setting_id],
+                               "type"    : settings.types[setting_id],
+                               "default" : settings.defaults[setting_id] }
+                             for setting_id in settings.ids]
+        return entry
 
-            # XXX file exists for debugging
-            #
-            with open("episodelist.%d.html" % i, "w") as f:
-                f.write(url_data)
+    ##################################################################
+    #
+    def read(self, file_name):
+        """
+        Return the contents of a definition file.
 
-            episode_lists.append(url_data)
+        Arguments:
+        - `file_name`: Its file, relative to our directory.
+        """
+        with open(os.path.join(self.directory, file_name), "rb") as f:
+            return f.read()
 
-        # We have now retrieved all of the episode lists for this series
-        # One by one, pass them through our parser.
-        #
-        episode_list_results = []
-        for i, episode_list in enumerate(episode_lists):
-            self.parser.set_buffer(1, episode_list)
-            episode_list_result = self.parser.parse(FN_GET_EPISODE_LIST,
-                                                    self.settings)
+    ##################################################################
+    #
+    def load(self):
+        """
+        Return our manifest, a dict of the name of each definition to its
+        entry, reading it if we have not already. Definitions that are
+        not in it are read and added. Definitions that are gone are
+        dropped.
+        """
+        with self.lock:
+            if self.manifest is not None:
+                return self.manifest
 
-            # XXX write retrieved parsed xml data for debugging
-            #
-            with open("episodelist.%d.xml" % i + 1) as f:
-                f.write(episode_list_result)
+            manifest = { }
+            try:
+                with open(os.path.join(self.directory, self.MANIFEST)) as f:
+                    for entry in json.load(f):
+                        manifest[entry["name"]] = entry
+            except (IOError, ValueError), e:
+                self.logger.info("Can not read the manifest of %s: %s",
+                                 self.directory, e)
+
+            files = self.files()
+            for name in set(manifest) - set(files):
+                del manifest[name]
+            for name, file_name in files.iteritems():
+                # Entries written before we noted which definitions are
+                # supported are read again too.
+                #
+                entry = manifest.get(name)
+                if entry is None or entry["file"] != file_name or \
+                        "supported" not in entry:
+                    self.logger.info("%s is not in the manifest of %s",
+                                     file_name, self.directory)
+                    manifest[name] = self.describe(name, file_name,
+                                                   self.read(file_name))
+            self.manifest = manifest
+            return manifest
 
-            episode_list_results.append(episode_list_result)
+    ##################################################################
+    #
+    def entries(self, content = None, supported = None):
+        """
+        Return the manifest entries of our definitions, sorted by name.
+        Each is a dict with:
+
+        - 'name': the name we know it by
+        - 'file': its file, relative to our directory
+        - 'title': the definition's own name for itself, ie: 'IMDb TV'
+        - 'content': what it is for, ie: 'movies', 'tvshows', 'albums'
+        - 'thumb': the file name of its thumbnail, or None
+        - 'functions': the names of its function tags
+        - 'settings': a dict of the 'id', 'label', 'type' and 'default'
+                      of each of its settings
+        - 'supported': whether our Scraper can load it. If not, it has
+                       no settings.
+        - 'sha1': the sha1 hex digest of its file
 
-        self.logger.debug("get_episode_list: leaving")
-        return episode_list_results
+        Arguments:
+        - `content`: If given, only the definitions for this content.
+        - `supported`: If True only the definitions our Scraper can load,
+                       if False only those it can not.
+        """
+        manifest = self.load()
+        return [manifest[name] for name in sorted(manifest)
+                if (content is None or manifest[name]["content"] == content)
+                and (supported is None or
+                     manifest[name]["supported"] == supported)]
 
     ##################################################################
     #
-    def old_get_episode_details(self, episode_list_result, i):
+    def entry(self, name):
         """
+        Return the manifest entry of the given definition. Raises a
+        KeyError if we have no such definition.
 
         Arguments:
-        - `episode_list_result`: xml string with the episode list results
-        - `i`: I think this is the 'season' but I am not positive.
+        - `name`: The name of the definition.
         """
-        self.logger.debug("get_episode_details: entered (%d)" % i)
-        episode_guide = first_child(parseString(episode_list_result),
-                                    "episodeguide")
+        return self.load()[name.lower()]
 
-        # XXX Hm.. is there a link for each episode?
-        #
-        link = first_child(first_child(episode_guide, "episode"), "url")
-        src_url = ScrapURL(link)
-        url_data = src_url.get()
+    ##################################################################
+    #
+    def definition(self, name):
+        """
+        Return the XML of the given definition, reading it the first time
+        it is asked for. Raises a KeyError if we have no such definition.
 
-        with open("episodedetails.%d.html" % i, "w") as f:
-            f.write(url_data)
+        Arguments:
+        - `name`: The name of the definition.
+        """
+        name = name.lower()
+        entry = self.entry(name)
+        with self.lock:
+            xml = self.definitions.get(name)
+        if xml is not None:
+            return xml
+
+        xml = self.read(entry["file"])
+        if hashlib.sha1(xml).hexdigest() != entry["sha1"]:
+            self.logger.info("%s has changed since the manifest of %s was "
+                             "written", entry["file"], self.directory)
+            entry = self.describe(name, entry["file"], xml)
+        with self.lock:
+            self.manifest[name] = entry
+            self.definitions[name] = xml
+        return xml
 
-        self.parser.set_buffer(1, url_data)
+    ##################################################################
+    #
+    def write_manifest(self):
+        """
+        Read every one of our definitions and write our manifest.
+        """
+        manifest = [self.describe(name, file_name, self.read(file_name))
+                    for name, file_name in sorted(self.files().iteritems())]
+        with open(os.path.join(self.directory, self.MANIFEST), "w") as f:
+            json.dump(manifest, f, indent = 1, sort_keys = True,
+                      separators = (",", ": "))
+            f.write("\n")
+        with self.lock:
+            self.manifest = dict((entry["name"], entry) for entry in manifest)
+        return
 
-        episode_details = self.parser.parse(FN_GET_EPISODE_DETAILS,
-                                            self.settings)
+# The definitions we ship. See Scraper.by_name()
+#
+registry = Registry()
+
+##################################################################
+#
+# The scraper each of the worker processes of Scraper.lookup_many()
+# loads when it starts.
+#
+worker_scraper = None
+
+##################################################################
+#
+def lookup_many_init(scraper_xml, settings, cache_file, cache_ttl,
+                     definition_cache_dir = None):
+    """
+    Run when each of the worker processes of Scraper.lookup_many() is
+    started. Load the scraper definition the worker uses for all of its
+    lookups.
+
+    Arguments:
+    - `scraper_xml`: The XML scraper definition.
+    - `settings`: A dict of the values of the scraper's settings.
+    - `cache_file`: The file of the DiskCache to use, if any.
+    - `cache_ttl`: How many seconds cached responses are good for.
+    - `definition_cache_dir`: The directory of the DefinitionCache to
+                              load the definition from, if any.
+    """
+    global worker_scraper
+    response_cache = None
+    if cache_file is not None:
+        response_cache = DiskCache(cache_file)
+    definition_cache = None
+    if definition_cache_dir is not None:
+        definition_cache = DefinitionCache(definition_cache_dir)
+    worker_scraper = Scraper(scraper_xml, response_cache = response_cache,
+                             cache_ttl = cache_ttl,
+                             definition_cache = definition_cache)
+    worker_scraper.settings.values.update(settings)
+    return
+
+##################################################################
+#
+def lookup_many_main(init_args, clock, conn):
+    """
+    The main loop of the process of a LookupWorker: load the scraper
+    definition, then look up each title we are sent and send back its
+    result, until we are sent None.
+
+    Arguments:
+    - `init_args`: The arguments of lookup_many_init()
+    - `clock`: The shared value our parser keeps the time it started
+               running a function in (see ScraperParser.clock)
+    - `conn`: Our end of the pipe to Scraper.lookup_many()
+    """
+    lookup_many_init(*init_args)
+    worker_scraper.parser.clock = clock
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        conn.send(lookup_many_worker(job))
+    return
+
+##################################################################
+#
+def lookup_many_worker(job):
+    """
+    Look up one title for Scraper.lookup_many(). Returns the dict that
+    lookup_many() yields for it.
 
-        with open("episodedetails.%d.xml" % i, "w") as f:
-            f.write(episode_details)
+    Arguments:
+    - `job`: A tuple of the index of the title, the title, and the
+             'fields' and 'episodes' arguments of Scraper.lookup_one()
+    """
+    index, title, fields, episodes = job
+    result = worker_scraper.lookup_one(title, fields, episodes)
+    result["index"] = index
+    return result
 
-        return episode_details
+##################################################################
+##################################################################
+#
+class LookupWorker(object):
+    """
+    One of the worker processes of Scraper.lookup_many(). It loads the
+    scraper definition once and then looks up the titles it is sent over
+    its pipe, one at a time (see lookup_many_main())
+
+    While its parser is running a function it keeps the time it started
+    doing so in our 'clock' so that we can tell when it is stuck.
+    """
 
+    # How many seconds we wait for a worker we asked to stop to do so
+    # before we kill it.
+    #
+    WAIT = 1.0
 
     ##################################################################
     #
-    def get_episode_details(self, episode):
+    def __init__(self, init_args):
         """
-        Augment the episode object with the finer details for it.
-
-        It returns the episode object that we update.
-
         Arguments:
-        - `episode`: Episode object to get more details for.
+        - `init_args`: The arguments of lookup_many_init()
         """
-
-        url_data = episode.url.get()
-
-        # XXX Maybe we should just not return a list because we only use
-        #     the first element.
-        #
-        if hasattr(url_data, '__iter__'):
-            url_data = url_data[0]
-
-        self.parser.set_buffer(1, url_data)
-        self.parser.set_buffer(2, episode.id)
-        episode_details = self.parser.parse(FN_GET_EPISODE_DETAILS,
-                                            self.settings)
-
-        self.logger.debug("Episode details: %s" % episode_details)
-        episode.set_details(episode_details)
-        return episode
+        self.clock = multiprocessing.RawValue("d", 0.0)
+        self.conn, worker_conn = multiprocessing.Pipe()
+        self.job = None
+        self.process = multiprocessing.Process(target = lookup_many_main,
+                                               args = (init_args,
+                                                       self.clock,
+                                                       worker_conn))
+        self.process.daemon = True
+        self.process.start()
+        worker_conn.close()
 
     ##################################################################
     #
-    def get_episode_list(self, show):
+    def send(self, job):
         """
-        we return a list of Episode objects with their basic information
-        filled in.
+        Give the worker a title to look up.
 
         Arguments:
-        - `show`: The Series object to get the episode list for.
+        - `job`: The job lookup_many_worker() is called with.
         """
+        self.job = job
+        self.conn.send(job)
+        return
 
-        # If the show has no episode guide url's, then there is nothing
-        # we can fetch..
-        #
-        if len(show.episode_guide_urls) == 0:
-            return []
-
-        episode_list = []
-
-        for url in show.episode_guide_urls:
-            self.logger.debug("get_episode_list, data from: %s" % url.url)
-            url_data = url.get()
-
-            # Now we run the GetEpisodeList rules on this data that
-            # we just retrieved.
-            #
-            self.parser.set_buffer(1, url_data)
-            self.parser.set_buffer(2, url.url)
-
-            # This gets us a XML string with the list of episodes in it.
-            # parse this in to a dom and then go through each <episode>
-            # element creating an Episode object to append to our episode
-            # list
-            ep_list_result = self.parser.parse(FN_GET_EPISODE_LIST,
-                                               self.settings)
-            dom  =parseString(ep_list_result)
-            eps = dom.firstChild
-            ep = first_child(eps, "episode")
-            while ep:
-                episode_list.append(Episode(ep, show, self))
-                ep = next_sibling(ep, "episode")
-            dom.unlink()
-        return episode_list
+    ##################################################################
+    #
+    def receive(self):
+        """
+        Return the result of the title the worker was looking up, which
+        it has sent us. The worker is then free.
+        """
+        result = self.conn.recv()
+        self.job = None
+        return result
 
     ##################################################################
     #
-    def lookup(self, search_string):
+    def failed(self, error):
         """
-        Based on the search string it will find a bunch of shows/movies that
-        match and return a list of search results.
+        Return the result for the title the worker was looking up when it
+        could not finish it.
 
         Arguments:
-        - `search_string`:
+        - `error`: What went wrong.
         """
-        url = self.create_search_url(search_string)
-        self.logger.debug("lookup: using search url: %s" % url)
-        search_results = self.get_search_results(url)
-        results = []
-        # Search results is an XML string with basic top level info about
-        # all the entities that matched our search string..
-        #
-        dom = parseString(search_results).firstChild
-        entity = first_child(dom, "entity")
-        while entity:
-            if self.parser.content == "movies":
-                results.append(Movie(entity, self))
-            else:
-                results.append(Series(entity, self))
-            entity = next_sibling(entity, "entity")
-        return results
+        index, title, fields, episodes = self.job
+        return { "query" : title, "index" : index, "error" : error }
 
     ##################################################################
     #
-    def old_lookup(self, search_string):
+    def stuck(self, budget, now):
         """
+        Return True if the worker has been running one function for more
+        than `budget` seconds.
 
         Arguments:
-        - `function`:
+        - `budget`: The most seconds a function may run for.
+        - `now`: The time it is.
         """
-        self.logger.debug("lookup: entering (search string: '%s')" % \
-                          search_string)
+        started = self.clock.value
+        return started > 0 and now - started > budget
 
-        url = self.create_search_url(search_string)
-        self.logger.debug("lookup: using search url: %s" % url)
-        search_results = self.get_search_results(url)
+    ##################################################################
+    #
+    def stop(self):
+        """
+        Stop the worker's process: asking it to, if it is free, otherwise
+        killing it.
+        """
+        if self.job is None and self.process.is_alive():
+            try:
+                self.conn.send(None)
+                self.process.join(self.WAIT)
+            except IOError:
+                pass
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+        return
 
-        return []
-        # Search results is an XML string with basic top level info about
-        # all the entities that matched our search string.. we want to get
-        # the details for each of them. We store the results in the list
-        # 'all_details'.
-        #
-        all_details = []
-        dom = parseString(search_results).firstChild
-        entity = first_child(dom, "entity")
-        while entity:
-            details = self.old_get_details(entity)
-            if details is not None:
-                all_details.append(details)
-            entity = next_sibling(entity, "entity")
+##################################################################
+##################################################################
+#
+class LazyField(object):
+    """
+    A descriptor for a field of a Movie that is filled in by custom
+    functions. The custom functions are not run when the movie's details
+    are gotten. Instead the first time the field is read the movie runs
+    the custom functions that fill it in (see Movie.resolve())
 
-        for details in all_details:
-            # Now based on whether we are use a XML definition for a tv show
-            # (series) or a movie that determines our next step. If our XML
-            # parser is for tv shows we fall in to 'get_episode_list',
-            # otherwise we fall in to a 'custom' function with our details
-            # as the input.
-            #
-            if self.parser.content == "movies":
-                results.append(self.custom_functions(details))
-            else:
-                # Otherwise we need to get the episode lists and episode
-                # details.
-                #
-                ep_lists = self.get_episode_list(details)
+    Until the movie's details have been gotten the field does not exist.
+    """
 
-                # Now we go through the episode list results and get the
-                # episode details..
-                #
-                results = []
-                for i, ep_list in enumerate(ep_lists):
-                    ep_details = self.get_episode_details(ep_list, i)
-                    results.append(self.custom_functions(ep_details))
+    ##################################################################
+    #
+    def __init__(self, name):
+        """
+        Arguments:
+        - `name`: The name of the field.
+        """
+        self.name = name
 
-        self.logger.debug("lookup: results: %s" % repr(results))
-        self.logger.debug("lookup: leaving (search: '%s')" % search_string)
-        return results
+    ##################################################################
+    #
+    def __get__(self, obj, objtype = None):
+        if obj is None:
+            return self
+        if self.name not in obj.__dict__:
+            raise AttributeError(self.name)
+        obj.resolve([self.name])
+        return obj.__dict__[self.name]
+
+    ##################################################################
+    #
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
 
 ##################################################################
 ##################################################################
@@ -1799,13 +5451,18 @@ class Show(object):
     rest of the show's details.
     """
 
+    # The fields of as_dict() that we know from the lookup alone, without
+    # getting our details.
+    #
+    LOOKUP_FIELDS = ("title", "id", "urls")
+
     ##################################################################
     #
     def __init__(self, lookup_result, scraper):
         """
         This is basically an abstract base class of both Movie and Series.
         Arguments:
-        - `lookup_result`: The Dom node that has the lookup info for a
+        - `lookup_result`: The element that has the lookup info for a
                            specific show.
         - `scraper`: The scraper used to get these details
         """
@@ -1813,14 +5470,19 @@ class Show(object):
         self.title = ""
         self.id = None
         self.links = []
+        self.xml_details = None
+
+        # How well we matched what was looked up, if the search results
+        # were ranked (see Scraper.rank())
+        #
+        self.score = None
 
         self.title = get_child_data(lookup_result, "title", "")
         self.id = get_child_data(lookup_result, "id", None)
 
-        link = first_child(lookup_result, "url")
-        while link:
-            self.links.append(ScrapeURL(link, cache = scraper.cache))
-            link = next_sibling(link, "url")
+        for link in children(lookup_result, "url"):
+            self.links.append(ScrapeURL(link, cache = scraper.cache,
+                                        fetcher = scraper.fetcher))
         return
 
     ##################################################################
@@ -1836,31 +5498,67 @@ class Show(object):
 
     ##################################################################
     #
-    def get_details(self):
+    def get_details(self, fields = None):
         """
         Stub function for the sub-classes to implement.
         It does the basic invoking of the parser on the data we have
         so far. Subclasses will need to extend this method to get the
         rest of the salient details.
+
+        Arguments:
+        - `fields`: The fields the caller is going to want. Subclasses
+                    whose fields are filled in lazily get these ones
+                    now.
         """
         # For every URL in our list of links that we got from the parser's
         # 'lookup()' method we get the data from that URL, set it in our
         # parser's buffer, and then let the parser do the rest of the work.
         #
-        for i,link in enumerate(self.links):
-            # NOTE: Buffers are 1-based, not 0-based.
-            #
-            link_data = link.get()
-            self.scraper.parser.set_buffer(i+1, link_data)
+        # The URL's are all fetched at once, and come back in the same
+        # order as our links.
+        #
+        buffers = self.scraper.fetcher.fetch_all(self.links)
 
         # And in the final buffer we set the id. The scraper we have
         # loaded knows how many bits of url data it expects and in which
         # buffer the id will be in.
         #
-        i += 1
-        self.scraper.parser.set_buffer(i+1, self.id)
-        self.xml_details = self.scraper.parser.parse(FN_GET_DETAILS,
-                                                     self.scraper.settings)
+        buffers.append(self.id)
+        self.xml_details = self.scraper.parse(FN_GET_DETAILS, buffers)
+        return self
+
+    ##################################################################
+    #
+    def as_dict(self, fields = None):
+        """
+        Return what we know about this show as a dict of plain python
+        values, ie: for serializing as JSON. Subclasses add their details
+        once they have been gotten.
+
+        Arguments:
+        - `fields`: If given, the list of the fields we want. Only those
+                    are put in the dict (and only those are resolved.)
+        """
+        result = { "title" : self.title,
+                   "id" : self.id,
+                   "urls" : [link.url for link in self.links] }
+        if fields is not None:
+            result = dict((f, result[f]) for f in fields if f in result)
+        return result
+
+    ##################################################################
+    #
+    def aget_details(self, callback = None):
+        """
+        Like get_details() except it does not wait. It returns an
+        AsyncResult (see Scraper.run_async()) whose value is this show
+        once its details have been gotten.
+
+        Arguments:
+        - `callback`: If given, called with this show once its details
+                      have been gotten.
+        """
+        return self.scraper.run_async(self.get_details, callback = callback)
     
 ##################################################################
 ##################################################################
@@ -1869,15 +5567,52 @@ class Movie(Show):
     """
     A Movie object. As differentiated from a 'Series' object by the scraper we
     are using which tells us if it works on movies or tv shows (aka series.)
+
+    The fields filled in by custom functions are resolved lazily: each
+    one's custom functions are only run when it is first read (see
+    LazyField and resolve())
     """
 
+    # The lazy fields the handler (fn_<foo>) of each custom function
+    # fills in. Which of a definition's custom functions lead to each
+    # handler is up to the definition (see field_functions())
+    #
+    HANDLER_FIELDS = {
+        "GetMoviePlot"      : ("plot",),
+        "GetMovieDirectors" : ("directors",),
+        "GetMovieWriters"   : ("writers",),
+        "GetTMDBFanart"     : ("fanart",),
+        "GetIMDBPoster"     : ("posters",),
+        "GetTrailer"        : ("trailers",),
+        }
+
+    plot = LazyField("plot")
+    directors = LazyField("directors")
+    writers = LazyField("writers")
+    fanart = LazyField("fanart")
+    posters = LazyField("posters")
+    trailers = LazyField("trailers")
+
+    # The fields as_dict() adds once our details have been gotten.
+    #
+    DETAIL_FIELDS = ("year", "certifications", "runtime", "rating", "votes",
+                     "genres", "directors", "writers", "studio", "outline",
+                     "plot", "fanart", "posters", "trailers")
+
     ##################################################################
     #
-    def get_details(self):
+    def get_details(self, fields = None):
         """
         Before 'get_details' is invoked this Movie object is mostly an empty
         shell. All it has is the title, maybe an id, and one or more URL's that
         will let us resolve the rest of the object.
+
+        The custom functions that fill in our lazy fields are not run
+        here unless they are for one of the given `fields`. Those are all
+        fetched at once.
+
+        Arguments:
+        - `fields`: The fields the caller is going to want.
         """
         # The basic details are put sussed out by our super class
         # method and put in 'self.xml_details'
@@ -1916,26 +5651,23 @@ class Movie(Show):
         # And here we parse the information that was in the XML response the
         # parser gave us.
         #
-        dom = parseString(self.xml_details)
-        ep = dom.firstChild
+        ep = parse_xml(self.xml_details)
 
         self.id = get_child_data(ep, "id", self.id)
         self.title = get_child_data(ep, "title", self.title)
         self.year = try_int(get_child_data(ep, "year"))
 
-        certification = first_child(ep, "certification")
-        while certification:
-            self.certifications.append(certification.firstChild.data)
-            certification = next_sibling(certification, "certification")
+        for certification in children(ep, "certification"):
+            if certification.text:
+                self.certifications.append(element_text(certification))
 
         self.runtime = get_child_data(ep, "runtime")
         self.rating = try_float(get_child_data(ep, "rating"))
         self.votes = try_int(get_child_data(ep, "votes"))
 
-        genre = first_child(ep, "genre")
-        while genre:
-            self.genres.append(genre.firstChild.data)
-            genre = next_sibling(genre, "genre")
+        for genre in children(ep, "genre"):
+            if genre.text:
+                self.genres.append(element_text(genre))
 
         self.studio = get_child_data(ep, "studio", "")
         self.outline = get_child_data(ep, "outline", "")
@@ -1946,28 +5678,92 @@ class Movie(Show):
         # URL's. These are recursive, and may also invoke back functions
         # on this movie object to fill in even more specific nested information.
         #
-        url = first_child(ep, "url")
-        while url:
+        for url in children(ep, "url"):
             self.urls.append(ScrapeURL(url, cache = self.scraper.cache,
-                                       base_url = self.base_url))
-            url = next_sibling(url, "url")
+                                       base_url = self.base_url,
+                                       fetcher = self.scraper.fetcher))
 
-        # At this point we are finished parsing with this dom. minidom says we
-        # should still unlink it to be sure for it to be able to be GC'd. Ug.
+        # None of our custom functions have been run yet. They are run
+        # when the fields they fill in are read, or now if they are for
+        # the fields our caller wants.
         #
-        ep = None
-        dom.unlink()
-        dom = None
+        self.pending_urls = list(self.urls)
+        if fields is not None:
+            self.resolve(fields)
+        return self
+
+    ##################################################################
+    #
+    def resolve(self, fields = None):
+        """
+        Run the custom functions, that have not already been run, that
+        fill in the given fields. If no fields are given run all of
+        them. The URL's of the custom functions are all fetched at once.
 
-        # XXX I am not sure there is any reason to store these URL's.
-        #     in the above loop perhaps we should just directly invoke
-        #     the parser on every URL as we come across it.
+        Arguments:
+        - `fields`: The list of fields to resolve.
+        """
+        pending = getattr(self, "pending_urls", None)
+        if not pending:
+            return
+
+        # We take the url's off of our pending list before we run them so
+        # that the fields they read (and write) do not try to resolve
+        # them again.
         #
-        for url in self.urls:
-            self.scraper.custom_function(url, self)
-                
+        if fields is None:
+            urls = pending
+            self.pending_urls = []
+        else:
+            field_functions = self.field_functions()
+            functions = set()
+            for field in fields:
+                functions.update(field_functions.get(field, ()))
+            urls = [url for url in pending \
+                        if url.function and url.function.lower() in functions]
+            if len(urls) == 0:
+                return
+            self.pending_urls = [url for url in pending if url not in urls]
+        self.scraper.custom_functions(urls, self)
         return
 
+    ##################################################################
+    #
+    def field_functions(self):
+        """
+        Return a dict of each of our lazy fields to the set of the custom
+        functions of our definition, by their names in lower case, that
+        fill it in: the function whose handler fills it in (see
+        HANDLER_FIELDS) and every function whose results call that one,
+        directly or through others. ie: with the IMDb definition the
+        fanart comes from GetTMDBFanart, whose url GetTMDBId finds.
+        """
+        calls = self.scraper.parser.custom_function_calls()
+        handlers = dict((name.lower(), fields) for name, fields in \
+                            self.HANDLER_FIELDS.iteritems())
+        # Our custom functions are the ones that something calls, which
+        # leaves out GetDetails and the like.
+        #
+        custom = set()
+        for called in calls.itervalues():
+            custom.update(called)
+
+        result = { }
+        for name in custom:
+            # Every function we can get to from this one.
+            #
+            reached = set([name])
+            pending = [name]
+            while pending:
+                for called in calls.get(pending.pop(), ()):
+                    if called not in reached:
+                        reached.add(called)
+                        pending.append(called)
+            for handler in reached:
+                for field in handlers.get(handler, ()):
+                    result.setdefault(field, set()).add(name)
+        return result
+
     ##################################################################
     #
     def fn_GetTMDBFanart(self, details):
@@ -1980,10 +5776,7 @@ class Movie(Show):
         if details is None:
             return
 
-        dom = parseString(details)
-        d = dom.firstChild
-        
-        fanart = first_child(d, "fanart")
+        fanart = first_child(parse_xml(details), "fanart")
         if fanart is None:
             return
 
@@ -1991,16 +5784,10 @@ class Movie(Show):
         # poster images and their previews. We do not store that, we just
         # construct the full urls.
         #
-        url_base = fanart.getAttribute("url")
-
-        self.fanart = []
-        
-        thumb = first_child(fanart, "thumb")
-        while thumb:
-            self.fanart.append(url_base + thumb.firstChild.data)
-            thumb = next_sibling(thumb, "thumb")
+        url_base = fanart.get("url", "")
 
-        dom.unlink()
+        self.fanart = [url_base + element_text(thumb, "")
+                       for thumb in children(fanart, "thumb")]
         return
 
     ##################################################################
@@ -2021,20 +5808,13 @@ class Movie(Show):
         if details is None:
             return
 
-        dom = parseString(details)
-        d = dom.firstChild
-
         self.trailers = []
 
-        trailer = first_child(d, "trailer")
-        while trailer:
-            url = trailer.firstChild.data
-            if trailer.getAttribute("urlencoded").lower() == "yes":
+        for trailer in children(parse_xml(details), "trailer"):
+            url = element_text(trailer, "")
+            if trailer.get("urlencoded", "").lower() == "yes":
                 url = urllib.unquote(url)
             self.trailers.append(url)
-            trailer = next_sibling(trailer, "trailer")
-
-        dom.unlink()
         return
     
     ##################################################################
@@ -2056,10 +5836,7 @@ class Movie(Show):
         if details is None:
             return
 
-        dom = parseString(details)
-        d = dom.firstChild
-        self.plot = get_child_data(d, "plot", self.plot)
-        dom.unlink()
+        self.plot = get_child_data(parse_xml(details), "plot", self.plot)
 
     ##################################################################
     #
@@ -2076,7 +5853,7 @@ class Movie(Show):
         #
         if details is None:
             return
-        print "GetMovieCast details: %s" % details
+        self.scraper.logger.debug("GetMovieCast details: %s", details)
 
     ##################################################################
     #
@@ -2093,7 +5870,7 @@ class Movie(Show):
         #
         if details is None:
             return
-        print "GetIMPALink details: %s" % details
+        self.scraper.logger.debug("GetIMPALink details: %s", details)
 
     ##################################################################
     #
@@ -2110,7 +5887,7 @@ class Movie(Show):
         #
         if details is None:
             return
-        print "GetTMDBId details: %s" % details
+        self.scraper.logger.debug("GetTMDBId details: %s", details)
 
     ##################################################################
     #
@@ -2128,13 +5905,9 @@ class Movie(Show):
         if details is None:
             return
 
-        dom = parseString(details)
-        e = dom.firstChild
-        director = first_child(e, "director")
-        while director:
-            self.directors.append(director.firstChild.data)
-            director = next_sibling(director, "director")
-        dom.unlink()
+        for director in children(parse_xml(details), "director"):
+            if director.text:
+                self.directors.append(element_text(director))
 
     ##################################################################
     #
@@ -2152,13 +5925,9 @@ class Movie(Show):
         if details is None:
             return
 
-        dom = parseString(details)
-        e = dom.firstChild
-        credit = first_child(e, "credits")
-        while credit:
-            self.writers.append(credit.firstChild.data)
-            credit = next_sibling(credit, "credits")
-        dom.unlink()
+        for credit in children(parse_xml(details), "credits"):
+            if credit.text:
+                self.writers.append(element_text(credit))
         return
 
     ##################################################################
@@ -2177,21 +5946,37 @@ class Movie(Show):
         if details is None:
             return
 
-        dom = parseString(details)
-        e = dom.firstChild
-        thumbs = first_child(e, "thumbs")
+        thumbs = first_child(parse_xml(details), "thumbs")
         if thumbs is None:
             return
-        thumb = first_child(thumbs, "thumb")
-        while thumb:
-            self.posters.append(thumb.firstChild.data)
-            thumb = next_sibling(thumb, "thumb")
-        dom.unlink()
+        for thumb in children(thumbs, "thumb"):
+            if thumb.text:
+                self.posters.append(element_text(thumb))
         return
 
+    ##################################################################
+    #
+    def as_dict(self, fields = None):
+        """
+        Return what we know about this movie as a dict of plain python
+        values.
+
+        Arguments:
+        - `fields`: If given, the list of the fields we want.
+        """
+        result = super(Movie, self).as_dict(fields)
+        if self.xml_details is None:
+            return result
+        self.resolve(fields)
+        for field in self.DETAIL_FIELDS:
+            if fields is None or field in fields:
+                result[field] = getattr(self, field)
+        return result
+
     ##################################################################
     #
     def __str__(self):
+        self.resolve()
         result = []
         result.append("Title: %s" % self.title)
         result.append("year: %s" % self.year)
@@ -2239,11 +6024,38 @@ class Series(Show):
 
     ##################################################################
     #
-    def get_details(self):
+    def __init__(self, lookup_result, scraper):
+        """
+        Arguments:
+        - `lookup_result`: The element that has the lookup info for this
+                           series.
+        - `scraper`: The scraper used to get these details
+        """
+        super(Series, self).__init__(lookup_result, scraper)
+        self.episodes = None
+
+        # For every episode guide url we have gotten episodes from, a
+        # digest of the guide and the Episodes we got from it. This lets
+        # get_episode_list() skip the guides that have not changed.
+        #
+        self.guides = { }
+        return
+
+    ##################################################################
+    #
+    def get_details(self, fields = None):
         """
         Before 'get_details' is invoked this Series object is mostly an empty
         shell. All it has is the title, maybe an id, and one or more URL's that
         will let us resolve the rest of the object.
+
+        Our episode list is not gotten here. It is gotten when it is
+        first asked for (see get_episode_list())
+
+        Arguments:
+        - `fields`: The fields the caller is going to want. Our details
+                    all come from the one GetDetails so this is only for
+                    symmetry with Movie.get_details()
         """
         # The basic details are put sussed out by our super class
         # method and put in 'self.xml_details'
@@ -2266,115 +6078,183 @@ class Series(Show):
         #
         self.base_url = self.links[0].url
 
-        dom = parseString(self.xml_details)
-        ep = dom.firstChild
+        ep = parse_xml(self.xml_details)
 
         self.title = get_child_data(ep, "title", self.title)
         self.plot = get_child_data(ep, "plot", "")
         self.premiered = get_child_data(ep, "premiered")
         self.rating = try_float(get_child_data(ep, "rating"))
 
-        genre = first_child(ep, "genre")
-        while genre:
-            if genre.firstChild and len(genre.firstChild.data) > 0:
-                self.genres.append(genre.firstChild.data)
-            genre = next_sibling(genre, "genre")
+        for genre in children(ep, "genre"):
+            if genre.text:
+                self.genres.append(element_text(genre))
 
         # Thumbs have not only url's, but they can have informative attributes
         # so we store this data all as a Dict.. it will always at least have
         # the 'url' key.
         #
         thumbs = first_child(ep, "thumbs")
-        if thumbs:
-            thumb = first_child(thumbs, "thumb")
-            while thumb:
-                td = { "url" : thumb.firstChild.data }
-                attrs = thumb.attributes
-                for i in range(0,attrs.length):
-                    attr = attrs.item(i)
-                    td[attr.name] = attr.value
+        if thumbs is not None:
+            for thumb in children(thumbs, "thumb"):
+                td = { "url" : element_text(thumb, "") }
+                td.update(thumb.attrib)
                 self.thumbs.append(td)
-                thumb = next_sibling(thumb, "thumb")
 
         fanart = first_child(ep, "fanart")
-        if fanart:
+        if fanart is not None:
             # The 'url' attribute of the <fanart> tag is the base url for the
             # poster images and their previews. We do not store that, we just
             # construct the full urls.
             #
-            url_base = fanart.getAttribute("url")
-
-            self.fanart = []
+            url_base = fanart.get("url", "")
 
-            thumb = first_child(fanart, "thumb")
-            while thumb:
-                self.fanart.append(url_base + thumb.firstChild.data)
-                thumb = next_sibling(thumb, "thumb")
+            self.fanart = [url_base + element_text(thumb, "")
+                           for thumb in children(fanart, "thumb")]
 
         episodeguide = first_child(ep, "episodeguide")
-        if episodeguide:
-            url = first_child(episodeguide, "url")
-            while url:
-                self.episode_guide_urls.append(\
-                    ScrapeURL(url,cache = self.scraper.cache,
-                              base_url = self.base_url))
-                url = next_sibling(url, "url")
+        if episodeguide is not None:
+            for url in children(episodeguide, "url"):
+                guide = ScrapeURL(url,cache = self.scraper.cache,
+                                  base_url = self.base_url,
+                                  fetcher = self.scraper.fetcher)
+
+                # An episode guide that is a zip archive, like TheTVDB's
+                # <language>.zip, has its episodes in <language>.xml. The
+                # other members (banners, actors) are no use to us here.
+                #
+                name = urlparse.urlsplit(guide.url or "")[2].split("/")[-1]
+                if name.lower().endswith(".zip"):
+                    guide.members = [name[:-4] + ".xml"]
+                self.episode_guide_urls.append(guide)
 
         # And at this point we have parsed out all of the series specific
         # data from our XML response, and also got a handle on where to get
         # the episode information.
         #
-        dom.unlink()
-        dom = None
-        return
+        return self
 
     ##################################################################
     #
-    def get_episode_list(self):
+    def get_episode_list(self, refresh = False):
         """
         Retrieve the episode list from the URL's in the episode guide.
         Unless we have already retrieved the episode list in which case
         just return that.
+
+        When we are asked to refresh the episode list we check with the
+        server whether each episode guide has changed (see
+        Fetcher.fetch()). The Episodes of a guide that has not changed are
+        used as they are. For a guide that has, any Episode whose entry in
+        it is the same as before is kept, along with whatever details we
+        have already gotten for it.
+
+        Arguments:
+        - `refresh`: If True get the episode list again even if we
+                     already have it.
         """
-        if self.episodes is not None:
+        if self.episodes is not None and not refresh:
             return self.episodes
 
-        self.episodes = []
-
         # Now before we return pre-emptively fetch the episode list.
         # XXX We _could_ put this in a 'get_episode_list' method that does the
         #     fetching then.. but for now we are just going to have it done
         #     here.
         #
         if len(self.episode_guide_urls) == 0:
+            self.guides = { }
+            self.episodes = []
             return self.episodes
 
-        for url in self.episode_guide_urls:
-            url_data = url.get()
+        # The Episodes we already have by their entry in the episode guide.
+        #
+        known = { }
+        for ign, guide_episodes in self.guides.itervalues():
+            for episode in guide_episodes:
+                known[episode.details] = episode
+
+        # Fetch all of the episode guides at once before we parse any of
+        # them.
+        #
+        episodes = []
+        guides = { }
+        contents = self.scraper.fetcher.fetch_all(self.episode_guide_urls,
+                                                  refresh)
+        for url, url_data in zip(self.episode_guide_urls, contents):
+            # The guide is unicode if we know the charset it came in.
+            #
+            guide = url_data or ""
+            if isinstance(guide, unicode):
+                guide = guide.encode("utf-8")
+            digest = hashlib.sha1(guide).hexdigest()
+            previous = self.guides.get(url.url)
+            if previous is not None and previous[0] == digest:
+                guides[url.url] = previous
+                episodes.extend(previous[1])
+                continue
 
             # Now we run the GetEpisodeList rules on this data that
             # we just retrieved.
             #
-            self.scraper.parser.set_buffer(1, url_data)
-            self.scraper.parser.set_buffer(2, url.url)
-
             # This gets us a XML string with the list of episodes in it.
-            # parse this in to a dom and then go through each <episode>
-            # element creating an Episode object to append to our episode
-            # list
-            ep_list_result = self.scraper.parser.parse(FN_GET_EPISODE_LIST,
-                                                       self.scraper.settings)
-            dom = parseString(ep_list_result)
-            eps = dom.firstChild
-            ep = first_child(eps, "episode")
-            while ep:
-                self.episodes.append(Episode(ep, self, self.scraper))
-                ep = next_sibling(ep, "episode")
-            dom.unlink()
-            dom = None
-        
-            return self.episodes
+            # We go through each <episode> element as it is parsed creating
+            # an Episode object to append to our episode list
+            #
+            ep_list_result = self.scraper.parse(FN_GET_EPISODE_LIST,
+                                                [url_data, url.url])
+            guide_episodes = []
+            for ep in iter_children(ep_list_result, "episode"):
+                episode = known.get(element_xml(ep))
+                if episode is None:
+                    episode = Episode(ep, self, self.scraper)
+                guide_episodes.append(episode)
+            guides[url.url] = (digest, guide_episodes)
+            episodes.extend(guide_episodes)
+
+        self.guides = guides
+        self.episodes = episodes
+        return self.episodes
+
+    ##################################################################
+    #
+    def aget_episode_list(self, callback = None, refresh = False):
+        """
+        Like get_episode_list() except it does not wait. It returns an
+        AsyncResult (see Scraper.run_async()) whose value is the list of
+        episodes.
+
+        Arguments:
+        - `callback`: If given, called with the list of episodes once we
+                      have it.
+        - `refresh`: Passed on to get_episode_list()
+        """
+        return self.scraper.run_async(self.get_episode_list, (refresh,),
+                                      callback = callback)
     
+    ##################################################################
+    #
+    def as_dict(self, fields = None):
+        """
+        Return what we know about this series, and its episodes if we
+        have gotten them, as a dict of plain python values.
+
+        Arguments:
+        - `fields`: If given, the list of the fields we want.
+        """
+        result = super(Series, self).as_dict(fields)
+        if self.xml_details is None:
+            return result
+        for field in ("premiered", "rating", "plot", "genres", "thumbs",
+                      "fanart"):
+            if fields is None or field in fields:
+                result[field] = getattr(self, field)
+        if fields is None or "episode_guide_urls" in fields:
+            result["episode_guide_urls"] = [url.url for url in \
+                                                self.episode_guide_urls]
+        if self.episodes is not None and \
+                (fields is None or "episodes" in fields):
+            result["episodes"] = [ep.as_dict() for ep in self.episodes]
+        return result
+
     ##################################################################
     #
     def __unicode__(self):
@@ -2423,27 +6303,51 @@ class Episode(object):
     def __init__(self, episode, series, scraper):
         """
         Arguments:
-        - `details`: XML string with the details of this episode
+        - `episode`: The <episode> element for this episode from the
+                     episode list.
         - `series`: The series that this episode belongs to.
         - `scraper`: The scraper we are using to look this all up with.
         """
-        self.details = episode.toxml("utf-8")
+        self.details = element_xml(episode)
         self.series = series
         self.scraper = scraper
         self.url = None
         self.episode_number = None
         self.season_number = None
         self.id = None
+        self.extended_details = None
 
         self.title = get_child_data(episode, "title", "")
         self.url = try_url(get_child_data(episode, "url"),
                                           cache = self.scraper.cache,
-                                          base_url = self.series.base_url)
+                                          base_url = self.series.base_url,
+                                          fetcher = self.scraper.fetcher)
         self.episode_number = try_int(get_child_data(episode, "epnum"))
         self.season_number = try_int(get_child_data(episode, "season"))
         self.id = get_child_data(episode, "id")
         return
 
+    ##################################################################
+    #
+    def as_dict(self):
+        """
+        Return what we know about this episode as a dict of plain python
+        values.
+        """
+        result = { "title" : self.title,
+                   "id" : self.id,
+                   "season" : self.season_number,
+                   "episode" : self.episode_number,
+                   "url" : None }
+        if self.url is not None:
+            result["url"] = self.url.url
+        if self.extended_details is None:
+            return result
+        for field in ("plot", "aired", "thumbnail", "director", "rating",
+                      "credits", "actors"):
+            result[field] = getattr(self, field)
+        return result
+
     ##################################################################
     #
     def __unicode__(self):
@@ -2459,7 +6363,7 @@ class Episode(object):
 
     ##################################################################
     #
-    def get_details(self):
+    def get_details(self, refresh = False):
         """
         Augment our existing information with these details.
 
@@ -2469,23 +6373,29 @@ class Episode(object):
               and this is supposed to be the more details information
               so we use it.
 
+        Once we have our details we keep them, even for an Episode that
+        Series.get_episode_list() kept when it refreshed the episode
+        list, unless we are asked to refresh them.
+
         Arguments:
-        - `details`: The XML string we parse for the details.
+        - `refresh`: If True get our details again even if we already
+                     have them, checking with the server whether the
+                     page they come from has changed (see
+                     Fetcher.fetch())
         """
-        url_data = self.url.get()
+        if self.extended_details is not None and not refresh:
+            return self
+        url_data = self.url.get(refresh)
 
-        self.scraper.parser.set_buffer(1, url_data)
-        self.scraper.parser.set_buffer(2, self.id)
-        ep_details = self.scraper.parser.parse(FN_GET_EPISODE_DETAILS,
-                                               self.scraper.settings)
+        ep_details = self.scraper.parse(FN_GET_EPISODE_DETAILS,
+                                        [url_data, self.id])
         
         self.extended_details = ep_details
         self.actors = []
         self.credits = []
 
-        self.scraper.logger.debug("set_details: %s" % repr(ep_details))
-        dom = parseString(ep_details)
-        episode = dom.firstChild
+        self.scraper.logger.debug("set_details: %r", ep_details)
+        episode = parse_xml(ep_details)
 
         self.title = get_child_data(episode, "title", self.title)
         self.plot = get_child_data(episode, "plot", "")
@@ -2496,19 +6406,28 @@ class Episode(object):
         self.episode_number = try_int(get_child_data(episode, "episode"))
         self.season_number = try_int(get_child_data(episode, "season"))
 
-        credit = first_child(episode, "credits")
-        while credit:
-            if credit.firstChild and len(credit.firstChild.data) > 0:
-                self.credits.append(credit.firstChild.data)
-            credit = next_sibling(credit, "credits")
+        for credit in children(episode, "credits"):
+            if credit.text:
+                self.credits.append(element_text(credit))
 
-        actor = first_child(episode, "actor")
-        while actor:
+        for actor in children(episode, "actor"):
             actor_name = get_child_data(actor, "name")
             if actor_name is not None:
                 self.actors.append(actor_name)
-            actor = next_sibling(actor, "actor")
+        return self
 
-        dom.unlink()
-        dom = None
-        return
+    ##################################################################
+    #
+    def aget_details(self, callback = None, refresh = False):
+        """
+        Like get_details() except it does not wait. It returns an
+        AsyncResult (see Scraper.run_async()) whose value is this episode
+        once its details have been gotten.
+
+        Arguments:
+        - `callback`: If given, called with this episode once its details
+                      have been gotten.
+        - `refresh`: Passed on to get_details()
+        """
+        return self.scraper.run_async(self.get_details, (refresh,),
+                                      callback = callback)
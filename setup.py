@@ -5,17 +5,20 @@ from distutils.core import setup
 # will change every now and then I will programatically determine what are
 # current set of scrapers are.
 #
-scraperdir = os.path.join(os.path.dirname(__file__), 'scraper','scrapers')
+packagedir = os.path.join(os.path.dirname(__file__), 'scraper')
+scraperdir = os.path.join(packagedir, 'scrapers')
 package_data = []
 
 # Walk our scraper directory looking for files which have the correct
-# file postfix. We collect these in to a dict by directory.
+# file postfix, along with the manifest of the definitions (see
+# scraper.Registry.) Their paths are relative to our package.
 #
-for dirpath, dirnames, filenames in os.walk('scrapers'):
+for dirpath, dirnames, filenames in os.walk(scraperdir):
     for filename in filenames:
         ign, ext = os.path.splitext(filename)
-        if ext.lower() in ('.xml', '.png', '.jpg', '.gif'):
-            pacakge_data.append(os.path.join(dirpath, filename))
+        if ext.lower() in ('.xml', '.json', '.png', '.jpg', '.gif'):
+            package_data.append(os.path.relpath(os.path.join(dirpath, filename),
+                                                packagedir))
 
 setup(name='scraper',
       version = '0.5',
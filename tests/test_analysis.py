@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of ScraperFunction.analyze(): skipping the steps whose output is
+never read, and releasing buffers no later step reads, must not change
+what any function returns. Run them from the top of the source tree
+with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import copy
+import unittest
+
+#
+import scraper
+from benchmark import bench
+
+# What we put in a function's other buffers, after the page in buffer
+# 1: a number (the id most functions are given) or a url. Not the page
+# again, since some definitions put buffers in their expressions and a
+# page made in to an expression can take minutes to compile and match.
+#
+OTHER_BUFFERS = ("12345", "http://example.com/")
+NUM_INPUTS = 9
+
+####################################################################
+#
+def run(parser, settings, function, buffers):
+    """
+    Return the result of running the given function, or the name of the
+    exception it raises.
+
+    Arguments:
+    - `parser`: The ScraperParser.
+    - `settings`: The Settings to run it with.
+    - `function`: The name of the function.
+    - `buffers`: The strings to put in buffers 1, 2, ...
+    """
+    try:
+        return parser.parse(function, settings, buffers)
+    except Exception, e:
+        return "raised %s" % e.__class__.__name__
+
+####################################################################
+#
+def force_live(parser):
+    """
+    Undo the analysis of all of the functions of the given parser: every
+    step is run and no buffer is released.
+
+    Arguments:
+    - `parser`: The ScraperParser.
+    """
+    for function in parser.functions.itervalues():
+        for step in function.all_steps():
+            step.live = True
+            step.release = []
+    return
+
+####################################################################
+#
+def flipped(settings):
+    """
+    Return a copy of the given settings with every boolean setting set to
+    the opposite of its default, so that the steps conditional on them
+    that are not run by default are.
+
+    Arguments:
+    - `settings`: The Settings of a scraper.
+    """
+    result = copy.deepcopy(settings)
+    for setting_id in result.ids:
+        value = result.value(setting_id)
+        if isinstance(value, bool):
+            result.set_value(setting_id, value and "false" or "true")
+    return result
+
+##################################################################
+##################################################################
+#
+class TestBundledDefinitions(unittest.TestCase):
+    """
+    Runs every function of every definition we support over synthetic
+    pages (see benchmark.bench.function_samples()), once as analyzed and
+    once with every step run, and checks the results are the same.
+    """
+
+    ##################################################################
+    #
+    def inputs(self, scraper_xml):
+        """
+        Return a list of the lists of buffers we run the functions of the
+        given definition with: a page with samples of every function's
+        expressions, and one with those of each function alone, each
+        along with every kind of other input.
+        """
+        functions = bench.function_samples(scraper_xml)
+        pages = [u"\n<br>\n".join(text for name, samples in functions
+                                  for text in samples)]
+        pages.extend(u"\n<br>\n".join(samples) for name, samples in functions)
+        inputs = []
+        for page in pages:
+            page = page.encode("ascii", "xmlcharrefreplace")
+            for other in OTHER_BUFFERS:
+                inputs.append([page] + [other] * (NUM_INPUTS - 1))
+        return inputs
+
+    ##################################################################
+    #
+    def check_definition(self, name):
+        """
+        Check the given definition, and return how many of its steps the
+        analysis skips.
+        """
+        scraper_xml = scraper.registry.definition(name)
+        s = scraper.Scraper(scraper_xml, definition_cache = None)
+        parser = s.parser
+        skipped = len([step for function in parser.functions.itervalues()
+                       for step in function.all_steps()
+                       if step.has_expression and not step.live])
+        all_settings = (s.settings, flipped(s.settings))
+        inputs = self.inputs(scraper_xml)
+        functions = sorted(parser.functions)
+
+        analyzed = [run(parser, settings, function, buffers)
+                    for function in functions
+                    for settings in all_settings
+                    for buffers in inputs]
+        force_live(parser)
+        everything = [run(parser, settings, function, buffers)
+                      for function in functions
+                      for settings in all_settings
+                      for buffers in inputs]
+
+        # Say which function differs, not just that something did.
+        #
+        per_function = len(all_settings) * len(inputs)
+        for i, function in enumerate(functions):
+            part = slice(i * per_function, (i + 1) * per_function)
+            self.assertEqual(analyzed[part], everything[part],
+                             "%s %s" % (name, function))
+        return skipped
+
+    ##################################################################
+    #
+    def test_bundled_definitions(self):
+        names = [entry["name"] for entry in
+                 scraper.registry.entries(supported = True)]
+        self.assertTrue(len(names) > 0)
+
+        # Some of them have steps to skip, or we are not testing much.
+        #
+        skipped = sum(self.check_definition(name) for name in names)
+        self.assertTrue(skipped > 0)
+
+##################################################################
+##################################################################
+#
+class TestAnalysis(unittest.TestCase):
+    """
+    The cases analyze() has to get right, each in a function of its own.
+    """
+
+    ##################################################################
+    #
+    def parser(self, function_xml):
+        """
+        Return a ScraperParser of a definition with just the given
+        function in it.
+        """
+        return scraper.ScraperParser('<scraper name="test" '
+                                     'content="movies">%s</scraper>' % \
+                                     function_xml)
+
+    ##################################################################
+    #
+    def check(self, function_xml, buffers, expected, settings = None):
+        """
+        Check that the <GetDetails> in the given XML returns what we
+        expect, both as analyzed and with every step run. Return whether
+        the analysis found each of its steps live, in the order they are
+        run.
+        """
+        parser = self.parser(function_xml)
+        function = parser.functions["getdetails"]
+        steps = [step for step, guarded in function.run_order()]
+        live = [step.live for step in steps]
+        self.assertEqual(parser.parse("GetDetails", settings, buffers),
+                         expected)
+        force_live(parser)
+        self.assertEqual(parser.parse("GetDetails", settings, buffers),
+                         expected)
+        return live
+
+    ##################################################################
+    #
+    def test_cleared_buffer_is_dead(self):
+        # The first step's result is cleared by the second, whatever the
+        # second one matches, so the first one need not be run.
+        #
+        live = self.check(
+            '<GetDetails dest="3">'
+            '<RegExp input="$$1" output="first" dest="5">'
+            '<expression>(.*)</expression></RegExp>'
+            '<RegExp input="$$1" output="\\1" dest="5">'
+            '<expression clear="yes">(nothing)</expression></RegExp>'
+            '<RegExp input="$$5" output="[\\1]" dest="3">'
+            '<expression>(.*)</expression></RegExp>'
+            '</GetDetails>', ["page"], "[]")
+        self.assertEqual(live, [False, True, True])
+
+    ##################################################################
+    #
+    def test_appended_buffer_is_live(self):
+        # The second step appends to what the first one wrote.
+        #
+        live = self.check(
+            '<GetDetails dest="3">'
+            '<RegExp input="$$1" output="first" dest="5">'
+            '<expression>(.*)</expression></RegExp>'
+            '<RegExp input="$$1" output=",\\1" dest="5+">'
+            '<expression>(.*)</expression></RegExp>'
+            '<RegExp input="$$5" output="[\\1]" dest="3">'
+            '<expression>(.*)</expression></RegExp>'
+            '</GetDetails>', ["page"], "[first,page]")
+        self.assertEqual(live, [True, True, True])
+
+    ##################################################################
+    #
+    def test_appended_after_clear_is_dead(self):
+        # Appending to a buffer that is cleared first does not read it.
+        #
+        live = self.check(
+            '<GetDetails dest="3">'
+            '<RegExp input="$$1" output="first" dest="5">'
+            '<expression>(.*)</expression></RegExp>'
+            '<RegExp input="$$1" output=",\\1" dest="5+">'
+            '<expression clear="yes">(.*)</expression></RegExp>'
+            '<RegExp input="$$5" output="[\\1]" dest="3">'
+            '<expression>(.*)</expression></RegExp>'
+            '</GetDetails>', ["page"], "[,page]")
+        self.assertEqual(live, [False, True, True])
+
+    ##################################################################
+    #
+    def test_guarded_clear_keeps_buffer_live(self):
+        # The step that would clear buffer 5 is only run if the setting
+        # 'never' is True, and it is not, so the first step's result is
+        # what we get.
+        #
+        live = self.check(
+            '<GetDetails dest="3">'
+            '<RegExp input="$$1" output="first" dest="5">'
+            '<expression>(.*)</expression></RegExp>'
+            '<RegExp input="$$1" output="\\1" dest="5" conditional="never">'
+            '<expression clear="yes">(.*)</expression></RegExp>'
+            '<RegExp input="$$5" output="[\\1]" dest="3">'
+            '<expression>(.*)</expression></RegExp>'
+            '</GetDetails>', ["page"], "[first]")
+        self.assertEqual(live, [True, True, True])
+
+    ##################################################################
+    #
+    def test_clear_nested_in_conditional_keeps_buffer_live(self):
+        # As above, but it is the step the clearing one is nested in
+        # that is conditional.
+        #
+        live = self.check(
+            '<GetDetails dest="3">'
+            '<RegExp input="$$1" output="first" dest="5">'
+            '<expression>(.*)</expression></RegExp>'
+            '<RegExp input="$$1" output="x" dest="6" conditional="never">'
+            '<RegExp input="$$1" output="\\1" dest="5">'
+            '<expression clear="yes">(.*)</expression></RegExp>'
+            '<expression>(.*)</expression></RegExp>'
+            '<RegExp input="$$5" output="[\\1]" dest="3">'
+            '<expression>(.*)</expression></RegExp>'
+            '</GetDetails>', ["page"], "[first]")
+        self.assertEqual(live, [True, True, False, True])
+
+    ##################################################################
+    #
+    def test_compare_buffer_is_live(self):
+        # The second step's own result is never read but it lower cases
+        # buffer 2 (its 'compare' buffer), which the last step reads.
+        #
+        live = self.check(
+            '<GetDetails dest="3">'
+            '<RegExp input="$$1" output="\\1" dest="2">'
+            '<expression>(.*)</expression></RegExp>'
+            '<RegExp input="$$1" output="\\1" dest="6">'
+            '<expression compare="2">(.*)</expression></RegExp>'
+            '<RegExp input="$$2" output="[\\1]" dest="3">'
+            '<expression>(.*)</expression></RegExp>'
+            '</GetDetails>', ["The PAGE"], "[the page]")
+        self.assertEqual(live, [True, True, True])
+
+    ##################################################################
+    #
+    def test_dead_step_still_runs_nested_steps(self):
+        # The outer step's result is never read, but the step nested in
+        # it writes our result.
+        #
+        live = self.check(
+            '<GetDetails dest="3">'
+            '<RegExp input="$$1" output="unread" dest="6">'
+            '<RegExp input="$$1" output="[\\1]" dest="3">'
+            '<expression>(.*)</expression></RegExp>'
+            '<expression>(.*)</expression></RegExp>'
+            '</GetDetails>', ["page"], "[page]")
+        self.assertEqual(live, [True, False])
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of looking up a batch of titles: Scraper.lookup_one(),
+Scraper.lookup_iter() and the NDJSON written by scrape_cli.py's
+'batch' command. Run them from the top of the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+#
+import scraper
+import scrape_cli
+
+# A movie definition that finds the show named on the search page, if
+# there is one, and gets its year from the details page.
+#
+MOVIE_XML = """<scraper name="batch" content="movies">
+<CreateSearchUrl dest="3">
+  <RegExp input="$$1" output="http://test/search/\\1" dest="3">
+    <expression noclean="1">(.*)</expression>
+  </RegExp>
+</CreateSearchUrl>
+<GetSearchResults dest="8">
+  <RegExp input="$$5" output="&lt;results&gt;\\1&lt;/results&gt;" dest="8">
+    <RegExp input="$$1" output="&lt;entity&gt;&lt;title&gt;\\1&lt;/title&gt;&lt;id&gt;\\2&lt;/id&gt;&lt;url&gt;http://test/details/\\2&lt;/url&gt;&lt;/entity&gt;" dest="5">
+      <expression repeat="yes">title=([^;]*);id=([^;]*);</expression>
+    </RegExp>
+    <expression noclean="1">(.*)</expression>
+  </RegExp>
+</GetSearchResults>
+<GetDetails dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;title&gt;\\1&lt;/title&gt;&lt;year&gt;\\2&lt;/year&gt;&lt;/details&gt;" dest="3">
+    <expression>title=([^;]*);year=([^;]*);</expression>
+  </RegExp>
+</GetDetails>
+</scraper>
+"""
+
+# What each of the definition's urls returns. Searching for 'broken'
+# fails, and 'slow' takes SLOW seconds.
+#
+PAGES = {
+    "http://test/search/the+matrix" : "title=The Matrix;id=1;"
+                                      "title=The Matrix Reloaded;id=2;",
+    "http://test/search/alien"      : "title=Aliens;id=3;title=Alien;id=4;",
+    "http://test/search/slow"       : "title=Slow;id=5;",
+    "http://test/search/nothing"    : "",
+    "http://test/details/1"         : "title=The Matrix;year=1999;",
+    "http://test/details/2"         : "title=The Matrix Reloaded;year=2003;",
+    "http://test/details/3"         : "title=Aliens;year=1986;",
+    "http://test/details/4"         : "title=Alien;year=1979;",
+    "http://test/details/5"         : "title=Slow;year=2000;",
+    }
+SLOW = 0.5
+
+##################################################################
+##################################################################
+#
+class PageFetcher(scraper.Fetcher):
+    """
+    A Fetcher that gets its pages from PAGES instead of the network. It
+    keeps track of the most searches it was asked for at once.
+    """
+
+    ##################################################################
+    #
+    def __init__(self):
+        scraper.Fetcher.__init__(self, workers = 1)
+        self.searching = 0
+        self.most_searching = 0
+
+    ##################################################################
+    #
+    def fetch(self, url, revalidate = False):
+        if url.url not in PAGES:
+            raise scraper.FetchFailed("No page at %s" % url.url)
+        if "/search/" not in url.url:
+            return PAGES[url.url]
+        with self.lock:
+            self.searching += 1
+            self.most_searching = max(self.most_searching, self.searching)
+        try:
+            time.sleep(url.url.endswith("/slow") and SLOW or 0.01)
+            return PAGES[url.url]
+        finally:
+            with self.lock:
+                self.searching -= 1
+
+####################################################################
+#
+def failing_titles(titles):
+    """
+    Yield the given titles and then fail, like a file that can not be
+    read to its end.
+
+    Arguments:
+    - `titles`: The titles to yield first.
+    """
+    for title in titles:
+        yield title
+    raise IOError("read failed")
+
+##################################################################
+##################################################################
+#
+class BatchTestCase(unittest.TestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.fetcher = PageFetcher()
+        self.scraper = scraper.Scraper(MOVIE_XML, fetcher = self.fetcher,
+                                       definition_cache = None)
+
+##################################################################
+##################################################################
+#
+class TestLookupOne(BatchTestCase):
+
+    ##################################################################
+    #
+    def test_best_match(self):
+        result = self.scraper.lookup_one("The Matrix")
+        self.assertEqual(result["query"], "The Matrix")
+        self.assertEqual(result["results"], 2)
+        self.assertEqual(result["score"], 1.0)
+        self.assertEqual(result["show"]["title"], "The Matrix")
+        self.assertEqual(result["show"]["year"], 1999)
+
+        # The best match is not always the first one.
+        #
+        result = self.scraper.lookup_one("Alien")
+        self.assertEqual(result["show"]["id"], "4")
+        self.assertEqual(result["show"]["year"], 1979)
+
+    ##################################################################
+    #
+    def test_no_match(self):
+        self.assertEqual(self.scraper.lookup_one("Nothing"),
+                         { "query" : "Nothing", "results" : 0,
+                           "show" : None })
+
+    ##################################################################
+    #
+    def test_error(self):
+        self.assertEqual(self.scraper.lookup_one("Broken"),
+                         { "query" : "Broken",
+                           "error" : "FetchFailed: No page at "
+                                     "http://test/search/broken" })
+
+    ##################################################################
+    #
+    def test_fields(self):
+        result = self.scraper.lookup_one("The Matrix", ["title", "year"])
+        self.assertEqual(result["show"], { "title" : "The Matrix",
+                                           "year" : 1999 })
+
+##################################################################
+##################################################################
+#
+class TestLookupIter(BatchTestCase):
+
+    ##################################################################
+    #
+    def test_every_title_comes_back_once(self):
+        titles = ["The Matrix", "Broken", "Alien", "Nothing"] * 3
+        results = list(self.scraper.lookup_iter(titles, 3))
+        self.assertEqual(sorted(r["index"] for r in results),
+                         range(len(titles)))
+        for result in results:
+            index = result.pop("index")
+            self.assertEqual(result, self.scraper.lookup_one(titles[index]))
+        self.assertTrue(self.fetcher.most_searching <= 3)
+
+    ##################################################################
+    #
+    def test_results_come_back_as_they_are_done(self):
+        titles = ["Slow", "The Matrix", "Alien"]
+        order = [r["index"] for r in self.scraper.lookup_iter(titles, 3)]
+        self.assertEqual(sorted(order), [0, 1, 2])
+        self.assertEqual(order[-1], 0)
+
+        # With one in flight they are done, and come back, in order.
+        #
+        order = [r["index"] for r in self.scraper.lookup_iter(titles, 1)]
+        self.assertEqual(order, [0, 1, 2])
+
+    ##################################################################
+    #
+    def test_error_reading_titles(self):
+        results = []
+        def read_all():
+            for result in self.scraper.lookup_iter(
+                    failing_titles(["The Matrix", "Alien"]), 2):
+                results.append(result)
+        self.assertRaises(IOError, read_all)
+        self.assertEqual(sorted(r["index"] for r in results), [0, 1])
+
+    ##################################################################
+    #
+    def test_stopping_early(self):
+        titles = ["The Matrix"] * 20
+        for result in self.scraper.lookup_iter(titles, 2):
+            break
+        self.assertEqual(result["show"]["title"], "The Matrix")
+
+        # Nothing more is looked up once our caller stops.
+        #
+        time.sleep(0.1)
+        self.assertEqual(self.fetcher.searching, 0)
+        self.assertTrue(self.fetcher.most_searching <= 2)
+
+##################################################################
+##################################################################
+#
+class TestBatchCommand(BatchTestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        BatchTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.definition = os.path.join(self.directory, "batch.xml")
+        with open(self.definition, "w") as f:
+            f.write(MOVIE_XML)
+        self.cp = scrape_cli.CommandProcessor(self.definition)
+        self.cp.scraper.fetcher = self.fetcher
+
+    ##################################################################
+    #
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    ##################################################################
+    #
+    def batch(self, titles, jobs, fields = None):
+        """
+        Run the 'batch' command and return the lines it writes, each one
+        parsed as JSON.
+        """
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.cp.cmd_batch(titles, jobs, fields)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertTrue(output.endswith("\n"))
+        return [json.loads(line) for line in output.splitlines()]
+
+    ##################################################################
+    #
+    def test_one_line_per_title(self):
+        titles = ["Slow", "The Matrix", "Broken", "Nothing", "Alien"]
+        lines = self.batch(titles, 4)
+        self.assertEqual(sorted(line["index"] for line in lines),
+                         range(len(titles)))
+        self.assertEqual(lines[-1]["index"], 0)
+        by_index = dict((line["index"], line) for line in lines)
+        self.assertEqual(by_index[1]["show"]["year"], 1999)
+        self.assertEqual(by_index[2]["error"],
+                         "FetchFailed: No page at http://test/search/broken")
+        self.assertEqual(by_index[3]["show"], None)
+        self.assertEqual(by_index[4]["show"]["title"], "Alien")
+        for line in lines:
+            self.assertEqual(line["query"], titles[line["index"]])
+
+    ##################################################################
+    #
+    def test_fields(self):
+        lines = self.batch(["The Matrix", "Broken"], 1, ["title", "year"])
+        self.assertEqual(lines,
+                         [{ "query" : "The Matrix", "index" : 0,
+                            "results" : 2, "score" : 1.0,
+                            "show" : { "title" : "The Matrix",
+                                       "year" : 1999 } },
+                          { "query" : "Broken", "index" : 1,
+                            "error" : "FetchFailed: No page at "
+                                      "http://test/search/broken" }])
+
+    ##################################################################
+    #
+    def test_titles_from_files(self):
+        names = os.path.join(self.directory, "names.txt")
+        with open(names, "w") as f:
+            f.write("/media/The Matrix.mkv\n\n  /media/Alien.avi  \n")
+        titles = list(scrape_cli.read_titles([names], media_files = True))
+        self.assertEqual(titles, ["The Matrix", "Alien"])
+        lines = self.batch(titles, 1, ["title"])
+        self.assertEqual([line["show"] for line in lines],
+                         [{ "title" : "The Matrix" }, { "title" : "Alien" }])
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
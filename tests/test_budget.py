@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of a ScraperParser's expression_budget and function_budget
+stopping a definition in this process, between the matches of an
+expression. Run them from the top of the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import unittest
+
+#
+import scraper
+
+# An expression that backtracks through every way of splitting up a run
+# of 'a's before it gives up on the 'b' and matches the run as it is.
+# Each match takes a while, but not for ever.
+#
+SLOW_EXPRESSION = "(?:(a+)+b|a+)"
+RUN = "a" * 16
+RUNS = 20
+
+# A definition that makes its search url out of every run of 'a's in
+# the title, and gets the details of a page in two steps, the first of
+# them slow.
+#
+SLOW_XML = """<scraper name="slow" content="movies">
+<CreateSearchUrl dest="3">
+  <RegExp input="$$1" output="\\1" dest="3">
+    <expression repeat="yes" noclean="1">(%(expression)s)</expression>
+  </RegExp>
+</CreateSearchUrl>
+<GetDetails dest="3">
+  <RegExp input="$$1" output="\\1" dest="5">
+    <expression repeat="yes" noclean="1">(%(expression)s)</expression>
+  </RegExp>
+  <RegExp input="$$5" output="&lt;details&gt;&lt;/details&gt;" dest="3">
+    <expression>(.*)</expression>
+  </RegExp>
+</GetDetails>
+</scraper>
+""" % { "expression" : SLOW_EXPRESSION }
+
+##################################################################
+##################################################################
+#
+class TestBudget(unittest.TestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.parser = scraper.ScraperParser(SLOW_XML)
+        self.page = "\n".join([RUN] * RUNS)
+
+    ##################################################################
+    #
+    def test_within_budget(self):
+        self.assertEqual(self.parser.parse("GetDetails", None, [self.page]),
+                         "<details></details>")
+
+    ##################################################################
+    #
+    def test_expression_budget(self):
+        # The expression is given up on after its first match, instead
+        # of once it has matched every run.
+        #
+        self.parser.expression_budget = 0.0
+        try:
+            self.parser.parse("GetDetails", None, [self.page])
+        except scraper.ParseTimeout, e:
+            self.assertTrue("GetDetails/RegExp[1]" in str(e), str(e))
+            self.assertTrue("and 1 matches on %d bytes" % len(self.page) in
+                            str(e), str(e))
+        else:
+            self.fail("ParseTimeout not raised")
+
+    ##################################################################
+    #
+    def test_function_budget(self):
+        self.parser.expression_budget = None
+        self.parser.function_budget = 0.0
+        self.assertRaises(scraper.ParseTimeout, self.parser.parse,
+                          "GetDetails", None, [self.page])
+
+        # The deadline is only for the call it was set for.
+        #
+        self.parser.function_budget = None
+        self.assertEqual(self.parser.parse("GetDetails", None, [self.page]),
+                         "<details></details>")
+
+    ##################################################################
+    #
+    def test_lookup_one(self):
+        # Looking up a title in this process fails with the timeout,
+        # without ever fetching anything.
+        #
+        s = scraper.Scraper(SLOW_XML, definition_cache = None)
+        s.parser.expression_budget = 0.0
+        result = s.lookup_one(" ".join([RUN] * RUNS))
+        self.assertEqual(sorted(result), ["error", "query"])
+        self.assertTrue(result["error"].startswith("ParseTimeout"),
+                        result["error"])
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
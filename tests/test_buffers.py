@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of the parameter buffers of a parse: the chunks appended to a
+BufferStore that are only joined when it is read, and the buffers
+released once no later step reads them. Run them from the top of the
+source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import random
+import unittest
+
+#
+import scraper
+from scraper import scrap
+from benchmark import bench
+
+# What we put in a function's other buffers, after the page in buffer
+# 1 (see test_analysis.)
+#
+OTHER_BUFFERS = ("12345", "http://example.com/")
+NUM_INPUTS = 9
+
+##################################################################
+##################################################################
+#
+class KeptBufferStore(scraper.BufferStore):
+    """
+    A BufferStore that keeps a list of every one that is made, so that
+    we can look at the buffers of a parse once it is done.
+    """
+    made = []
+
+    ##################################################################
+    #
+    def __init__(self, *args, **kwargs):
+        scraper.BufferStore.__init__(self, *args, **kwargs)
+        self.made.append(self)
+
+####################################################################
+#
+def run(s, function, buffers):
+    """
+    Return the result of running the given function, or the name of the
+    exception it raises.
+
+    Arguments:
+    - `s`: The Scraper.
+    - `function`: The name of the function.
+    - `buffers`: The strings to put in buffers 1, 2, ...
+    """
+    try:
+        return s.parse(function, buffers)
+    except Exception, e:
+        return "raised %s" % e.__class__.__name__
+
+####################################################################
+#
+def keep_releasing(parser, release):
+    """
+    Set whether the steps of the given parser release the buffers they
+    read last, and return what each of them released.
+
+    Arguments:
+    - `parser`: The ScraperParser.
+    - `release`: If False no step releases any buffer.
+    """
+    released = { }
+    for function in parser.functions.itervalues():
+        for step in function.all_steps():
+            released[step] = step.release
+            if not release:
+                step.release = []
+    return released
+
+##################################################################
+##################################################################
+#
+class TestBufferStore(unittest.TestCase):
+
+    ##################################################################
+    #
+    def test_set_and_get(self):
+        store = scraper.BufferStore(3)
+        self.assertEqual([store.get(i) for i in (1, 2, 3)], ["", "", ""])
+        store.set(2, "two")
+        store.set(3, u"thr\xe9e")
+        self.assertEqual([store.get(i) for i in (1, 2, 3)],
+                         ["", "two", u"thr\xe9e"])
+        for i in (0, 4, -1):
+            self.assertRaises(IndexError, store.get, i)
+            self.assertRaises(IndexError, store.set, i, "x")
+        store.clear()
+        self.assertEqual(store.get(2), "")
+
+    ##################################################################
+    #
+    def test_appends_are_joined_when_read(self):
+        store = scraper.BufferStore(3)
+        store.set(1, "a")
+        for part in "bcd":
+            store.set(1, part, append = True)
+        self.assertEqual(store.slots[1], "a")
+        self.assertEqual(store.chunks[1], ["a", "b", "c", "d"])
+        self.assertEqual(store.get(1), "abcd")
+        self.assertEqual(store.chunks, { })
+        self.assertEqual(store.get(1), "abcd")
+
+        # Appending after a read carries on from what was read, and
+        # setting the buffer drops what was appended.
+        #
+        store.set(1, "e", append = True)
+        self.assertEqual(store.get(1), "abcde")
+        store.set(1, "f", append = True)
+        store.set(1, "g")
+        self.assertEqual(store.get(1), "g")
+
+        # Appending to an empty buffer, and clearing appended buffers.
+        #
+        store.set(2, "x", append = True)
+        store.set(3, "y", append = True)
+        self.assertEqual(store.get(2), "x")
+        store.clear()
+        self.assertEqual([store.get(i) for i in (1, 2, 3)], ["", "", ""])
+        self.assertEqual(store.chunks, { })
+
+    ##################################################################
+    #
+    def test_mixed_text(self):
+        store = scraper.BufferStore(2)
+        store.set(1, "caf", append = True)
+        store.set(1, u"\xe9", append = True)
+        self.assertEqual(store.get(1), u"caf\xe9")
+
+        # A page in a charset we were not told of can not be mixed with
+        # unicode, which is then put in as character references.
+        #
+        store.set(2, "caf\xe9 ")
+        store.set(2, u"\u5343", append = True)
+        self.assertEqual(store.get(2), "caf\xe9 &#21315;")
+
+    ##################################################################
+    #
+    def test_same_as_concatenating(self):
+        # Any mix of setting, appending and reading gives what setting
+        # and adding strings together does.
+        #
+        rand = random.Random(1234)
+        store = scraper.BufferStore(4)
+        expected = [""] * 5
+        for n in range(2000):
+            i = rand.randint(1, 4)
+            op = rand.random()
+            data = rand.choice(["", "x", "yz", u"\xe9", "%d;" % n])
+            if op < 0.5:
+                store.set(i, data, append = True)
+                expected[i] += data
+            elif op < 0.6:
+                store.set(i, data)
+                expected[i] = data
+            elif op < 0.61:
+                store.clear()
+                expected = [""] * 5
+            else:
+                self.assertEqual(store.get(i), expected[i])
+        for i in range(1, 5):
+            self.assertEqual(store.get(i), expected[i])
+
+##################################################################
+##################################################################
+#
+class TestRelease(unittest.TestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.buffer_store = scrap.BufferStore
+        scrap.BufferStore = KeptBufferStore
+        del KeptBufferStore.made[:]
+
+    ##################################################################
+    #
+    def tearDown(self):
+        scrap.BufferStore = self.buffer_store
+        del KeptBufferStore.made[:]
+
+    ##################################################################
+    #
+    def test_buffers_are_released_after_their_last_read(self):
+        parser = scraper.ScraperParser(
+            '<scraper name="test" content="movies"><GetDetails dest="3">'
+            '<RegExp input="$$1" output="\\1" dest="5">'
+            '<expression>title=([^;]*)</expression></RegExp>'
+            '<RegExp input="$$2" output="\\1" dest="6">'
+            '<expression>(.*)</expression></RegExp>'
+            '<RegExp input="$$5" output="[\\1|$$6]" dest="3">'
+            '<expression>(.*)</expression></RegExp>'
+            '</GetDetails></scraper>')
+        steps = list(parser.functions["getdetails"].all_steps())
+        self.assertEqual([step.release for step in steps],
+                         [[1], [2], [5, 6]])
+
+        page = "title=The Matrix;" + "filler " * 1000
+        buffers = [page, "tt0133093", "unread"]
+        self.assertEqual(parser.parse("GetDetails", None, buffers),
+                         "[The Matrix|tt0133093]")
+        store = KeptBufferStore.made[-1]
+        self.assertEqual([store.get(i) for i in range(1, 7)],
+                         ["", "", "[The Matrix|tt0133093]", "", "", ""])
+
+        keep_releasing(parser, False)
+        self.assertEqual(parser.parse("GetDetails", None, buffers),
+                         "[The Matrix|tt0133093]")
+        store = KeptBufferStore.made[-1]
+        self.assertEqual([store.get(i) for i in range(1, 7)],
+                         [page, "tt0133093", "[The Matrix|tt0133093]",
+                          "", "The Matrix", "tt0133093"])
+
+    ##################################################################
+    #
+    def test_bundled_definitions(self):
+        # Every function of every definition we support, over the
+        # benchmark's synthetic pages, returns the same with and without
+        # releasing buffers.
+        #
+        released = 0
+        for entry in scraper.registry.entries(supported = True):
+            scraper_xml = scraper.registry.definition(entry["name"])
+            s = scraper.Scraper(scraper_xml, definition_cache = None)
+            calls = []
+            for name, samples in bench.function_samples(scraper_xml):
+                page = u"\n<br>\n".join(samples).encode("ascii",
+                                                      "xmlcharrefreplace")
+                for other in OTHER_BUFFERS:
+                    calls.append((name, [page] + [other] * (NUM_INPUTS - 1)))
+
+            with_release = [run(s, *call) for call in calls]
+            released += sum(len(release) for release in
+                            keep_releasing(s.parser, False).itervalues())
+            without_release = [run(s, *call) for call in calls]
+            for call, got, expected in zip(calls, with_release,
+                                           without_release):
+                self.assertEqual(got, expected,
+                                 "%s %s" % (entry["name"], call[0]))
+
+        # And some of their steps do release buffers, or we are not
+        # testing much.
+        #
+        self.assertTrue(released > 0)
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of the Fetcher's response caches, MemoryCache and DiskCache:
+expiring entries, dropping the least recently used ones when they hold
+too much, and, for DiskCache, outliving the process. Run them from the
+top of the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+#
+import scraper
+
+# How long an entry that expires lives, and how long we wait for it to
+# have expired.
+#
+TTL = 0.05
+EXPIRED = 0.1
+
+# Each body we cache is this big, and the caches we evict from hold
+# three of them.
+#
+BODY_BYTES = 100
+MAX_BYTES = 3 * BODY_BYTES
+
+####################################################################
+#
+def body(name):
+    """
+    Return a body of BODY_BYTES for the given key.
+
+    Arguments:
+    - `name`: The key.
+    """
+    return (name * BODY_BYTES)[:BODY_BYTES]
+
+##################################################################
+##################################################################
+#
+class CacheTests(object):
+    """
+    The tests that MemoryCache and DiskCache both have to pass. The test
+    case of each makes the cache.
+    """
+
+    ##################################################################
+    #
+    def make_cache(self, max_bytes = None):
+        """
+        Return a new, empty cache of the kind we test, holding at most
+        the given number of bytes (or its default.)
+        """
+        raise NotImplementedError
+
+    ##################################################################
+    #
+    def test_put_and_get(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.get("a"), None)
+        cache.put("a", "page", charset = "utf-8")
+        self.assertEqual(cache.get("a"), ("page", "utf-8"))
+        cache.put("a", "new page")
+        self.assertEqual(cache.get("a"), ("new page", None))
+        self.assertEqual(len(cache), 1)
+
+    ##################################################################
+    #
+    def test_expired_entry_is_dropped(self):
+        cache = self.make_cache()
+        cache.put("a", "page", ttl = TTL)
+        cache.put("b", "page")
+        self.assertEqual(cache.get("a"), ("page", None))
+        time.sleep(EXPIRED)
+
+        # Without a validator there is nothing more it is good for.
+        #
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get_stale("a"), None)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get("b"), ("page", None))
+        self.assertEqual(cache.size, 4)
+
+    ##################################################################
+    #
+    def test_expired_entry_with_validator_is_kept(self):
+        cache = self.make_cache()
+        cache.put("a", "page", ttl = TTL, etag = '"1"',
+                  last_modified = "Mon, 01 Jan 2001 00:00:00 GMT",
+                  charset = "utf-8")
+        time.sleep(EXPIRED)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get_stale("a"),
+                         ("page", '"1"', "Mon, 01 Jan 2001 00:00:00 GMT",
+                          "utf-8"))
+        self.assertEqual(len(cache), 1)
+
+        # Once it is revalidated it is fresh again.
+        #
+        cache.put("a", "page", ttl = 60, etag = '"1"')
+        self.assertEqual(cache.get("a"), ("page", None))
+
+    ##################################################################
+    #
+    def test_least_recently_used_is_evicted(self):
+        cache = self.make_cache(MAX_BYTES)
+        for name in "abc":
+            cache.put(name, body(name))
+            time.sleep(0.01)
+        self.assertEqual(len(cache), 3)
+
+        # Reading 'a' makes 'b' the least recently used, so it goes to
+        # make room for 'd'.
+        #
+        self.assertEqual(cache.get("a"), (body("a"), None))
+        time.sleep(0.01)
+        cache.put("d", body("d"))
+        self.assertEqual(cache.get("b"), None)
+        for name in "acd":
+            self.assertEqual(cache.get(name), (body(name), None))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.size, MAX_BYTES)
+
+    ##################################################################
+    #
+    def test_body_bigger_than_cache_is_not_kept(self):
+        cache = self.make_cache(MAX_BYTES)
+        cache.put("a", body("a"))
+        cache.put("b", "b" * (MAX_BYTES + 1))
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), (body("a"), None))
+
+    ##################################################################
+    #
+    def test_clear(self):
+        cache = self.make_cache()
+        cache.put("a", "page")
+        cache.clear()
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+##################################################################
+##################################################################
+#
+class TestMemoryCache(CacheTests, unittest.TestCase):
+
+    ##################################################################
+    #
+    def make_cache(self, max_bytes = None):
+        if max_bytes is None:
+            return scraper.MemoryCache()
+        return scraper.MemoryCache(max_bytes)
+
+##################################################################
+##################################################################
+#
+class TestDiskCache(CacheTests, unittest.TestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cache.db")
+        self.caches = []
+
+    ##################################################################
+    #
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.directory)
+
+    ##################################################################
+    #
+    def make_cache(self, max_bytes = None):
+        if max_bytes is None:
+            cache = scraper.DiskCache(self.path)
+        else:
+            cache = scraper.DiskCache(self.path, max_bytes)
+        self.caches.append(cache)
+        return cache
+
+    ##################################################################
+    #
+    def test_outlives_close(self):
+        cache = self.make_cache(MAX_BYTES)
+        cache.put("a", body("a"), ttl = 60, charset = "utf-8")
+        cache.put("b", body("b"), ttl = TTL, etag = '"b"')
+        cache.put("c", body("c"), ttl = TTL)
+        cache.close()
+        self.caches.remove(cache)
+        time.sleep(EXPIRED)
+
+        cache = self.make_cache(MAX_BYTES)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.size, MAX_BYTES)
+        self.assertEqual(cache.get("a"), (body("a"), "utf-8"))
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get_stale("b"), (body("b"), '"b"', None, None))
+        self.assertEqual(cache.get("c"), None)
+
+        # The sizes of what it held count toward its limit, less that of
+        # 'c' that it dropped, and 'b' is the least recently used now.
+        #
+        self.assertEqual(cache.size, 2 * BODY_BYTES)
+        cache.put("d", body("d"))
+        time.sleep(0.01)
+        cache.put("e", body("e"))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get_stale("b"), None)
+        for name in "ade":
+            self.assertTrue(cache.get(name) is not None)
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of the cleaning and trimming of match groups as they are put in
+to a step's output, against what the '!!!CLEAN!!!' and '!!!TRIM!!!'
+markers and the MLStripper they were run through made of them. Run
+them from the top of the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import re
+import unittest
+import HTMLParser
+from xml.sax.saxutils import escape, quoteattr
+
+#
+import scraper
+
+# The markers the output pattern's group references were wrapped in.
+#
+clean_re = re.compile(r'!!!CLEAN!!!((?!!!!CLEAN!!!).*?)!!!CLEAN!!!', re.DOTALL)
+trim_re = re.compile(r'!!!TRIM!!!((?!!!!TRIM!!!).*?)!!!TRIM!!!', re.DOTALL)
+
+##################################################################
+##################################################################
+#
+class MLStripper(HTMLParser.HTMLParser):
+    """
+    What groups were cleaned with: an HTMLParser that keeps only the
+    text between the tags.
+    """
+    def __init__(self):
+        self.reset()
+        self.fed = []
+    def handle_data(self, d):
+        self.fed.append(d)
+    def get_fed_data(self):
+        return ''.join(self.fed)
+
+####################################################################
+#
+def old_clean_substr(match_obj):
+    """
+    Return the text of group 1 of the given match, as a group between
+    '!!!CLEAN!!!' markers was cleaned.
+
+    Arguments:
+    - `match_obj`: The match of clean_re.
+    """
+    x = MLStripper()
+    x.feed(match_obj.group(1).strip())
+    return x.get_fed_data()
+
+####################################################################
+#
+def old_expand(match, output, noclean = ()):
+    """
+    Return what the given output pattern expanded to for the given
+    match before groups were cleaned as they were put in to it: \\1 to
+    \\8, less those in `noclean`, were wrapped in '!!!CLEAN!!!' markers,
+    the whole pattern expanded and then what was between the markers
+    cleaned. Nothing was trimmed: the 'trim' attribute was read with
+    '==' and never took effect.
+
+    Arguments:
+    - `match`: The match object.
+    - `output`: The output pattern.
+    - `noclean`: The groups that are not cleaned.
+    """
+    for i in range(1, 9):
+        if i not in noclean:
+            temp = "\\%d" % i
+            output = output.replace(temp, "!!!CLEAN!!!" + temp + "!!!CLEAN!!!")
+    result = match.expand(output)
+    result = clean_re.sub(old_clean_substr, result)
+    result = trim_re.sub(lambda m: m.group(1).strip(), result)
+    result = result.replace("!!!CLEAN!!!!!!CLEAN!!!", "")
+    return result.replace("!!!TRIM!!!!!!TRIM!!!", "")
+
+####################################################################
+#
+def parse(expression, output, page, noclean = (), trim = ()):
+    """
+    Return what a <GetDetails> made up of one step with the given
+    expression and output makes of the given page.
+
+    Arguments:
+    - `expression`: The step's expression.
+    - `output`: The step's output pattern.
+    - `page`: The page, in buffer 1.
+    - `noclean`: The groups its 'noclean' attribute lists.
+    - `trim`: The groups its 'trim' attribute lists.
+    """
+    attributes = ""
+    if noclean:
+        attributes += ' noclean="%s"' % ",".join(str(i) for i in noclean)
+    if trim:
+        attributes += ' trim="%s"' % ",".join(str(i) for i in trim)
+    parser = scraper.ScraperParser(
+        '<scraper name="test" content="movies"><GetDetails dest="3">'
+        '<RegExp input="$$1" output=%s dest="3">'
+        '<expression%s>%s</expression></RegExp></GetDetails></scraper>' % \
+            (quoteattr(output), attributes, escape(expression)))
+    return parser.parse("GetDetails", None, [page])
+
+##################################################################
+##################################################################
+#
+class TestClean(unittest.TestCase):
+
+    ##################################################################
+    #
+    def check(self, expression, output, page, noclean = ()):
+        """
+        Check that the step gives what it did before, and return it.
+        """
+        old = old_expand(re.search(expression, page, re.DOTALL), output,
+                         noclean)
+        new = parse(expression, output, page, noclean)
+        self.assertEqual(new, old, "%r: %r, not %r" % (page, new, old))
+        return new
+
+    ##################################################################
+    #
+    def test_white_space_is_stripped(self):
+        self.assertEqual(self.check("<h1>(.*)</h1>", "[\\1]",
+                                    "<h1>  The Matrix \n </h1>"),
+                         "[The Matrix]")
+
+    ##################################################################
+    #
+    def test_nested_tags_are_stripped(self):
+        page = '<td>\n<a href="/name/1"><b>Keanu</b> <i>Charles</i> ' \
+            'Reeves</a><br/></td>'
+        self.assertEqual(self.check("<td>(.*)</td>", "<actor>\\1</actor>",
+                                    page),
+                         "<actor>Keanu Charles Reeves</actor>")
+        self.assertEqual(self.check("<td>(.*)</td>", "<a>\\1</a>",
+                                    "<td><p>One<!-- a comment --> two"
+                                    "<div><span>three</span></div></p></td>"),
+                         "<a>One twothree</a>")
+
+    ##################################################################
+    #
+    def test_tag_cut_off_at_the_end_is_stripped(self):
+        self.assertEqual(self.check("(.*)", "\\1", "Title <a href="),
+                         "Title ")
+
+    ##################################################################
+    #
+    def test_noclean(self):
+        page = "<td> <b>one</b> </td><td> <i>two</i> </td>"
+        expression = "<td>(.*?)</td><td>(.*?)</td>"
+        self.assertEqual(self.check(expression, "\\1|\\2", page, (2,)),
+                         "one| <i>two</i> ")
+        self.assertEqual(self.check(expression, "\\1|\\2", page, (1, 2)),
+                         " <b>one</b> | <i>two</i> ")
+        self.assertEqual(self.check(expression, "\\2|\\1|\\2", page, (1,)),
+                         "two| <b>one</b> |two")
+
+    ##################################################################
+    #
+    def test_empty_groups(self):
+        self.assertEqual(self.check("<b>(.*)</b>", "[\\1]", "<b></b>"),
+                         "[]")
+
+        # Two empty groups in a row left their markers, out of step, in
+        # the output.
+        #
+        page = "<b></b>"
+        expression = "<b>(.*)</b>(x?)"
+        self.assertEqual(old_expand(re.search(expression, page),
+                                    "[\\1][\\2]"),
+                         "[!!!CLEAN!!!][!!!CLEAN!!!]")
+        self.assertEqual(parse(expression, "[\\1][\\2]", page), "[][]")
+
+    ##################################################################
+    #
+    def test_entities(self):
+        # The MLStripper dropped every entity it came across, leaving
+        # text that the XML our results are parsed as might not take.
+        # Named HTML entities now become character references, and a
+        # bare '&' is escaped.
+        #
+        page = "<p>Caf&eacute; &amp; Bar &#233; & Grill &nbsp;</p>"
+        expression = "<p>(.*)</p>"
+        self.assertEqual(old_expand(re.search(expression, page), "\\1"),
+                         "Caf  Bar  & Grill ")
+        self.assertEqual(parse(expression, "\\1", page),
+                         "Caf&#233; &amp; Bar &#233; &amp; Grill &#160;")
+        self.assertEqual(parse(expression, "\\1", page, (1,)),
+                         "Caf&eacute; &amp; Bar &#233; & Grill &nbsp;")
+
+    ##################################################################
+    #
+    def test_trim(self):
+        page = "<td> one </td><td> two </td>"
+        expression = "<td>(.*?)</td><td>(.*?)</td>"
+
+        # A group that is cleaned is stripped anyway.
+        #
+        self.assertEqual(self.check(expression, "[\\1]", page), "[one]")
+        self.assertEqual(parse(expression, "[\\1]", page, trim = (1,)),
+                         "[one]")
+
+        # One that is not is now trimmed when the step asks for it, where
+        # it never was before.
+        #
+        self.assertEqual(self.check(expression, "[\\1][\\2]", page, (1, 2)),
+                         "[ one ][ two ]")
+        self.assertEqual(parse(expression, "[\\1][\\2]", page, (1, 2), (2,)),
+                         "[ one ][two]")
+
+    ##################################################################
+    #
+    def test_ninth_group_is_cleaned(self):
+        # Only \1 to \8 had markers put around them, though 'noclean'
+        # took 1 to 9. Now \9 is cleaned like the rest.
+        #
+        page = "".join("<td><b>%d</b></td>" % i for i in range(1, 10))
+        expression = "<td>(.*?)</td>" * 9
+        output = "".join("\\%d," % i for i in range(1, 10))
+        match = re.search(expression, page)
+        self.assertEqual(old_expand(match, output),
+                         "1,2,3,4,5,6,7,8,<b>9</b>,")
+        self.assertEqual(parse(expression, output, page),
+                         "1,2,3,4,5,6,7,8,9,")
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
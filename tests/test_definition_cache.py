@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of the DefinitionCache: a definition compiled once is loaded
+from it after that, and a file in it that is corrupt, cut short, or
+written by another version of the module is ignored and the
+definition compiled from its XML again. Run them from the top of the
+source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import os
+import shutil
+import cPickle
+import tempfile
+import unittest
+
+#
+import scraper
+from scraper import scrap
+
+# A definition with a setting, and a function whose results depend on
+# it, so that we can tell that the settings came back too.
+#
+DEFINITION_XML = """<scraper name="cached" content="movies">
+<GetSettings dest="3">
+  <RegExp input="" output="&lt;settings&gt;&lt;setting label=&quot;Region&quot; type=&quot;text&quot; id=&quot;region&quot; default=&quot;us&quot;&gt;&lt;/setting&gt;&lt;/settings&gt;" dest="3">
+    <expression></expression>
+  </RegExp>
+</GetSettings>
+<GetDetails dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;title region=&quot;$INFO[region]&quot;&gt;\\1&lt;/title&gt;&lt;/details&gt;" dest="3">
+    <expression>title=([^;]*)</expression>
+  </RegExp>
+</GetDetails>
+</scraper>
+"""
+PAGE = "title=The Matrix;"
+DETAILS = '<details><title region="us">The Matrix</title></details>'
+
+##################################################################
+##################################################################
+#
+class TestDefinitionCache(unittest.TestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = scraper.DefinitionCache(os.path.join(self.directory,
+                                                          "definitions"))
+        self.path = os.path.join(self.cache.directory,
+                                 self.cache.key(DEFINITION_XML))
+
+        # We count the definitions that are compiled from their XML.
+        #
+        self.compiles = 0
+        self.compile = scraper.ScraperParser.compile
+        def compile(parser):
+            self.compiles += 1
+            return self.compile(parser)
+        scraper.ScraperParser.compile = compile
+        self.engine_version = scrap.ENGINE_VERSION
+
+    ##################################################################
+    #
+    def tearDown(self):
+        scraper.ScraperParser.compile = self.compile
+        scrap.ENGINE_VERSION = self.engine_version
+        shutil.rmtree(self.directory)
+
+    ##################################################################
+    #
+    def scraper(self):
+        """
+        Return a Scraper for our definition that uses our cache, having
+        checked that it works.
+        """
+        s = scraper.Scraper(DEFINITION_XML, definition_cache = self.cache)
+        self.assertTrue("region" in s.settings.ids)
+        self.assertEqual(s.parse("GetDetails", [PAGE]), DETAILS)
+        return s
+
+    ##################################################################
+    #
+    def test_compiled_once(self):
+        self.assertEqual(self.cache.get(DEFINITION_XML), None)
+        self.scraper()
+        self.assertEqual(self.compiles, 1)
+        self.assertTrue(os.path.exists(self.path))
+        self.scraper()
+        self.scraper()
+        self.assertEqual(self.compiles, 1)
+
+        # Only the one file, with no temporary files left behind.
+        #
+        self.assertEqual(os.listdir(self.cache.directory),
+                         [self.cache.key(DEFINITION_XML)])
+
+    ##################################################################
+    #
+    def test_changed_definition_is_compiled(self):
+        self.scraper()
+        changed = DEFINITION_XML.replace('default=&quot;us&quot;',
+                                         'default=&quot;uk&quot;')
+        s = scraper.Scraper(changed, definition_cache = self.cache)
+        self.assertEqual(self.compiles, 2)
+        self.assertEqual(s.parse("GetDetails", [PAGE]),
+                         DETAILS.replace('"us"', '"uk"'))
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+
+    ##################################################################
+    #
+    def check_fallback(self):
+        """
+        Check that what is in our cache's file is not used: the
+        definition is compiled from its XML again, and the file replaced
+        with one that is.
+        """
+        self.assertEqual(self.cache.get(DEFINITION_XML), None)
+        self.compiles = 0
+        self.scraper()
+        self.assertEqual(self.compiles, 1)
+        self.scraper()
+        self.assertEqual(self.compiles, 1)
+
+    ##################################################################
+    #
+    def test_corrupt_file(self):
+        self.scraper()
+        with open(self.path, "wb") as f:
+            f.write("this is not a pickle")
+        self.check_fallback()
+
+    ##################################################################
+    #
+    def test_truncated_file(self):
+        self.scraper()
+        with open(self.path, "rb") as f:
+            data = f.read()
+        with open(self.path, "wb") as f:
+            f.write(data[:len(data) // 2])
+        self.check_fallback()
+
+        with open(self.path, "wb") as f:
+            pass
+        self.check_fallback()
+
+    ##################################################################
+    #
+    def test_stale_pickle(self):
+        # A file in the right place written by an older version of this
+        # module.
+        #
+        self.scraper()
+        with open(self.path, "wb") as f:
+            cPickle.dump((scrap.ENGINE_VERSION - 1,
+                          self.cache.key(DEFINITION_XML),
+                          { "parser" : { }, "settings" : None }), f,
+                         cPickle.HIGHEST_PROTOCOL)
+        self.check_fallback()
+
+        # One for another definition.
+        #
+        with open(self.path, "wb") as f:
+            cPickle.dump((scrap.ENGINE_VERSION, "0" * 40,
+                          { "parser" : { }, "settings" : None }), f,
+                         cPickle.HIGHEST_PROTOCOL)
+        self.check_fallback()
+
+    ##################################################################
+    #
+    def test_engine_version_change(self):
+        self.scraper()
+        scrap.ENGINE_VERSION += 1
+        self.assertEqual(self.cache.get(DEFINITION_XML), None)
+        self.scraper()
+        self.assertEqual(self.compiles, 2)
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+
+        # Each version has a file of its own, so going back to the first
+        # one finds its file again.
+        #
+        scrap.ENGINE_VERSION = self.engine_version
+        self.scraper()
+        self.assertEqual(self.compiles, 2)
+
+    ##################################################################
+    #
+    def test_unwritable_directory(self):
+        # The directory can not be created because there is a file in
+        # its place. We carry on without the cache.
+        #
+        with open(self.cache.directory, "w") as f:
+            f.write("in the way")
+        self.scraper()
+        self.scraper()
+        self.assertEqual(self.compiles, 2)
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,667 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# File: $Id$
+#
+"""
+Tests of the Fetcher, against a stand-in HTTP server on the loopback
+interface. Run them from the top of the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import urlparse
+import zlib
+import gzip
+import StringIO
+import BaseHTTPServer
+import SocketServer
+
+#
+import scraper
+
+# A definition that finds the director on a Russian page, by a label in
+# Cyrillic.
+#
+DIRECTOR_XML = u"""<scraper name="director" content="movies">
+<GetDetails dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;director&gt;\\1&lt;/director&gt;&lt;/details&gt;" dest="3">
+    <expression>Режиссёр: ([^&lt;]*)</expression>
+  </RegExp>
+</GetDetails>
+</scraper>
+""".encode("utf-8")
+
+PAGE = u"<html><body><p>Режиссёр: Андрей Тарковский</p></body></html>"
+DIRECTOR = "<details><director>%s</director></details>" % \
+    u"Андрей Тарковский".encode("ascii", "xmlcharrefreplace")
+
+##################################################################
+##################################################################
+#
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A server that answers every request on a thread of its own, counting
+    how many requests it gets for each path, how many it is answering at
+    the same time and how many connections they come in on.
+    """
+    daemon_threads = True
+
+    ##################################################################
+    #
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           StandInHandler)
+        self.lock = threading.Lock()
+        self.requests = { }
+        self.active = 0
+        self.max_active = 0
+        self.connections = 0
+
+        # The responses we send for a path, other than the default one:
+        # (status, content type, body), and any other headers we send
+        # with them. A response with an ETag is answered with a 304 when
+        # it is asked for with an If-None-Match of that ETag.
+        #
+        self.responses = { }
+        self.headers = { }
+
+        # The (path, request headers, status) of every request we answer,
+        # in the order we answer them.
+        #
+        self.log = []
+
+##################################################################
+##################################################################
+#
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers a GET of '/<path>?delay=<seconds>', after that many seconds,
+    with the response the server has for the path or, if it has none,
+    the text 'page <path>'. Connections are kept alive.
+    """
+    protocol_version = "HTTP/1.1"
+
+    ##################################################################
+    #
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    ##################################################################
+    #
+    def do_GET(self):
+        server = self.server
+        path, ign, query = self.path.partition("?")
+        delay = float(urlparse.parse_qs(query).get("delay", ["0"])[0])
+        with server.lock:
+            server.requests[path] = server.requests.get(path, 0) + 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(delay)
+            status, content_type, body = server.responses.get(
+                path, (200, "text/plain", "page %s" % path[1:]))
+            headers = server.headers.get(path, { })
+            etag = headers.get("ETag")
+            if etag is not None and \
+                    self.headers.getheader("If-None-Match") == etag:
+                status, body = 304, ""
+            with server.lock:
+                server.log.append((path, dict(self.headers.items()), status))
+            self.send_response(status)
+            for name, value in sorted(headers.items()):
+                self.send_header(name, value)
+            if status != 304:
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    ##################################################################
+    #
+    def log_message(self, format, *args):
+        return
+
+##################################################################
+##################################################################
+#
+class FetcherTestCase(unittest.TestCase):
+    """
+    Starts a StandInServer and a Fetcher that talks to it, without going
+    through any proxy, for each test.
+    """
+
+    WORKERS = 6
+    PER_HOST = 2
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.server = StandInServer()
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.fetcher = scraper.Fetcher(
+            workers = self.WORKERS, per_host = self.PER_HOST,
+            session = scraper.HTTPSession(proxies = { }))
+
+    ##################################################################
+    #
+    def tearDown(self):
+        self.fetcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    ##################################################################
+    #
+    def url(self, path, delay = 0, cache = None, named_cache = None):
+        """
+        Return a ScrapeURL of the given path on our server, that takes
+        `delay` seconds to answer.
+
+        Arguments:
+        - `path`: The path, ie: '/credits'
+        - `delay`: How many seconds the server waits before it answers.
+        - `cache`: The 'cache' attribute of the <url>, if any.
+        - `named_cache`: The dict the scraper keeps named responses in.
+        """
+        url = "http://127.0.0.1:%d%s?delay=%s" % (self.server.server_port,
+                                                  path, delay)
+        if cache is not None:
+            url = '<url cache="%s">%s</url>' % (cache,
+                                                url.replace("&", "&amp;"))
+        if named_cache is None:
+            named_cache = { }
+        return scraper.ScrapeURL(url, named_cache, fetcher = self.fetcher)
+
+##################################################################
+##################################################################
+#
+class TestFetchAll(FetcherTestCase):
+
+    ##################################################################
+    #
+    def test_results_are_in_order(self):
+        # The first url is the slowest to answer, the last the fastest.
+        #
+        urls = [self.url("/%d" % i, delay = 0.05 * (5 - i))
+                for i in range(6)]
+        self.assertEqual(self.fetcher.fetch_all(urls),
+                         ["page %d" % i for i in range(6)])
+
+    ##################################################################
+    #
+    def test_per_host_limit(self):
+        urls = [self.url("/%d" % i, delay = 0.2) for i in range(6)]
+        self.fetcher.fetch_all(urls)
+        self.assertEqual(self.server.max_active, self.PER_HOST)
+        self.assertEqual(sum(self.server.requests.values()), 6)
+
+    ##################################################################
+    #
+    def test_shared_cache_key_is_fetched_once(self):
+        # Like IMDb's GetMovieCast, GetMovieDirectors and GetMovieWriters,
+        # which all want "$$2-credits.html".
+        #
+        named_cache = { }
+        urls = [self.url("/credits", delay = 0.2, cache = "tt1-credits.html",
+                         named_cache = named_cache) for i in range(3)]
+        self.assertEqual(self.fetcher.fetch_all(urls), ["page credits"] * 3)
+        self.assertEqual(self.server.requests, { "/credits" : 1 })
+        self.assertEqual(named_cache, { "tt1-credits.html" : "page credits" })
+
+    ##################################################################
+    #
+    def test_same_request_is_made_once(self):
+        urls = [self.url("/same", delay = 0.2) for i in range(3)] + \
+            [self.url("/other", delay = 0.2)]
+        self.assertEqual(self.fetcher.fetch_all(urls),
+                         ["page same"] * 3 + ["page other"])
+        self.assertEqual(self.server.requests, { "/same" : 1, "/other" : 1 })
+
+    ##################################################################
+    #
+    def test_failure_reaches_every_waiter(self):
+        self.server.responses["/broken"] = (500, "text/plain", "broken")
+        urls = [self.url("/broken", delay = 0.2) for i in range(3)]
+        self.assertRaises(scraper.FetchFailed, self.fetcher.fetch_all, urls)
+        self.assertEqual(self.server.requests, { "/broken" : 1 })
+        self.assertEqual(self.fetcher.in_flight, { })
+
+##################################################################
+##################################################################
+#
+class TestCharsets(FetcherTestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        FetcherTestCase.setUp(self)
+        self.server.responses["/declared"] = (
+            200, "text/html; charset=windows-1251", PAGE.encode("windows-1251"))
+        self.server.responses["/meta"] = (
+            200, "text/html",
+            '<meta http-equiv="Content-Type" '
+            'content="text/html; charset=koi8-r">' + PAGE.encode("koi8-r"))
+        self.server.responses["/unknown"] = (
+            200, "application/octet-stream", PAGE.encode("windows-1251"))
+        self.scraper = scraper.Scraper(DIRECTOR_XML)
+
+    ##################################################################
+    #
+    def fetch_twice(self, path):
+        """
+        Fetch the given path, and then fetch it again from our cache.
+        Return the two contents.
+        """
+        first = self.url(path).get()
+        second = self.url(path).get()
+        self.assertEqual(self.server.requests, { path : 1 })
+        return first, second
+
+    ##################################################################
+    #
+    def check_cached(self, cache):
+        self.fetcher.cache = cache
+        for page in self.fetch_twice("/declared"):
+            self.assertTrue(isinstance(page, unicode))
+            self.assertEqual(page, PAGE)
+            self.assertEqual(self.scraper.parse("GetDetails", [page]),
+                             DIRECTOR)
+
+        # What is cached is the bytes we were sent, and their charset.
+        #
+        body, charset = cache.get(self.fetcher.request_key(
+                self.url("/declared")))
+        self.assertEqual(body, PAGE.encode("windows-1251"))
+        self.assertEqual(charset, "windows-1251")
+
+    ##################################################################
+    #
+    def test_declared_charset_is_decoded_after_memory_cache(self):
+        self.check_cached(scraper.MemoryCache())
+
+    ##################################################################
+    #
+    def test_declared_charset_is_decoded_after_disk_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = scraper.DiskCache(os.path.join(directory, "cache.db"))
+            self.check_cached(cache)
+            cache.close()
+        finally:
+            shutil.rmtree(directory)
+
+    ##################################################################
+    #
+    def test_meta_charset_is_decoded(self):
+        page = self.url("/meta").get()
+        self.assertTrue(isinstance(page, unicode))
+        self.assertEqual(self.scraper.parse("GetDetails", [page]), DIRECTOR)
+
+    ##################################################################
+    #
+    def test_unknown_charset_is_left_as_bytes(self):
+        page = self.url("/unknown").get()
+        self.assertEqual(page, PAGE.encode("windows-1251"))
+
+##################################################################
+##################################################################
+#
+class TestRevalidation(FetcherTestCase):
+    """
+    An expired response that has an ETag or Last-Modified is asked for
+    again with a conditional GET, and a 304 reuses what we have.
+    """
+
+    ##################################################################
+    #
+    def setUp(self):
+        FetcherTestCase.setUp(self)
+        self.server.responses["/tagged"] = (
+            200, "text/html; charset=windows-1251", PAGE.encode("windows-1251"))
+        self.server.headers["/tagged"] = {
+            "ETag" : '"v1"',
+            "Last-Modified" : "Sat, 01 Jan 2011 00:00:00 GMT" }
+        self.fetcher.ttl = 0
+
+    ##################################################################
+    #
+    def check_revalidated(self, cache):
+        self.fetcher.cache = cache
+        first = self.url("/tagged").get()
+        second = self.url("/tagged").get()
+        self.assertEqual([status for path, headers, status in self.server.log],
+                         [200, 304])
+
+        # The second request was conditional on what the first one got.
+        #
+        headers = self.server.log[1][1]
+        self.assertEqual(headers.get("if-none-match"), '"v1"')
+        self.assertEqual(headers.get("if-modified-since"),
+                         "Sat, 01 Jan 2011 00:00:00 GMT")
+
+        # The body we had, in the charset we had it in, is used again.
+        #
+        self.assertTrue(isinstance(second, unicode))
+        self.assertEqual(first, PAGE)
+        self.assertEqual(second, first)
+
+    ##################################################################
+    #
+    def test_memory_cache(self):
+        self.check_revalidated(scraper.MemoryCache())
+
+    ##################################################################
+    #
+    def test_disk_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = scraper.DiskCache(os.path.join(directory, "cache.db"))
+            self.check_revalidated(cache)
+            cache.close()
+        finally:
+            shutil.rmtree(directory)
+
+    ##################################################################
+    #
+    def test_changed_response_is_used(self):
+        self.fetcher.cache = scraper.MemoryCache()
+        self.assertEqual(self.url("/tagged").get(), PAGE)
+        self.server.responses["/tagged"] = (200, "text/plain", "changed")
+        self.server.headers["/tagged"] = { "ETag" : '"v2"' }
+        self.assertEqual(self.url("/tagged").get(), "changed")
+        self.assertEqual([status for path, headers, status in self.server.log],
+                         [200, 200])
+
+# A TV show definition for our StandInServer, with its address filled
+# in: a search for anything finds '/details', whose episode guide is
+# '/guide', which lists an episode on each line as '<number> <title>'.
+# The details of episode <number> are at '/episode<number>', which is
+# just its title.
+#
+SHOW_XML = """<scraper name="standin" content="tvshows">
+<CreateSearchUrl dest="3">
+  <RegExp input="$$1" output="&lt;url&gt;%(base)s/search&lt;/url&gt;" dest="3">
+    <expression/>
+  </RegExp>
+</CreateSearchUrl>
+<GetSearchResults dest="8">
+  <RegExp input="$$1" output="&lt;results&gt;&lt;entity&gt;&lt;title&gt;Show&lt;/title&gt;&lt;url&gt;%(base)s/details&lt;/url&gt;&lt;/entity&gt;&lt;/results&gt;" dest="8">
+    <expression/>
+  </RegExp>
+</GetSearchResults>
+<GetDetails dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;title&gt;Show&lt;/title&gt;&lt;episodeguide&gt;&lt;url&gt;%(base)s/guide&lt;/url&gt;&lt;/episodeguide&gt;&lt;/details&gt;" dest="3">
+    <expression/>
+  </RegExp>
+</GetDetails>
+<GetEpisodeList dest="3">
+  <RegExp input="$$5" output="&lt;episodeguide&gt;\\1&lt;/episodeguide&gt;" dest="3">
+    <RegExp input="$$1" output="&lt;episode&gt;&lt;title&gt;\\2&lt;/title&gt;&lt;epnum&gt;\\1&lt;/epnum&gt;&lt;season&gt;1&lt;/season&gt;&lt;url&gt;%(base)s/episode\\1&lt;/url&gt;&lt;/episode&gt;" dest="5">
+      <expression repeat="yes">(\\d+) ([^\\n]*)</expression>
+    </RegExp>
+    <expression noclean="1"/>
+  </RegExp>
+</GetEpisodeList>
+<GetEpisodeDetails dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;title&gt;\\1&lt;/title&gt;&lt;/details&gt;" dest="3">
+    <expression>(.*)</expression>
+  </RegExp>
+</GetEpisodeDetails>
+</scraper>
+"""
+
+##################################################################
+##################################################################
+#
+class TestEpisodeListRefresh(FetcherTestCase):
+    """
+    Series.get_episode_list(refresh = True) revalidates the episode guide
+    and keeps the Episodes it already has for what has not changed.
+    """
+
+    ##################################################################
+    #
+    def setUp(self):
+        FetcherTestCase.setUp(self)
+        self.fetcher.cache = scraper.MemoryCache()
+        self.fetcher.ttl = 0
+        self.server.responses["/guide"] = (200, "text/plain",
+                                           "1 Pilot\n2 Second")
+        self.server.headers["/guide"] = { "ETag" : '"v1"' }
+        base = "http://127.0.0.1:%d" % self.server.server_port
+        s = scraper.Scraper(SHOW_XML % { "base" : base },
+                            fetcher = self.fetcher)
+        self.series = s.lookup("Show")[0]
+        self.series.get_details()
+
+    ##################################################################
+    #
+    def guide_statuses(self):
+        return [status for path, headers, status in self.server.log
+                if path == "/guide"]
+
+    ##################################################################
+    #
+    def test_unchanged_guide_keeps_episodes(self):
+        before = self.series.get_episode_list()
+        self.assertEqual([episode.title for episode in before],
+                         ["Pilot", "Second"])
+        after = self.series.get_episode_list(refresh = True)
+        self.assertEqual(self.guide_statuses(), [200, 304])
+        self.assertEqual(len(after), 2)
+        for old, new in zip(before, after):
+            self.assertTrue(old is new)
+
+    ##################################################################
+    #
+    def test_changed_guide_keeps_unchanged_episodes(self):
+        before = self.series.get_episode_list()
+        self.server.responses["/guide"] = (200, "text/plain",
+                                           "1 Pilot\n2 Renamed\n3 Third")
+        self.server.headers["/guide"] = { "ETag" : '"v2"' }
+        after = self.series.get_episode_list(refresh = True)
+        self.assertEqual(self.guide_statuses(), [200, 200])
+        self.assertEqual([episode.title for episode in after],
+                         ["Pilot", "Renamed", "Third"])
+        self.assertTrue(after[0] is before[0])
+        self.assertFalse(after[1] is before[1])
+
+    ##################################################################
+    #
+    def test_episode_details_are_refreshed_when_asked(self):
+        self.server.responses["/episode1"] = (200, "text/plain", "Pilot")
+        episode = self.series.get_episode_list()[0]
+        self.assertEqual(episode.get_details().title, "Pilot")
+
+        self.server.responses["/episode1"] = (200, "text/plain", "Renamed")
+        self.assertEqual(episode.get_details().title, "Pilot")
+        self.assertEqual(self.server.requests["/episode1"], 1)
+        self.assertEqual(episode.get_details(refresh = True).title,
+                         "Renamed")
+        self.assertEqual(self.server.requests["/episode1"], 2)
+
+####################################################################
+#
+def gzipped(data):
+    """
+    Return the given data compressed the way a 'Content-Encoding: gzip'
+    response body is.
+
+    Arguments:
+    - `data`: The string to compress.
+    """
+    out = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj = out, mode = "wb")
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+####################################################################
+#
+def deflated(data, raw = False):
+    """
+    Return the given data compressed the way a 'Content-Encoding:
+    deflate' response body is: a zlib stream or, the way some servers
+    send it, a raw deflate stream.
+
+    Arguments:
+    - `data`: The string to compress.
+    - `raw`: If True the stream has no zlib header.
+    """
+    if not raw:
+        return zlib.compress(data)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+##################################################################
+##################################################################
+#
+class TestHTTPSession(FetcherTestCase):
+    """
+    The HTTPSession under the Fetcher: keeping connections alive,
+    uncompressing what it is sent and spooling zip archives.
+    """
+
+    # A body that compresses well, and is bigger than the chunks a
+    # spooled response is read in.
+    #
+    BODY = "".join("line %d of a page\n" % i for i in range(20000))
+
+    ##################################################################
+    #
+    def setUp(self):
+        FetcherTestCase.setUp(self)
+        self.session = self.fetcher.session
+
+    ##################################################################
+    #
+    def open(self, path):
+        """
+        Return the response to a GET of the given path on our server.
+        """
+        return self.session.open("GET", "http://127.0.0.1:%d%s" % \
+                                     (self.server.server_port, path))
+
+    ##################################################################
+    #
+    def serve(self, path, body, encoding = None,
+              content_type = "text/plain"):
+        """
+        Have our server answer the given path with the given body, sent
+        with the given Content-Encoding.
+        """
+        self.server.responses[path] = (200, content_type, body)
+        if encoding is not None:
+            self.server.headers[path] = { "Content-Encoding" : encoding }
+        return
+
+    ##################################################################
+    #
+    def test_connection_is_reused(self):
+        for i in range(5):
+            self.assertEqual(self.open("/%d" % i).body, "page %d" % i)
+        self.assertEqual(self.server.connections, 1)
+
+    ##################################################################
+    #
+    def test_closed_connection_is_not_reused(self):
+        for i in range(3):
+            self.server.headers["/%d" % i] = { "Connection" : "close" }
+            self.assertEqual(self.open("/%d" % i).body, "page %d" % i)
+        self.assertEqual(self.server.connections, 3)
+
+    ##################################################################
+    #
+    def test_idle_connection_closed_by_server_is_replaced(self):
+        self.assertEqual(self.open("/1").body, "page 1")
+
+        # Shut the connection we are keeping down, as a server that
+        # timed it out would have.
+        #
+        for conns in self.session.idle.values():
+            for conn in conns:
+                conn.sock.shutdown(2)
+        self.assertEqual(self.open("/2").body, "page 2")
+        self.assertEqual(self.server.connections, 2)
+
+    ##################################################################
+    #
+    def test_compression_is_asked_for(self):
+        self.open("/1")
+        path, headers, status = self.server.log[0]
+        self.assertEqual(headers["accept-encoding"], "gzip, deflate")
+
+    ##################################################################
+    #
+    def test_compressed_bodies_are_uncompressed(self):
+        self.serve("/gzip", gzipped(self.BODY), "gzip")
+        self.serve("/deflate", deflated(self.BODY), "deflate")
+        self.serve("/raw", deflated(self.BODY, raw = True), "deflate")
+        self.serve("/identity", self.BODY, "identity")
+        for path in ("/gzip", "/deflate", "/raw", "/identity"):
+            self.assertEqual(self.open(path).body, self.BODY, path)
+
+        # Through the Fetcher, and on the one connection.
+        #
+        self.assertEqual(self.url("/gzip").get(), self.BODY)
+        self.assertEqual(self.server.connections, 1)
+
+    ##################################################################
+    #
+    def test_bad_compressed_body_fails(self):
+        self.serve("/gzip", "not gzip at all", "gzip")
+        self.assertRaises(scraper.FetchFailed, self.open, "/gzip")
+
+        # The connection is still good for the next request.
+        #
+        self.assertEqual(self.open("/1").body, "page 1")
+
+    ##################################################################
+    #
+    def test_zip_is_spooled(self):
+        # Small enough to stay in memory, and big enough to go to disk.
+        #
+        self.session.SPOOL_BYTES = 64 * 1024
+        self.session.CHUNK_BYTES = 4 * 1024
+        for path, size in (("/small", 1000), ("/big", len(self.BODY))):
+            self.serve(path, self.BODY[:size],
+                       content_type = "application/zip")
+            body = self.open(path).body
+            self.assertFalse(isinstance(body, str))
+            self.assertEqual(body._rolled, size > self.session.SPOOL_BYTES)
+            self.assertEqual(body.read(), self.BODY[:size])
+            body.close()
+
+    ##################################################################
+    #
+    def test_compressed_zip_is_uncompressed_as_it_is_spooled(self):
+        self.session.CHUNK_BYTES = 4 * 1024
+        for path, body, encoding in (
+            ("/gzip", gzipped(self.BODY), "gzip"),
+            ("/deflate", deflated(self.BODY), "deflate"),
+            ("/raw", deflated(self.BODY, raw = True), "deflate")):
+            self.serve(path, body, encoding, "application/zip")
+            spooled = self.open(path).body
+            self.assertEqual(spooled.read(), self.BODY, path)
+            spooled.close()
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of a Movie's lazy fields: the custom functions that fill each one
+in are only run when it is first read, or when the caller of
+get_details() or lookup_one() asks for it. Run them from the top of the
+source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import unittest
+
+#
+import scraper
+
+# A movie definition whose details call custom functions through others
+# that are named differently from any of the Movie's handlers: the plot
+# comes from GetMoviePlot by way of FindPlot, and the fanart from
+# GetTMDBFanart by way of FindFanart. The directors come straight from
+# GetMovieDirectors, and GetMovieCast fills in none of the lazy fields.
+#
+MOVIE_XML = """<scraper name="lazy" content="movies">
+<CreateSearchUrl dest="3">
+  <RegExp input="$$1" output="http://test/search/\\1" dest="3">
+    <expression noclean="1">(.*)</expression>
+  </RegExp>
+</CreateSearchUrl>
+<GetSearchResults dest="8">
+  <RegExp input="$$1" output="&lt;results&gt;&lt;entity&gt;&lt;title&gt;\\1&lt;/title&gt;&lt;id&gt;1&lt;/id&gt;&lt;url&gt;http://test/details&lt;/url&gt;&lt;/entity&gt;&lt;/results&gt;" dest="8">
+    <expression>title=([^;]*)</expression>
+  </RegExp>
+</GetSearchResults>
+<GetDetails dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;title&gt;\\1&lt;/title&gt;&lt;plot&gt;Short.&lt;/plot&gt;&lt;url function=&quot;FindPlot&quot;&gt;http://test/plot&lt;/url&gt;&lt;url function=&quot;FindFanart&quot;&gt;http://test/tmdbid&lt;/url&gt;&lt;url function=&quot;GetMovieDirectors&quot;&gt;http://test/directors&lt;/url&gt;&lt;url function=&quot;GetMovieCast&quot;&gt;http://test/cast&lt;/url&gt;&lt;/details&gt;" dest="3">
+    <expression>title=([^;]*)</expression>
+  </RegExp>
+</GetDetails>
+<FindPlot dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;url function=&quot;GetMoviePlot&quot;&gt;http://test/\\1&lt;/url&gt;&lt;/details&gt;" dest="3">
+    <expression>page=([^;]*)</expression>
+  </RegExp>
+</FindPlot>
+<GetMoviePlot dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;plot&gt;\\1&lt;/plot&gt;&lt;/details&gt;" dest="3">
+    <expression>plot=([^;]*)</expression>
+  </RegExp>
+</GetMoviePlot>
+<FindFanart dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;url function=&quot;GetTMDBFanart&quot;&gt;http://test/fanart/\\1&lt;/url&gt;&lt;/details&gt;" dest="3">
+    <expression>id=([^;]*)</expression>
+  </RegExp>
+</FindFanart>
+<GetTMDBFanart dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;fanart url=&quot;http://images/&quot;&gt;&lt;thumb&gt;\\1&lt;/thumb&gt;&lt;/fanart&gt;&lt;/details&gt;" dest="3">
+    <expression>thumb=([^;]*)</expression>
+  </RegExp>
+</GetTMDBFanart>
+<GetMovieDirectors dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;director&gt;\\1&lt;/director&gt;&lt;/details&gt;" dest="3">
+    <expression>director=([^;]*)</expression>
+  </RegExp>
+</GetMovieDirectors>
+<GetMovieCast dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;actor&gt;\\1&lt;/actor&gt;&lt;/details&gt;" dest="3">
+    <expression>actor=([^;]*)</expression>
+  </RegExp>
+</GetMovieCast>
+</scraper>
+"""
+
+# What each of the definition's urls returns.
+#
+PAGES = {
+    "http://test/search/the+matrix" : "title=The Matrix;",
+    "http://test/details"           : "title=The Matrix;",
+    "http://test/plot"              : "page=fullplot;",
+    "http://test/fullplot"          : "plot=Neo takes the red pill.;",
+    "http://test/tmdbid"            : "id=603;",
+    "http://test/fanart/603"        : "thumb=matrix.jpg;",
+    "http://test/directors"         : "director=Lana Wachowski;",
+    "http://test/cast"              : "actor=Keanu Reeves;",
+    }
+
+# The urls each lazy field is filled in from.
+#
+PLOT_URLS = ["http://test/plot", "http://test/fullplot"]
+FANART_URLS = ["http://test/tmdbid", "http://test/fanart/603"]
+DIRECTORS_URLS = ["http://test/directors"]
+LOOKUP_URLS = ["http://test/search/the+matrix", "http://test/details"]
+
+##################################################################
+##################################################################
+#
+class PageFetcher(scraper.Fetcher):
+    """
+    A Fetcher that gets its pages from PAGES instead of the network, and
+    keeps the list of the urls it was asked for.
+    """
+
+    ##################################################################
+    #
+    def __init__(self):
+        scraper.Fetcher.__init__(self, workers = 1)
+        self.fetched = []
+
+    ##################################################################
+    #
+    def fetch(self, url, revalidate = False):
+        self.fetched.append(url.url)
+        return PAGES[url.url]
+
+##################################################################
+##################################################################
+#
+class TestLazyFields(unittest.TestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.fetcher = PageFetcher()
+        self.scraper = scraper.Scraper(MOVIE_XML, fetcher = self.fetcher,
+                                       definition_cache = None)
+
+    ##################################################################
+    #
+    def movie(self, fields = None):
+        """
+        Return the movie our definition finds, with its details gotten
+        for the given fields.
+        """
+        movie = self.scraper.lookup("The Matrix")[0]
+        movie.get_details(fields)
+        return movie
+
+    ##################################################################
+    #
+    def assertFetched(self, urls):
+        """
+        Check that the urls fetched since we last checked are the given
+        ones, in any order.
+        """
+        self.assertEqual(sorted(self.fetcher.fetched), sorted(urls))
+        self.fetcher.fetched = []
+
+    ##################################################################
+    #
+    def test_field_functions_follow_the_definition(self):
+        movie = self.movie()
+        self.assertEqual(movie.field_functions(),
+                         { "plot"      : set(["findplot", "getmovieplot"]),
+                           "fanart"    : set(["findfanart", "gettmdbfanart"]),
+                           "directors" : set(["getmoviedirectors"]) })
+
+    ##################################################################
+    #
+    def test_field_is_resolved_on_first_read(self):
+        movie = self.movie()
+        self.assertFetched(LOOKUP_URLS)
+        self.assertEqual(movie.title, "The Matrix")
+        self.assertEqual(movie.year, None)
+        self.assertFetched([])
+
+        self.assertEqual(movie.plot, "Neo takes the red pill.")
+        self.assertFetched(PLOT_URLS)
+        self.assertEqual(movie.plot, "Neo takes the red pill.")
+        self.assertFetched([])
+
+        self.assertEqual(movie.fanart, ["http://images/matrix.jpg"])
+        self.assertFetched(FANART_URLS)
+        self.assertEqual(movie.directors, ["Lana Wachowski"])
+        self.assertFetched(DIRECTORS_URLS)
+
+        # Reading them all again runs nothing, and what is left over is
+        # only run when every field is asked for.
+        #
+        self.assertEqual(movie.fanart, ["http://images/matrix.jpg"])
+        self.assertEqual(movie.directors, ["Lana Wachowski"])
+        self.assertEqual(movie.writers, [])
+        self.assertFetched([])
+        movie.resolve()
+        self.assertFetched(["http://test/cast"])
+
+    ##################################################################
+    #
+    def test_field_is_missing_before_details(self):
+        movie = self.scraper.lookup("The Matrix")[0]
+        self.assertRaises(AttributeError, getattr, movie, "plot")
+        self.assertFetched(["http://test/search/the+matrix"])
+
+    ##################################################################
+    #
+    def test_details_resolve_the_fields_asked_for(self):
+        movie = self.movie(["fanart", "directors"])
+        self.assertFetched(LOOKUP_URLS + FANART_URLS + DIRECTORS_URLS)
+        self.assertEqual(movie.fanart, ["http://images/matrix.jpg"])
+        self.assertEqual(movie.directors, ["Lana Wachowski"])
+        self.assertFetched([])
+        self.assertEqual(movie.plot, "Neo takes the red pill.")
+        self.assertFetched(PLOT_URLS)
+
+    ##################################################################
+    #
+    def test_as_dict_resolves_every_field(self):
+        movie = self.movie()
+        self.fetcher.fetched = []
+        result = movie.as_dict()
+        self.assertFetched(PLOT_URLS + FANART_URLS + DIRECTORS_URLS +
+                           ["http://test/cast"])
+        self.assertEqual(result["plot"], "Neo takes the red pill.")
+        self.assertEqual(result["directors"], ["Lana Wachowski"])
+
+    ##################################################################
+    #
+    def test_lookup_one_runs_only_the_functions_of_its_fields(self):
+        # What the 'batch' command's --fields asks for.
+        #
+        result = self.scraper.lookup_one("The Matrix", ["title", "plot"])
+        self.assertEqual(result["show"], { "title" : "The Matrix",
+                                           "plot" : "Neo takes the red pill." })
+        self.assertFetched(LOOKUP_URLS + PLOT_URLS)
+
+        # Fields we know from the lookup do not even get the details.
+        #
+        result = self.scraper.lookup_one("The Matrix", ["title", "id"])
+        self.assertEqual(result["show"], { "title" : "The Matrix",
+                                           "id" : "1" })
+        self.assertFetched(["http://test/search/the+matrix"])
+
+        result = self.scraper.lookup_one("The Matrix")
+        self.assertEqual(result["show"]["fanart"], ["http://images/matrix.jpg"])
+        self.assertFetched(LOOKUP_URLS + PLOT_URLS + FANART_URLS +
+                           DIRECTORS_URLS + ["http://test/cast"])
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of Scraper.lookup_many() stopping workers that are stuck in an
+expression. Run them from the top of the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import time
+import unittest
+
+#
+import scraper
+
+# A definition whose search url takes forever to make for a title of
+# 'a's, since its expression backtracks through every way of splitting
+# them up. Any other title fails, straight away, with an empty url.
+#
+BACKTRACKING_XML = """<scraper name="backtracking" content="movies">
+<CreateSearchUrl dest="3">
+  <RegExp input="$$1" output="\\1" dest="3">
+    <expression>^((a+)+b|)</expression>
+  </RegExp>
+</CreateSearchUrl>
+<GetSearchResults dest="8">
+  <RegExp input="$$1" output="&lt;results&gt;&lt;/results&gt;" dest="8">
+    <expression>(.*)</expression>
+  </RegExp>
+</GetSearchResults>
+<GetDetails dest="3">
+  <RegExp input="$$1" output="&lt;details&gt;&lt;/details&gt;" dest="3">
+    <expression>(.*)</expression>
+  </RegExp>
+</GetDetails>
+</scraper>
+"""
+
+##################################################################
+##################################################################
+#
+class TestStuckWorkers(unittest.TestCase):
+
+    ##################################################################
+    #
+    def test_stuck_worker_is_killed_and_replaced(self):
+        s = scraper.Scraper(BACKTRACKING_XML)
+        s.parser.function_budget = 1
+        s.WORKER_GRACE = 0.5
+        s.WORKER_POLL = 0.1
+
+        start = time.time()
+        titles = ["a" * 40, "fine", "a" * 40, "fine", "fine"]
+        results = dict((r["index"], r) for r in s.lookup_many(titles,
+                                                              workers = 2))
+        self.assertTrue(time.time() - start < 10)
+
+        self.assertEqual(sorted(results), range(len(titles)))
+        for index, title in enumerate(titles):
+            self.assertEqual(results[index]["query"], title)
+            if title == "fine":
+                self.assertFalse("ParseTimeout" in results[index]["error"])
+            else:
+                self.assertTrue(results[index]["error"].startswith(
+                        "ParseTimeout"))
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of running the functions of one Scraper on many threads at the
+same time: each call must return what it does when the calls are made
+one after the other. Run them from the top of the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import threading
+import unittest
+
+#
+import scraper
+from benchmark import bench
+
+# How many threads call the scraper at once, and how many times each
+# one makes every call.
+#
+THREADS = 8
+ROUNDS = 3
+
+# A definition whose expressions are made from its buffers and whose
+# steps append to and compare buffers (which lower cases them), so that
+# calls that shared any of that would get each other's results.
+#
+BUFFERS_XML = """<scraper name="buffers" content="movies">
+<GetDetails dest="3">
+  <RegExp input="$$5" output="&lt;details&gt;\\1&lt;/details&gt;" dest="3">
+    <RegExp input="$$1" output="&lt;title&gt;\\1&lt;/title&gt;" dest="5">
+      <expression>$$2=([^;]*)</expression>
+    </RegExp>
+    <RegExp input="$$1" output="&lt;genre&gt;\\1&lt;/genre&gt;" dest="5+">
+      <expression repeat="yes">genre=([^;]*)</expression>
+    </RegExp>
+    <RegExp input="$$1" output="&lt;id&gt;\\1&lt;/id&gt;" dest="5+">
+      <expression compare="3">id=([^;]*)</expression>
+    </RegExp>
+    <expression noclean="1">(.*)</expression>
+  </RegExp>
+</GetDetails>
+</scraper>
+"""
+
+##################################################################
+##################################################################
+#
+class TestParseThreads(unittest.TestCase):
+
+    ##################################################################
+    #
+    def check(self, s, calls):
+        """
+        Make the given calls, a list of (function, buffers), of the given
+        Scraper one after the other and then all at once from THREADS
+        threads, each in its own order, and check that each call returns
+        the same thing every time.
+        """
+        expected = [s.parse(function, buffers) for function, buffers in calls]
+
+        start = threading.Event()
+        results = [None] * THREADS
+        def run(n):
+            order = range(len(calls))
+            order = order[n::2] + order[(n + 1) % 2::2]
+            if n % 3 == 0:
+                order.reverse()
+            got = { }
+            start.wait()
+            try:
+                for i in range(ROUNDS):
+                    for j in order:
+                        got.setdefault(j, []).append(s.parse(*calls[j]))
+            except Exception, e:
+                got = e
+            results[n] = got
+
+        threads = [threading.Thread(target = run, args = (n,))
+                   for n in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        for n, got in enumerate(results):
+            self.assertFalse(isinstance(got, Exception), repr(got))
+            for j, call_results in got.iteritems():
+                self.assertEqual(call_results, [expected[j]] * ROUNDS,
+                                 "thread %d, %s" % (n, calls[j][0]))
+        return expected
+
+    ##################################################################
+    #
+    def test_buffers(self):
+        s = scraper.Scraper(BUFFERS_XML, definition_cache = None)
+        calls = []
+        for i in range(12):
+            page = "name%d=Title %d;genre=A%d;genre=B%d;id=tt%d;" % \
+                (i % 3, i, i, i, i)
+            calls.append(("GetDetails", [page, "name%d" % (i % 3),
+                                         "TT%d" % i]))
+        expected = self.check(s, calls)
+        self.assertEqual(expected[4],
+                         "<details><title>Title 4</title><genre>A4</genre>"
+                         "<genre>B4</genre><id>tt4</id></details>")
+
+    ##################################################################
+    #
+    def test_bundled_definition(self):
+        # Every function of a real definition, over the synthetic pages
+        # the benchmark makes for it.
+        #
+        scraper_xml = scraper.registry.definition("imdb")
+        s = scraper.Scraper(scraper_xml, definition_cache = None)
+        calls = []
+        for name, samples in bench.function_samples(scraper_xml):
+            page = u"\n<br>\n".join(samples)
+            for other in ("12345", "tt0133093"):
+                calls.append((name, [page, other, other]))
+        expected = self.check(s, calls)
+        self.assertTrue(any(expected))
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of the Profiler: its statistics for each <RegExp> a
+ScraperParser runs, its report and its folded stacks (for
+scrape_cli.py's --profile and --flame-graph.) Run them from the top of
+the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+#
+import scraper
+import scrape_cli
+
+# A definition whose steps are on known lines: the outer <RegExp> on
+# line 3, the repeated one nested in it on line 4, the one that appends
+# to its buffer on line 7, and one that is only run if a setting says
+# so on line 10.
+#
+DEFINITION_XML = """<scraper name="profiled" content="movies">
+<GetDetails dest="3">
+  <RegExp input="$$5" output="&lt;details&gt;\\1&lt;/details&gt;" dest="3">
+    <RegExp input="$$1" output="&lt;genre&gt;\\1&lt;/genre&gt;" dest="5">
+      <expression repeat="yes">genre=([^;]*);</expression>
+    </RegExp>
+    <RegExp input="$$1" output="&lt;title&gt;\\1&lt;/title&gt;" dest="5+">
+      <expression>title=([^;]*);</expression>
+    </RegExp>
+    <RegExp input="$$1" output="&lt;id&gt;\\1&lt;/id&gt;" dest="5+" conditional="ids">
+      <expression>id=([^;]*);</expression>
+    </RegExp>
+    <expression noclean="1">(.*)</expression>
+  </RegExp>
+</GetDetails>
+</scraper>
+"""
+PAGE = "title=The Matrix;genre=Action;genre=Sci-Fi;id=tt0133093;"
+DETAILS = "<details><genre>Action</genre><genre>Sci-Fi</genre>" \
+    "<title>The Matrix</title></details>"
+RUNS = 3
+
+# The steps, by path, and their frames in the folded stacks.
+#
+OUTER = "GetDetails/RegExp[1]"
+GENRES = "GetDetails/RegExp[1]/RegExp[1]"
+TITLE = "GetDetails/RegExp[1]/RegExp[2]"
+FRAMES = { OUTER  : "GetDetails;RegExp[1]:3",
+           GENRES : "GetDetails;RegExp[1]:3;RegExp[1]:4",
+           TITLE  : "GetDetails;RegExp[1]:3;RegExp[2]:7" }
+
+##################################################################
+##################################################################
+#
+class ProfiledTestCase(unittest.TestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.parser = scraper.ScraperParser(DEFINITION_XML)
+        self.settings = scraper.Settings(
+            '<settings><setting label="Ids" type="bool" id="ids" '
+            'default="false"/></settings>')
+
+    ##################################################################
+    #
+    def run_parser(self, runs = RUNS):
+        """
+        Run our definition's <GetDetails> over our page the given number
+        of times.
+        """
+        for i in range(runs):
+            self.assertEqual(self.parser.parse("GetDetails", self.settings,
+                                               [PAGE]),
+                             DETAILS)
+
+##################################################################
+##################################################################
+#
+class TestProfiler(ProfiledTestCase):
+
+    ##################################################################
+    #
+    def stats(self, profiler):
+        """
+        Return a dict of the path of each step the given profiler has
+        seen to its calls, input bytes, matches and output bytes.
+        """
+        return dict((step.path, (stats[0], stats[2], stats[3], stats[4]))
+                    for step, stats in profiler.stats.itervalues())
+
+    ##################################################################
+    #
+    def test_step_counts(self):
+        profiler = self.parser.profile(scraper.Profiler())
+        self.run_parser()
+
+        # The step for a setting that is off is not run, and so not
+        # counted. The nested steps are given the page, and the outer
+        # one what they leave in buffer 5.
+        #
+        genres = "<genre>Action</genre><genre>Sci-Fi</genre>"
+        title = "<title>The Matrix</title>"
+        self.assertEqual(self.stats(profiler),
+                         { GENRES : (RUNS, RUNS * len(PAGE), RUNS * 2,
+                                     RUNS * len(genres)),
+                           TITLE  : (RUNS, RUNS * len(PAGE), RUNS,
+                                     RUNS * len(genres + title)),
+                           OUTER  : (RUNS, RUNS * len(genres + title),
+                                     RUNS, RUNS * len(DETAILS)) })
+        for step, stats in profiler.stats.itervalues():
+            self.assertTrue(stats[1] >= 0.0)
+
+        # Turning the setting on counts its step too.
+        #
+        self.settings.set_value("ids", "true")
+        profiler.clear()
+        self.parser.parse("GetDetails", self.settings, [PAGE])
+        stats = self.stats(profiler)
+        self.assertEqual(len(stats), 4)
+        self.assertEqual(stats["GetDetails/RegExp[1]/RegExp[3]"][:3],
+                         (1, len(PAGE), 1))
+
+    ##################################################################
+    #
+    def test_stop_profiling(self):
+        profiler = self.parser.profile(scraper.Profiler())
+        self.run_parser(1)
+        self.assertEqual(self.parser.profile(None), None)
+        self.run_parser()
+        self.assertEqual([stats[0] for step, stats in
+                          profiler.stats.itervalues()], [1, 1, 1])
+        profiler.clear()
+        self.assertEqual(profiler.stats, { })
+
+    ##################################################################
+    #
+    def test_lines(self):
+        self.parser.profile(scraper.Profiler())
+        lines = dict((step.path, step.line) for step in
+                     self.parser.functions["getdetails"].all_steps())
+        self.assertEqual(lines, { OUTER : 3, GENRES : 4, TITLE : 7,
+                                  "GetDetails/RegExp[1]/RegExp[3]" : 10 })
+
+    ##################################################################
+    #
+    def test_report(self):
+        profiler = self.parser.profile(scraper.Profiler())
+        self.run_parser()
+        out = StringIO()
+        profiler.report(out, sort = "output")
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split(),
+                         ["calls", "total", "ms", "ms/call", "input", "bytes",
+                          "matches", "output", "bytes", "step"])
+        self.assertEqual([line.split(None, 6)[6] for line in lines[1:]],
+                         ["%s (line 3)" % OUTER, "%s (line 7)" % TITLE,
+                          "%s (line 4)" % GENRES])
+        self.assertEqual([int(line.split()[0]) for line in lines[1:]],
+                         [RUNS] * 3)
+
+        out = StringIO()
+        profiler.report(out, sort = "matches", limit = 1)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith("%s (line 4)" % GENRES))
+
+    ##################################################################
+    #
+    def test_folded_stacks(self):
+        profiler = self.parser.profile(scraper.Profiler())
+        self.run_parser()
+        out = StringIO()
+        profiler.write_folded(out)
+
+        # One line per step: its frames, outermost first and separated by
+        # semicolons, a space, and its microseconds.
+        #
+        folded = { }
+        for line in out.getvalue().splitlines():
+            m = re.match(r"^([^ ;]+(?:;[^ ;]+)*) ([0-9]+)$", line)
+            self.assertTrue(m, line)
+            folded[m.group(1)] = int(m.group(2))
+        self.assertEqual(sorted(folded), sorted(FRAMES.values()))
+        for step, stats in profiler.stats.itervalues():
+            self.assertEqual(folded[FRAMES[step.path]],
+                             int(round(stats[1] * 1000000)))
+
+    ##################################################################
+    #
+    def test_write_profile(self):
+        # What scrape_cli.py writes for --profile and --flame-graph.
+        #
+        profiler = self.parser.profile(scraper.Profiler())
+        self.run_parser()
+        directory = tempfile.mkdtemp()
+        try:
+            profile_file = os.path.join(directory, "profile.txt")
+            flame_graph_file = os.path.join(directory, "folded.txt")
+            scrape_cli.write_profile(profiler, profile_file,
+                                     flame_graph_file)
+            with open(profile_file) as f:
+                self.assertEqual(len(f.read().splitlines()), 4)
+            with open(flame_graph_file) as f:
+                self.assertEqual(sorted(line.split()[0] for line in f),
+                                 sorted(FRAMES.values()))
+
+            os.remove(profile_file)
+            scrape_cli.write_profile(profiler, None, flame_graph_file)
+            self.assertFalse(os.path.exists(profile_file))
+        finally:
+            shutil.rmtree(directory)
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
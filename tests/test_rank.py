@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# File: $Id$
+#
+"""
+Tests of Scraper.rank(): ordering search results by how well their
+titles, and years, match what was looked up. Run them from the top of
+the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import unittest
+from xml.sax.saxutils import escape
+
+#
+import scraper
+
+# rank() only needs a definition to make a Scraper with.
+#
+MOVIE_XML = """<scraper name="rank" content="movies">
+<CreateSearchUrl dest="3">
+  <RegExp input="$$1" output="http://test/search/\\1" dest="3">
+    <expression noclean="1">(.*)</expression>
+  </RegExp>
+</CreateSearchUrl>
+</scraper>
+"""
+
+####################################################################
+#
+def results(*shows):
+    """
+    Return the <entity> elements of search results for the given shows.
+
+    Arguments:
+    - `shows`: Each one a title, or a (title, year) tuple.
+    """
+    xml = [u"<results>"]
+    for show in shows:
+        if isinstance(show, tuple):
+            xml.append(u"<entity><title>%s</title><year>%s</year></entity>" % \
+                           (escape(show[0]), show[1]))
+        else:
+            xml.append(u"<entity><title>%s</title></entity>" % escape(show))
+    xml.append(u"</results>")
+    return scraper.children(scraper.parse_xml(u"".join(xml).encode("utf-8")),
+                            "entity")
+
+##################################################################
+##################################################################
+#
+class TestRank(unittest.TestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.scraper = scraper.Scraper(MOVIE_XML, definition_cache = None)
+
+    ##################################################################
+    #
+    def rank(self, search_string, entities):
+        """
+        Return the list of the (score, title) of the given search results
+        ranked for the given search string.
+        """
+        return [(round(score, 3), scraper.get_child_data(entity, "title"))
+                for score, entity in self.scraper.rank(search_string,
+                                                       entities)]
+
+    ##################################################################
+    #
+    def titles(self, search_string, entities):
+        """
+        Return the titles of the given search results ranked for the
+        given search string.
+        """
+        return [title for score, title in self.rank(search_string, entities)]
+
+    ##################################################################
+    #
+    def test_best_title_first(self):
+        entities = results("The Matrix Reloaded", "The Matrix",
+                           "Matrix: Resurrections")
+        ranked = self.rank("the matrix", entities)
+        self.assertEqual(ranked[0], (1.0, "The Matrix"))
+        self.assertEqual([title for score, title in ranked[1:]],
+                         ["The Matrix Reloaded", "Matrix: Resurrections"])
+        self.assertTrue(ranked[1][0] > ranked[2][0])
+
+    ##################################################################
+    #
+    def test_case_and_punctuation_do_not_count(self):
+        entities = results("Alien", "ALIENS!", "Alien: Resurrection")
+        self.assertEqual(self.rank("aliens", entities)[0], (1.0, "ALIENS!"))
+        self.assertEqual(self.rank("The.Matrix.DVDRip.XviD",
+                                   results("The Matrix")),
+                         [(1.0, "The Matrix")])
+
+    ##################################################################
+    #
+    def test_ties_keep_the_site_order(self):
+        entities = results("Solaris", "Solaris", "Solaris (1972)",
+                           "Solaris")
+        self.assertEqual(self.rank("solaris", entities),
+                         [(1.0, "Solaris"), (1.0, "Solaris"),
+                          (1.0, "Solaris (1972)"), (1.0, "Solaris")])
+        ranked = self.scraper.rank("solaris", entities)
+        self.assertEqual([entity for score, entity in ranked], entities)
+
+        # Different titles that score the same, too.
+        #
+        entities = results("Heat (1986)", "Heat (1995)")
+        self.assertEqual(self.titles("heat", entities),
+                         ["Heat (1986)", "Heat (1995)"])
+        self.assertEqual(self.titles("heat", entities[::-1]),
+                         ["Heat (1995)", "Heat (1986)"])
+
+    ##################################################################
+    #
+    def test_year_matches(self):
+        entities = results(("Solaris", 1972), ("Solaris", 2002),
+                           ("Solaris", 2003), "Solaris")
+        self.assertEqual(self.rank("Solaris 2002", entities),
+                         [(1.2, "Solaris"), (1.1, "Solaris"),
+                          (1.0, "Solaris"), (0.8, "Solaris")])
+        ranked = self.scraper.rank("Solaris 2002", entities)
+        self.assertEqual([entity for score, entity in ranked],
+                         [entities[1], entities[2], entities[3], entities[0]])
+
+        # A year in the title of a result, or of a file name, counts the
+        # same as one given on its own.
+        #
+        entities = results("Heat (1986)", "Heat (1995)")
+        self.assertEqual(self.rank("Heat.1995.DVDRip", entities),
+                         [(1.2, "Heat (1995)"), (0.8, "Heat (1986)")])
+        self.assertEqual(self.rank("Heat (1995)", entities),
+                         [(1.2, "Heat (1995)"), (0.8, "Heat (1986)")])
+
+        # Release dates differ from country to country, so the right
+        # title a year off beats another title from the right year.
+        #
+        entities = results(("Heat Wave", 1995), ("Heat", 1996))
+        self.assertEqual(self.rank("heat 1995", entities)[0], (1.1, "Heat"))
+
+    ##################################################################
+    #
+    def test_title_that_is_a_year(self):
+        entities = results(("1984", 1956), ("1984", 1984), "Nineteen")
+        self.assertEqual(self.rank("1984", entities),
+                         [(1.2, "1984"), (0.8, "1984"), (0.0, "Nineteen")])
+        self.assertEqual(self.titles("1984", results("Nineteen", "1984")),
+                         ["1984", "Nineteen"])
+
+    ##################################################################
+    #
+    def test_non_ascii_titles(self):
+        entities = results(u"Amelie", (u"Amélie", 2001),
+                           u"Le Fabuleux Destin d'Amélie Poulain")
+        best = (1.0, u"Amélie")
+
+        # The search string may be UTF-8 or unicode, in any case.
+        #
+        self.assertEqual(self.rank("Amélie", entities)[0], best)
+        self.assertEqual(self.rank(u"Amélie", entities)[0], best)
+        self.assertEqual(self.rank(u"AMÉLIE", entities)[0], best)
+        self.assertEqual(self.rank(u"Amélie 2001", entities)[0],
+                         (1.2, u"Amélie"))
+        self.assertEqual(self.rank("Amelie", entities)[0], (1.0, u"Amelie"))
+
+        entities = results(u"千と千尋の神隠し", u"千と千尋", u"Spirited Away")
+        self.assertEqual(self.titles(u"千と千尋", entities),
+                         [u"千と千尋", u"千と千尋の神隠し", u"Spirited Away"])
+        self.assertEqual(self.rank("千と千尋の神隠し", entities)[0],
+                         (1.0, u"千と千尋の神隠し"))
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of the Registry of scraper definitions: its manifest, marking
+the definitions we can not load as not supported, and scrape_cli.py's
+--scraper and --list-scrapers. Run them from the top of the source tree
+with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+#
+import scraper
+
+# The top of the source tree, where scrape_cli.py is.
+#
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A movie definition with settings, one for content we do not support,
+# and one that is not well formed.
+#
+MOVIE_XML = """<scraper name="Movies" content="movies" thumb="movies.png">
+<GetSettings dest="3">
+  <RegExp input="" output="&lt;settings&gt;&lt;setting label=&quot;Fanart&quot; type=&quot;bool&quot; id=&quot;fanart&quot; default=&quot;true&quot;&gt;&lt;/setting&gt;&lt;/settings&gt;" dest="3">
+    <expression></expression>
+  </RegExp>
+</GetSettings>
+<CreateSearchUrl dest="3">
+  <RegExp input="$$1" output="http://test/search/\\1" dest="3">
+    <expression noclean="1">(.*)</expression>
+  </RegExp>
+</CreateSearchUrl>
+</scraper>
+"""
+ALBUM_XML = """<scraper name="Albums" content="albums">
+<CreateAlbumSearchUrl dest="3">
+  <RegExp input="$$1" output="http://test/search/\\1" dest="3">
+    <expression noclean="1">(.*)</expression>
+  </RegExp>
+</CreateAlbumSearchUrl>
+</scraper>
+"""
+BROKEN_XML = """<scraper name="Broken" content="movies"><CreateSearchUrl"""
+
+##################################################################
+##################################################################
+#
+class ReadingRegistry(scraper.Registry):
+    """
+    A Registry that keeps the list of the definition files it reads.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, directory):
+        scraper.Registry.__init__(self, directory)
+        self.files_read = []
+
+    ##################################################################
+    #
+    def read(self, file_name):
+        self.files_read.append(file_name)
+        return scraper.Registry.read(self, file_name)
+
+##################################################################
+##################################################################
+#
+class TestRegistry(unittest.TestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, "video"))
+        os.mkdir(os.path.join(self.directory, "music"))
+        self.write("video/Movies.xml", MOVIE_XML)
+        self.write("music/albums.xml", ALBUM_XML)
+        self.write("video/broken.xml", BROKEN_XML)
+
+    ##################################################################
+    #
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    ##################################################################
+    #
+    def write(self, file_name, contents):
+        """
+        Write a file, ie: a definition, in our directory.
+        """
+        with open(os.path.join(self.directory, file_name), "w") as f:
+            f.write(contents)
+
+    ##################################################################
+    #
+    def registry(self):
+        """
+        Return a new ReadingRegistry of our directory.
+        """
+        return ReadingRegistry(self.directory)
+
+    ##################################################################
+    #
+    def test_entries(self):
+        registry = self.registry()
+        self.assertEqual([e["name"] for e in registry.entries()],
+                         ["albums", "broken", "movies"])
+        entry = registry.entry("Movies")
+        self.assertEqual(entry["file"], "video/Movies.xml")
+        self.assertEqual(entry["title"], "Movies")
+        self.assertEqual(entry["content"], "movies")
+        self.assertEqual(entry["thumb"], "movies.png")
+        self.assertEqual(entry["functions"], ["GetSettings", "CreateSearchUrl"])
+        self.assertEqual(entry["settings"][0],
+                         { "id" : "fanart", "label" : "Fanart",
+                           "type" : "bool", "default" : True })
+        self.assertTrue(entry["supported"])
+        self.assertEqual(registry.definition("movies"), MOVIE_XML)
+        self.assertRaises(KeyError, registry.entry, "nothing")
+        self.assertRaises(KeyError, registry.definition, "nothing")
+
+    ##################################################################
+    #
+    def test_unsupported_definitions_are_marked(self):
+        registry = self.registry()
+        albums = registry.entry("albums")
+        self.assertEqual(albums["content"], "albums")
+        self.assertEqual(albums["functions"], ["CreateAlbumSearchUrl"])
+        self.assertFalse(albums["supported"])
+        self.assertEqual(albums["settings"], [])
+
+        # One that is not well formed does not keep us from listing the
+        # rest.
+        #
+        broken = registry.entry("broken")
+        self.assertFalse(broken["supported"])
+        self.assertEqual(broken["content"], "")
+        self.assertEqual(broken["functions"], [])
+
+        self.assertEqual([e["name"] for e in registry.entries(
+                    supported = True)], ["movies"])
+        self.assertEqual([e["name"] for e in registry.entries(
+                    supported = False)], ["albums", "broken"])
+        self.assertEqual([e["name"] for e in registry.entries("albums")],
+                         ["albums"])
+        self.assertEqual(registry.entries("albums", supported = True), [])
+
+    ##################################################################
+    #
+    def test_manifest_is_read_instead_of_the_definitions(self):
+        self.registry().write_manifest()
+        with open(os.path.join(self.directory, "manifest.json")) as f:
+            manifest = json.load(f)
+        self.assertEqual([e["name"] for e in manifest],
+                         ["albums", "broken", "movies"])
+
+        registry = self.registry()
+        self.assertEqual(registry.entries(), manifest)
+        self.assertEqual(registry.files_read, [])
+        registry.definition("movies")
+        registry.definition("movies")
+        self.assertEqual(registry.files_read, ["video/Movies.xml"])
+
+    ##################################################################
+    #
+    def test_manifest_follows_the_directory(self):
+        self.registry().write_manifest()
+        os.remove(os.path.join(self.directory, "music", "albums.xml"))
+        self.write("video/new.xml", MOVIE_XML.replace('"Movies"', '"New"'))
+
+        # Definitions added since the manifest was written are read, and
+        # those that are gone are dropped.
+        #
+        registry = self.registry()
+        self.assertEqual([e["name"] for e in registry.entries()],
+                         ["broken", "movies", "new"])
+        self.assertEqual(registry.entry("new")["title"], "New")
+        self.assertEqual(registry.files_read, ["video/new.xml"])
+
+    ##################################################################
+    #
+    def test_changed_definition_is_refreshed_when_read(self):
+        self.registry().write_manifest()
+        self.write("video/Movies.xml", MOVIE_XML.replace('"Movies"',
+                                                         '"Films"'))
+        registry = self.registry()
+        self.assertEqual(registry.entry("movies")["title"], "Movies")
+        xml = registry.definition("movies")
+        self.assertTrue('"Films"' in xml)
+        self.assertEqual(registry.entry("movies")["title"], "Films")
+
+    ##################################################################
+    #
+    def test_unreadable_manifest(self):
+        self.write("manifest.json", "[{ not json")
+        registry = self.registry()
+        self.assertEqual([e["name"] for e in registry.entries()],
+                         ["albums", "broken", "movies"])
+        self.assertEqual(sorted(registry.files_read),
+                         ["music/albums.xml", "video/Movies.xml",
+                          "video/broken.xml"])
+
+##################################################################
+##################################################################
+#
+class TestShippedDefinitions(unittest.TestCase):
+
+    ##################################################################
+    #
+    def test_manifest_is_up_to_date(self):
+        registry = ReadingRegistry(scraper.registry.directory)
+        self.assertEqual(sorted(e["name"] for e in registry.entries()),
+                         sorted(registry.files()))
+        self.assertEqual(registry.files_read, [])
+
+    ##################################################################
+    #
+    def test_music_is_not_supported(self):
+        self.assertTrue(len(scraper.registry.entries("albums")) > 0)
+        self.assertEqual(scraper.registry.entries("albums", supported = True),
+                         [])
+        self.assertTrue("allmusic" not in
+                        [e["name"] for e in scraper.Scraper.definitions()])
+        self.assertRaises(scraper.BadXML, scraper.Scraper.by_name, "allmusic")
+        self.assertRaises(KeyError, scraper.Scraper.by_name, "nothing")
+        self.assertEqual(scraper.Scraper.by_name("IMDb").parser.content,
+                         "movies")
+
+##################################################################
+##################################################################
+#
+class TestScraperOption(unittest.TestCase):
+
+    ##################################################################
+    #
+    def scrape_cli(self, *args):
+        """
+        Run scrape_cli.py with the given arguments and return its exit
+        status, standard output and standard error.
+        """
+        process = subprocess.Popen([sys.executable, "scrape_cli.py"] +
+                                   list(args), cwd = TOP,
+                                   stdin = subprocess.PIPE,
+                                   stdout = subprocess.PIPE,
+                                   stderr = subprocess.PIPE)
+        stdout, stderr = process.communicate("")
+        return process.returncode, stdout, stderr
+
+    ##################################################################
+    #
+    def test_unknown_scraper_is_a_usage_error(self):
+        status, stdout, stderr = self.scrape_cli("--scraper", "nothing",
+                                                 "batch")
+        self.assertEqual(status, 2)
+        self.assertTrue(stderr.startswith("Usage:"))
+        self.assertTrue("'nothing' is not a file or the name of one of our "
+                        "scraper definitions" in stderr, stderr)
+
+    ##################################################################
+    #
+    def test_unsupported_scraper_is_a_usage_error(self):
+        status, stdout, stderr = self.scrape_cli("--scraper", "allmusic",
+                                                 "batch")
+        self.assertEqual(status, 2)
+        self.assertTrue("The 'allmusic' definition is for 'albums', which is "
+                        "not supported." in stderr, stderr)
+
+    ##################################################################
+    #
+    def test_list_scrapers(self):
+        status, stdout, stderr = self.scrape_cli("--list-scrapers")
+        self.assertEqual(status, 0)
+        names = [line.split()[0] for line in stdout.splitlines()]
+        self.assertTrue("imdb" in names)
+        self.assertTrue("allmusic" not in names)
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of Template: rendering an input, output or expression string
+must give what the str.replace() passes it replaced gave. Run them from
+the top of the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import re
+import unittest
+
+#
+import scraper
+from scraper.scrap import NUM_BUFFERS, setting_re
+
+SETTINGS_XML = '<settings>' \
+    '<setting id="lang" type="labelenum" values="de|en" default="de"/>' \
+    '<setting id="fanart" type="bool" default="true"/>' \
+    '</settings>'
+
+####################################################################
+#
+def old_replace(dest, buffers, settings):
+    """
+    Return the given string with its buffer and setting references
+    replaced the way replace_buffers() did before we had Templates: a
+    str.replace() of every buffer, '$$20' down to '$$0', then of the
+    escaped newline, then a substitution of the settings.
+
+    Arguments:
+    - `dest`: The string.
+    - `buffers`: The list of the contents of buffers 1, 2, ...
+    - `settings`: The Settings.
+    """
+    if isinstance(dest, unicode):
+        dest = dest.encode('ascii', 'xmlcharrefreplace')
+    params = [""] + list(buffers) + [""] * (NUM_BUFFERS - len(buffers))
+    for i in range(NUM_BUFFERS, -1, -1):
+        buff = params[i]
+        if isinstance(buff, unicode):
+            buff = buff.encode('ascii', 'xmlcharrefreplace')
+        dest = dest.replace("$$%d" % i, buff)
+    dest = dest.replace(r'\\n', '\n')
+    return setting_re.sub(lambda m: settings.values[m.group(1)], dest)
+
+####################################################################
+#
+def render(dest, buffers, settings):
+    """
+    Return the given string rendered as a Template, as ASCII with XML
+    character references like old_replace() returns it.
+
+    Arguments:
+    - `dest`: The string.
+    - `buffers`: The list of the contents of buffers 1, 2, ...
+    - `settings`: The Settings.
+    """
+    store = scraper.BufferStore()
+    for i, data in enumerate(buffers):
+        store.set(i + 1, data)
+    result = scraper.Template(dest).render(store, settings)
+    if isinstance(result, unicode):
+        result = result.encode('ascii', 'xmlcharrefreplace')
+    return result
+
+##################################################################
+##################################################################
+#
+class TestTemplate(unittest.TestCase):
+    """
+    Each case is rendered as a Template and compared with what the old
+    str.replace() passes made of it.
+    """
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.settings = scraper.Settings(SETTINGS_XML)
+        self.settings.set_value("fanart", "false")
+
+    ##################################################################
+    #
+    def check(self, dest, buffers, expected = None):
+        """
+        Check that the given string renders to the same thing as it did,
+        and, if we are given it, to what we expect. Return what it
+        rendered to.
+        """
+        old = old_replace(dest, buffers, self.settings)
+        new = render(dest, buffers, self.settings)
+        self.assertEqual(new, old, "%r: %r, not %r" % (dest, new, old))
+        if expected is not None:
+            self.assertEqual(new, expected)
+        return new
+
+    ##################################################################
+    #
+    def test_literal(self):
+        self.check("<details></details>", [], "<details></details>")
+        self.check("", ["one"], "")
+        self.check(u"caf\xe9 $$1", [u"na\xefve"], "caf&#233; na&#239;ve")
+
+    ##################################################################
+    #
+    def test_two_digit_buffers(self):
+        # '$$10' is buffer 10, not buffer 1 followed by a '0'.
+        #
+        buffers = ["one"] + [""] * 8 + ["ten", "eleven", "twelve"]
+        self.check("$$10", buffers, "ten")
+        self.check("$$1$$10$$11$$12$$1", buffers,
+                   "oneteneleventwelveone")
+        self.check("$$100", buffers, "ten0")
+        self.check("$$20$$21", buffers, "1")
+
+        # There are only 20 buffers: '$$21' is buffer 2 and a '1'.
+        #
+        self.check("$$21", ["a", "b"], "b1")
+
+    ##################################################################
+    #
+    def test_empty_buffers(self):
+        self.check("[$$1][$$5][$$20]", [], "[][][]")
+        self.check("[$$1]", [""], "[]")
+        self.check("$$10", ["one"], "")
+
+        # There is no buffer 0, and it has always been nothing.
+        #
+        self.check("[$$0]", ["one"], "[]")
+        self.check("$$01", ["one"], "1")
+
+    ##################################################################
+    #
+    def test_escaped_markers(self):
+        # A '\\n' (backslash, backslash, n) is a newline.
+        #
+        self.check(r"a\\nb", [], "a\nb")
+        self.check(r"$$1\\n$$2", ["one", "two"], "one\ntwo")
+        self.check(r"\\n\\n", [], "\n\n")
+
+        # A single backslash, or one before anything else, is left alone
+        # for the expression or output pattern it is in.
+        #
+        self.check(r"\n\1\\1\\\n", ["one"], r"\n\1\\1" + "\\\n")
+
+        # Dollar signs that do not make up a reference are literal.
+        #
+        self.check("$$$1$", ["one"], "$one$")
+        self.check("$$x $ $INFO $INFO[] $INFO[lang", [],
+                   "$$x $ $INFO $INFO[] $INFO[lang")
+
+    ##################################################################
+    #
+    def test_settings(self):
+        self.check("$INFO[lang]/$INFO[lang]", [], "de/de")
+        self.check("$$1$INFO[lang]$$2", ["a", "b"], "adeb")
+
+        # A setting that is not there, or that is not a string, never
+        # could be put in a string.
+        #
+        for dest, error in (("$INFO[missing]", KeyError),
+                            ("$INFO[fanart]", TypeError)):
+            self.assertRaises(error, old_replace, dest, [], self.settings)
+            self.assertRaises(error, render, dest, [], self.settings)
+
+    ##################################################################
+    #
+    def test_multi_digit_backreferences(self):
+        # An output's '\10' is group 10 of its expression's match, as
+        # Match.expand() has it, once the buffers are replaced.
+        #
+        expression = "".join("(%s)" % c for c in "abcdefghijkl")
+        page = "abcdefghijkl"
+        output = r"\1,\10,\12,\1\0,$$2"
+        parser = scraper.ScraperParser(
+            '<scraper name="test" content="movies"><GetDetails dest="3">'
+            '<RegExp input="$$1" output="%s" dest="3">'
+            '<expression>%s</expression></RegExp></GetDetails></scraper>' % \
+                (output, expression))
+        old = re.search(expression, page).expand(
+            old_replace(output, [page, "two"], self.settings))
+        self.assertEqual(old, "a,j,l,a\x00,two")
+        self.assertEqual(parser.parse("GetDetails", self.settings,
+                                      [page, "two"]), old)
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# File: $Id$
+#
+"""
+Tests of the Tracer of a ScraperParser: its debug events go to its
+listeners and to its logger only when someone wants them. Run them from
+the top of the source tree with:
+
+    python -m unittest discover tests
+"""
+
+# system imports
+#
+import logging
+import unittest
+
+#
+import scraper
+
+# A definition with four steps, one of which is only run if a setting
+# says so, that make four matches of our page.
+#
+DEFINITION_XML = """<scraper name="traced" content="movies">
+<GetDetails dest="3">
+  <RegExp input="$$5" output="&lt;details&gt;\\1&lt;/details&gt;" dest="3">
+    <RegExp input="$$1" output="&lt;genre&gt;\\1&lt;/genre&gt;" dest="5">
+      <expression repeat="yes">genre=([^;]*);</expression>
+    </RegExp>
+    <RegExp input="$$1" output="&lt;title&gt;\\1&lt;/title&gt;" dest="5+">
+      <expression>title=([^;]*);</expression>
+    </RegExp>
+    <RegExp input="$$1" output="&lt;id&gt;\\1&lt;/id&gt;" dest="5+" conditional="ids">
+      <expression>id=([^;]*);</expression>
+    </RegExp>
+    <expression noclean="1">(.*)</expression>
+  </RegExp>
+</GetDetails>
+</scraper>
+"""
+PAGE = "title=The Matrix;genre=Action;genre=Sci-Fi;id=tt0133093;"
+DETAILS = "<details><genre>Action</genre><genre>Sci-Fi</genre>" \
+    "<title>The Matrix</title></details>"
+
+##################################################################
+##################################################################
+#
+class ListHandler(logging.Handler):
+    """
+    A logging handler that keeps the messages of the records it is
+    given.
+    """
+
+    ##################################################################
+    #
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    ##################################################################
+    #
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+##################################################################
+##################################################################
+#
+class TestTracer(unittest.TestCase):
+
+    ##################################################################
+    #
+    def setUp(self):
+        self.logger = logging.getLogger("test_tracer")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = ListHandler()
+        self.logger.addHandler(self.handler)
+        self.parser = scraper.ScraperParser(DEFINITION_XML, self.logger)
+        self.settings = scraper.Settings(
+            '<settings><setting label="Ids" type="bool" id="ids" '
+            'default="false"/></settings>')
+
+    ##################################################################
+    #
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    ##################################################################
+    #
+    def run_parser(self, runs = 3):
+        """
+        Run our definition's <GetDetails> over our page the given number
+        of times.
+        """
+        for i in range(runs):
+            self.assertEqual(self.parser.parse("GetDetails", self.settings,
+                                               [PAGE]),
+                             DETAILS)
+
+    ##################################################################
+    #
+    def test_quiet_when_no_one_listens(self):
+        self.run_parser()
+        self.assertFalse(self.parser.tracer.enabled)
+        self.assertEqual(self.handler.messages, [])
+
+    ##################################################################
+    #
+    def test_listeners(self):
+        events = []
+        listener = lambda name, fields: events.append((name, fields))
+        self.parser.tracer.add_listener(listener)
+        self.assertTrue(self.parser.tracer.enabled)
+        self.run_parser(1)
+
+        names = [name for name, fields in events]
+        self.assertEqual(names[1], "parse.enter")
+        self.assertEqual(names[-1], "parse.leave")
+        self.assertEqual(names.count("regexp.step"), 4)
+        self.assertEqual(names.count("expression.match"), 4)
+        self.assertEqual(events[-1][1]["tag"], "GetDetails")
+        self.assertEqual(events[-1][1]["result"], DETAILS)
+
+        # Nothing is written to the logger, which does not want DEBUG
+        # messages, and once the listener goes we are quiet again.
+        #
+        self.assertEqual(self.handler.messages, [])
+        self.parser.tracer.remove_listener(listener)
+        self.assertFalse(self.parser.tracer.enabled)
+        del events[:]
+        self.run_parser(1)
+        self.assertEqual(events, [])
+
+    ##################################################################
+    #
+    def test_debug_logging(self):
+        # The logger is only asked at the start of each function.
+        #
+        self.logger.setLevel(logging.DEBUG)
+        self.run_parser(1)
+        self.assertTrue(self.parser.tracer.enabled)
+        messages = self.handler.messages
+        self.assertTrue(any(message.startswith("parse: Parsing tag "
+                                               "<GetDetails>")
+                            for message in messages))
+        self.assertTrue(any(DETAILS in message for message in messages))
+
+        self.logger.setLevel(logging.INFO)
+        del messages[:]
+        self.run_parser(1)
+        self.assertFalse(self.parser.tracer.enabled)
+        self.assertEqual(messages, [])
+
+############################################################################
+############################################################################
+#
+if __name__ == "__main__":
+    unittest.main()